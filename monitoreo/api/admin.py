@@ -1,3 +1,15 @@
 from django.contrib import admin
+from .models import ClaveIngesta
 
-# Register your models here.
+
+@admin.register(ClaveIngesta)
+class ClaveIngestaAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'prefijo', 'organizacion', 'activa', 'created_at')
+    list_filter = ('activa', 'organizacion')
+    search_fields = ('nombre', 'prefijo')
+    readonly_fields = ('prefijo', 'created_at')
+
+    def has_add_permission(self, request):
+        # Las claves se crean con `manage.py crear_clave_ingesta` para poder
+        # mostrarlas una única vez
+        return False
@@ -0,0 +1,44 @@
+from functools import wraps
+
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+
+from .models import ClaveIngesta
+
+
+def _clave_de_cabecera(request):
+    cabecera = request.META.get('HTTP_AUTHORIZATION', '')
+    tipo, _, clave = cabecera.partition(' ')
+    if tipo.lower() != 'token':
+        return None
+    return clave.strip()
+
+
+def api_login_required(view_func):
+    """
+    Acepta una clave de ingesta ("Authorization: Token <clave>") o una sesión
+    iniciada. Responde 401 en JSON en vez de redirigir al login.
+
+    Las peticiones con clave no llevan cookies, así que no necesitan CSRF; a
+    las autenticadas por sesión se les aplica la validación CSRF normal.
+    """
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        clave = _clave_de_cabecera(request)
+        if clave is not None:
+            request.clave_ingesta = ClaveIngesta.autenticar(clave)
+            if request.clave_ingesta is None:
+                return JsonResponse({"ok": False, "message": "Clave inválida."}, status=401)
+            return view_func(request, *args, **kwargs)
+
+        request.clave_ingesta = None
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return JsonResponse({"ok": False, "message": "Autenticación requerida."}, status=401)
+        rechazo = CsrfViewMiddleware(lambda r: None).process_view(request, None, (), {})
+        if rechazo is not None:
+            return rechazo
+        return view_func(request, *args, **kwargs)
+
+    _wrapped_view.csrf_exempt = True
+    return _wrapped_view
@@ -0,0 +1,228 @@
+import math
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from dispositivos.ingesta import organizaciones_de_dispositivos
+
+# Token bucket de varias claves en un solo paso atómico de Redis. KEYS son
+# los buckets; ARGV, por bucket, costo, tasa y ráfaga, y al final '1' para
+# solo comprobar sin descontar. Devuelve la espera en segundos como texto
+# ('0' si alcanza): Redis truncaría un número de Lua.
+SCRIPT_REDIS = """
+local t = redis.call('TIME')
+local ahora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local espera = 0
+local fichas = {}
+for i, clave in ipairs(KEYS) do
+    local costo = tonumber(ARGV[3 * i - 2])
+    local tasa = tonumber(ARGV[3 * i - 1])
+    local rafaga = tonumber(ARGV[3 * i])
+    local estado = redis.call('HMGET', clave, 'f', 't')
+    local f = tonumber(estado[1]) or rafaga
+    local instante = tonumber(estado[2]) or ahora
+    f = math.min(rafaga, f + (ahora - instante) * tasa)
+    local necesarias = math.min(costo, rafaga)
+    if f < necesarias then
+        espera = math.max(espera, (necesarias - f) / tasa)
+    end
+    fichas[i] = f - costo
+end
+if espera > 0 or ARGV[3 * #KEYS + 1] == '1' then
+    return tostring(espera)
+end
+for i, clave in ipairs(KEYS) do
+    local tasa = tonumber(ARGV[3 * i - 1])
+    local rafaga = tonumber(ARGV[3 * i])
+    redis.call('HSET', clave, 'f', tostring(fichas[i]), 't', tostring(ahora))
+    redis.call('EXPIRE', clave, math.ceil((rafaga - fichas[i]) / tasa) + 1)
+end
+return '0'
+"""
+
+_script_redis = None
+
+
+def contar_por_dispositivo(lecturas):
+    """Cuenta lecturas por dispositivo sin validar ni consultar la base de datos."""
+    conteo = Counter()
+    for dato in lecturas:
+        if not isinstance(dato, dict):
+            continue
+        try:
+            conteo[int(dato.get('dispositivo'))] += 1
+        except (TypeError, ValueError):
+            continue
+    return conteo
+
+
+def sujeto_organizacion(organizacion_id):
+    return f'org:{organizacion_id}'
+
+
+def costos_de_lote(conteo, organizacion, total):
+    """
+    Resuelve con una consulta a quién se cobra el lote. Devuelve
+    ({sujeto: lecturas}, {dispositivo_id: lecturas}): los buckets de
+    dispositivo solo de los existentes de `organizacion`, para que un cliente
+    no pueda vaciar los de dispositivos ajenos nombrándolos en lecturas que
+    igual se rechazan. Con organización, ella paga el lote completo (`total`);
+    sin ella (claves globales y superusuarios) cada lectura la paga la
+    organización de su dispositivo.
+    """
+    organizaciones = organizaciones_de_dispositivos(conteo) if conteo else {}
+    if organizacion is not None:
+        propios = Counter({
+            dispositivo_id: cantidad
+            for dispositivo_id, cantidad in conteo.items()
+            if organizaciones.get(dispositivo_id) == organizacion.id
+        })
+        return {sujeto_organizacion(organizacion.id): total}, propios
+
+    propios = Counter({
+        dispositivo_id: cantidad
+        for dispositivo_id, cantidad in conteo.items()
+        if dispositivo_id in organizaciones
+    })
+    por_organizacion = Counter()
+    for dispositivo_id, cantidad in propios.items():
+        if organizaciones[dispositivo_id] is not None:
+            por_organizacion[sujeto_organizacion(organizaciones[dispositivo_id])] += cantidad
+    return por_organizacion, propios
+
+
+def _buckets(por_organizacion, conteo):
+    limite_org = settings.INGESTA_LIMITE_ORGANIZACION
+    limite_disp = settings.INGESTA_LIMITE_DISPOSITIVO
+    buckets = {
+        f'ingesta:{sujeto}': (costo, limite_org['TASA'], limite_org['RAFAGA'])
+        for sujeto, costo in por_organizacion.items()
+    }
+    for dispositivo_id, costo in conteo.items():
+        buckets[f'ingesta:disp:{dispositivo_id}'] = (costo, limite_disp['TASA'], limite_disp['RAFAGA'])
+    return buckets
+
+
+def _usa_redis():
+    return settings.CACHES['default']['BACKEND'].endswith('RedisCache')
+
+
+def _consumir_redis(buckets, descontar=True):
+    global _script_redis
+    cliente = cache._cache.get_client(write=True)
+    if _script_redis is None:
+        _script_redis = cliente.register_script(SCRIPT_REDIS)
+    argumentos = [valor for bucket in buckets.values() for valor in bucket] + ['0' if descontar else '1']
+    claves = [cache.make_key(clave) for clave in buckets]
+    return float(_script_redis(keys=claves, args=argumentos, client=cliente))
+
+
+def _consumir_cache(buckets, descontar=True):
+    ahora = time.time()
+    estados = cache.get_many(list(buckets))
+
+    nuevos = {}
+    espera = 0
+    for clave, (costo, tasa, rafaga) in buckets.items():
+        fichas, instante = estados.get(clave, (rafaga, ahora))
+        fichas = min(rafaga, fichas + (ahora - instante) * tasa)
+        necesarias = min(costo, rafaga)
+        if fichas < necesarias:
+            espera = max(espera, (necesarias - fichas) / tasa)
+        nuevos[clave] = (fichas - costo, ahora)
+
+    if espera or not descontar:
+        return espera
+
+    # Expira cuando el bucket volvería a estar lleno
+    timeout = max(
+        math.ceil((rafaga - nuevos[clave][0]) / tasa) + 1
+        for clave, (_, tasa, rafaga) in buckets.items()
+    )
+    cache.set_many(nuevos, timeout=timeout)
+    return 0
+
+
+def _consumir(buckets, descontar=True):
+    if _usa_redis():
+        return _consumir_redis(buckets, descontar)
+    return _consumir_cache(buckets, descontar)
+
+
+def comprobar_organizacion(organizacion, total):
+    """
+    Comprobación previa, solo contra la caché: los segundos a esperar si a
+    la organización no le alcanzan las fichas para `total` lecturas, sin
+    descontar nada. Un cliente limitado recibe el 429 sin costar consultas a
+    la base de datos. Sin organización no hay un bucket que mirar antes de
+    resolver los dispositivos y devuelve 0.
+    """
+    if not settings.INGESTA_LIMITE_ACTIVO or organizacion is None or not total:
+        return 0
+    return _consumir(_buckets({sujeto_organizacion(organizacion.id): total}, {}), descontar=False)
+
+
+def consumir(por_organizacion, conteo):
+    """
+    Token bucket por organización y por dispositivo, guardado en la caché
+    compartida para que todos los workers vean el mismo estado. Los costos
+    son los de costos_de_lote.
+
+    Si todos los buckets tienen fichas, las descuenta y devuelve 0; si no, no
+    descuenta nada y devuelve los segundos a esperar. Un lote mayor que la
+    ráfaga se acepta con el bucket lleno y lo deja en negativo, así la tasa
+    media se respeta igual. Con Redis se comprueba y descuenta en un script
+    atómico; con la caché en disco no es atómico entre workers y en una
+    carrera pueden pasar algunas lecturas de más.
+    """
+    if not settings.INGESTA_LIMITE_ACTIVO:
+        return 0
+    buckets = _buckets(por_organizacion, conteo)
+    if not buckets:
+        return 0
+    return _consumir(buckets)
+
+
+def limitar_lote(conteo, organizacion, total):
+    """
+    Cobra un lote: primero comprueba la organización solo con la caché y
+    recién si alcanza resuelve los dispositivos y descuenta. Devuelve 0 o
+    los segundos a esperar.
+    """
+    if not settings.INGESTA_LIMITE_ACTIVO:
+        return 0
+    espera = comprobar_organizacion(organizacion, total)
+    if espera:
+        return espera
+    return consumir(*costos_de_lote(conteo, organizacion, total))
+
+
+def _esperar(funcion, limite):
+    while True:
+        espera = funcion()
+        if not espera:
+            return True
+        if time.monotonic() + espera > limite:
+            return False
+        time.sleep(espera)
+
+
+def esperar_y_consumir(conteo, organizacion, max_espera, total):
+    """
+    Variante bloqueante de limitar_lote para la ingesta por streaming: espera
+    hasta que haya fichas (contrapresión sobre el cliente) o hasta
+    `max_espera` segundos. Devuelve True si consumió las fichas.
+    """
+    if not settings.INGESTA_LIMITE_ACTIVO:
+        return True
+    limite = time.monotonic() + max_espera
+    if not _esperar(lambda: comprobar_organizacion(organizacion, total), limite):
+        return False
+    costos = costos_de_lote(conteo, organizacion, total)
+    return _esperar(lambda: consumir(*costos), limite)
+
+
+def segundos_retry_after(espera):
+    return str(max(1, math.ceil(espera)))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import ClaveIngesta
+from usuarios.models import Organizacion
+
+
+class Command(BaseCommand):
+    help = 'Crea una clave de API para ingesta de mediciones y la muestra una sola vez'
+
+    def add_arguments(self, parser):
+        parser.add_argument('nombre', help='Nombre descriptivo, ej: gateway-planta-norte')
+        parser.add_argument('--organizacion', help='Nombre de la organización (omitir para una clave global)')
+
+    def handle(self, *args, **options):
+        organizacion = None
+        if options['organizacion']:
+            try:
+                organizacion = Organizacion.objects.get(nombre=options['organizacion'])
+            except Organizacion.DoesNotExist:
+                raise CommandError(f"No existe la organización '{options['organizacion']}'")
+
+        instancia, clave = ClaveIngesta.generar(options['nombre'], organizacion=organizacion)
+        self.stdout.write(self.style.SUCCESS(f'Clave creada: {instancia}'))
+        self.stdout.write('Guárdela ahora, no se podrá volver a mostrar:')
+        self.stdout.write(clave)
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('usuarios', '0003_organizacion_perfil_organizacion_perfil_rol'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaveIngesta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100)),
+                ('prefijo', models.CharField(db_index=True, editable=False, max_length=8)),
+                ('clave_hash', models.CharField(editable=False, max_length=64, unique=True)),
+                ('activa', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('organizacion', models.ForeignKey(blank=True, help_text='Vacío: la clave puede escribir en dispositivos de cualquier organización', null=True, on_delete=django.db.models.deletion.CASCADE, to='usuarios.organizacion')),
+            ],
+            options={
+                'verbose_name': 'Clave de ingesta',
+                'verbose_name_plural': 'Claves de ingesta',
+            },
+        ),
+    ]
@@ -1,3 +1,55 @@
+import hashlib
+import secrets
+
 from django.db import models
+from usuarios.models import Organizacion
+
+
+class ClaveIngesta(models.Model):
+    """
+    Clave de API para gateways y servicios de ingesta. Permite autenticar sin
+    sesión (cabecera "Authorization: Token <clave>"); solo se guarda el hash.
+    """
+    nombre = models.CharField(max_length=100)
+    organizacion = models.ForeignKey(
+        Organizacion, on_delete=models.CASCADE, null=True, blank=True,
+        help_text="Vacío: la clave puede escribir en dispositivos de cualquier organización"
+    )
+    prefijo = models.CharField(max_length=8, db_index=True, editable=False)
+    clave_hash = models.CharField(max_length=64, unique=True, editable=False)
+    activa = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Clave de ingesta"
+        verbose_name_plural = "Claves de ingesta"
+
+    def __str__(self):
+        return f"{self.nombre} ({self.prefijo}…)"
+
+    @staticmethod
+    def calcular_hash(clave):
+        return hashlib.sha256(clave.encode()).hexdigest()
+
+    @classmethod
+    def generar(cls, nombre, organizacion=None):
+        """Crea una clave nueva y devuelve (instancia, clave en claro)."""
+        clave = secrets.token_urlsafe(32)
+        instancia = cls.objects.create(
+            nombre=nombre,
+            organizacion=organizacion,
+            prefijo=clave[:8],
+            clave_hash=cls.calcular_hash(clave),
+        )
+        return instancia, clave
 
-# Create your models here.
+    @classmethod
+    def autenticar(cls, clave):
+        """Devuelve la ClaveIngesta activa que corresponde a `clave`, o None."""
+        if not clave:
+            return None
+        return (
+            cls.objects.select_related('organizacion')
+            .filter(clave_hash=cls.calcular_hash(clave), activa=True)
+            .first()
+        )
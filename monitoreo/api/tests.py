@@ -1,3 +1,277 @@
-from django.test import TestCase
+import json
+from collections import Counter
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+
+from dispositivos.ingesta import MAX_LECTURAS_POR_LOTE
+from dispositivos.models import Dispositivo, Medicion, Zona
+from usuarios.models import Organizacion, Perfil
+
+from .limites import comprobar_organizacion, consumir, segundos_retry_after
+from .models import ClaveIngesta
+
+CACHE_LOCAL = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+SIN_EXTRAS = dict(
+    CACHES=CACHE_LOCAL, INGESTA_LIMITE_ACTIVO=False, INGESTA_BUFFER_ACTIVO=False,
+    ALERTAS_ACTIVAS=False, ANOMALIAS_ACTIVAS=False,
+)
+LIMITES = dict(
+    CACHES=CACHE_LOCAL,
+    INGESTA_LIMITE_ACTIVO=True,
+    INGESTA_LIMITE_DISPOSITIVO={'TASA': 10, 'RAFAGA': 20},
+    INGESTA_LIMITE_ORGANIZACION={'TASA': 1, 'RAFAGA': 50},
+)
+
+
+class DatosIngestaMixin:
+    """Dos organizaciones con un dispositivo cada una y un cliente de la primera con sesión."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizacion = Organizacion.objects.create(nombre='Propia')
+        cls.ajena = Organizacion.objects.create(nombre='Ajena')
+        cls.zona = Zona.objects.create(nombre='Z1', organizacion=cls.organizacion)
+        cls.propio = Dispositivo.objects.create(nombre='Propio', zona=cls.zona)
+        cls.ajeno = Dispositivo.objects.create(
+            nombre='Ajeno', zona=Zona.objects.create(nombre='Z2', organizacion=cls.ajena)
+        )
+        usuario = User.objects.create_user('cliente', password='clave')
+        Perfil.objects.create(user=usuario, organizacion=cls.organizacion, rol='cliente_admin')
+
+    def setUp(self):
+        self.client.login(username='cliente', password='clave')
+
+    def enviar(self, lecturas, **extra):
+        return self.client.post(
+            '/api/mediciones/lote/', json.dumps(lecturas), content_type='application/json', **extra
+        )
+
+
+@override_settings(**SIN_EXTRAS)
+class IngestaLoteTests(DatosIngestaMixin, TestCase):
+
+    def test_guarda_y_reporta_errores_por_fila(self):
+        respuesta = self.enviar([
+            {'dispositivo': self.propio.id, 'consumo': 12.345},
+            {'dispositivo': self.propio.id, 'consumo': -1},
+            {'dispositivo': self.ajeno.id, 'consumo': 1},
+            {'dispositivo': 999999, 'consumo': 1},
+            {'dispositivo': 'x', 'consumo': 1},
+            'no es un objeto',
+        ])
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.json()
+        self.assertFalse(datos['ok'])
+        self.assertEqual((datos['recibidas'], datos['creadas']), (6, 1))
+        self.assertEqual([e['indice'] for e in datos['errores']], [1, 2, 3, 4, 5])
+        # Un dispositivo ajeno se informa igual que uno inexistente
+        self.assertEqual(datos['errores'][1]['error'], datos['errores'][2]['error'])
+        medicion = Medicion.objects.get()
+        self.assertEqual((medicion.dispositivo_id, medicion.consumo), (self.propio.id, 12.35))
+        self.assertEqual(medicion.organizacion_id, self.organizacion.id)
+
+    def test_lote_sin_errores(self):
+        datos = self.enviar([{'dispositivo': self.propio.id, 'consumo': c} for c in (1, 2, 3)]).json()
+        self.assertTrue(datos['ok'])
+        self.assertEqual(datos['creadas'], 3)
+
+    def test_rechaza_cuerpos_invalidos(self):
+        respuesta = self.client.post('/api/mediciones/lote/', '{', content_type='application/json')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(self.enviar({'dispositivo': self.propio.id}).status_code, 400)
+        respuesta = self.enviar([{'dispositivo': self.propio.id, 'consumo': 1}] * (MAX_LECTURAS_POR_LOTE + 1))
+        self.assertEqual(respuesta.status_code, 413)
+        self.assertFalse(Medicion.objects.exists())
+
+    def test_solo_post(self):
+        self.assertEqual(self.client.get('/api/mediciones/lote/').status_code, 405)
+
+    def test_requiere_autenticacion(self):
+        self.client.logout()
+        respuesta = self.enviar([])
+        self.assertEqual(respuesta.status_code, 401)
+        self.assertFalse(respuesta.json()['ok'])
+
+    def test_usuario_sin_organizacion(self):
+        User.objects.create_user('suelto', password='clave')
+        self.client.login(username='suelto', password='clave')
+        self.assertEqual(self.enviar([]).status_code, 403)
+
+    def test_sesion_exige_csrf(self):
+        cliente = Client(enforce_csrf_checks=True)
+        cliente.login(username='cliente', password='clave')
+        respuesta = cliente.post('/api/mediciones/lote/', '[]', content_type='application/json')
+        self.assertEqual(respuesta.status_code, 403)
+
+    def test_clave_de_ingesta(self):
+        self.client.logout()
+        _, clave = ClaveIngesta.generar('gateway', self.organizacion)
+        lecturas = [{'dispositivo': self.propio.id, 'consumo': 1}, {'dispositivo': self.ajeno.id, 'consumo': 1}]
+        datos = self.enviar(lecturas, HTTP_AUTHORIZATION=f'Token {clave}').json()
+        self.assertEqual(datos['creadas'], 1)
+
+        # Una clave sin organización escribe en cualquiera
+        _, global_ = ClaveIngesta.generar('global')
+        self.assertEqual(self.enviar(lecturas, HTTP_AUTHORIZATION=f'Token {global_}').json()['creadas'], 2)
+
+        self.assertEqual(self.enviar(lecturas, HTTP_AUTHORIZATION='Token otra').status_code, 401)
+        ClaveIngesta.objects.update(activa=False)
+        self.assertEqual(self.enviar(lecturas, HTTP_AUTHORIZATION=f'Token {clave}').status_code, 401)
+
+
+@override_settings(**SIN_EXTRAS)
+class IngestaFlujoTests(DatosIngestaMixin, TestCase):
+
+    def enviar_flujo(self, cuerpo, content_type='application/x-ndjson'):
+        respuesta = self.client.post('/api/mediciones/flujo/', cuerpo, content_type=content_type)
+        if not respuesta.streaming:
+            return respuesta, None
+        return respuesta, [json.loads(linea) for linea in b''.join(respuesta.streaming_content).splitlines()]
+
+    def test_ndjson_con_progreso_por_chunk(self):
+        lineas = [json.dumps({'dispositivo': self.propio.id, 'consumo': i + 1}) for i in range(2500)]
+        lineas[10] = '{roto'
+        respuesta, resumenes = self.enviar_flujo('\n'.join(lineas) + '\n')
+        self.assertEqual(respuesta['Content-Type'], 'application/x-ndjson')
+        # Un resumen por chunk de 1000 filas y uno final
+        self.assertEqual([r['procesadas'] for r in resumenes], [1000, 2000, 2500, 2500])
+        self.assertEqual(resumenes[0]['errores'], [{'indice': 10, 'error': 'JSON inválido.'}])
+        self.assertEqual(resumenes[-1], {
+            'fin': True, 'procesadas': 2500, 'creadas': 2499, 'duplicadas': 0, 'total_errores': 1,
+        })
+        self.assertEqual(Medicion.objects.count(), 2499)
+
+    def test_csv(self):
+        cuerpo = (
+            f'dispositivo,consumo,secuencia\n{self.propio.id},1.5,1\n{self.ajeno.id},2,2\n'
+            f'\n{self.propio.id},x,3\n'
+        )
+        _, resumenes = self.enviar_flujo(cuerpo, 'text/csv')
+        self.assertEqual(resumenes[-1]['creadas'], 1)
+        self.assertEqual([e['indice'] for e in resumenes[0]['errores']], [1, 2])
+        self.assertEqual(Medicion.objects.get().secuencia, 1)
+
+    def test_content_type_no_soportado(self):
+        respuesta, _ = self.enviar_flujo('[]', 'application/json')
+        self.assertEqual(respuesta.status_code, 415)
+
+
+@override_settings(**LIMITES)
+class TokenBucketTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        reloj = mock.patch('api.limites.time.time', return_value=1000.0)
+        self.reloj = reloj.start()
+        self.addCleanup(reloj.stop)
+
+    def avanzar(self, segundos):
+        self.reloj.return_value += segundos
+
+    def cobrar(self, sujeto, conteo):
+        return consumir({sujeto: sum(conteo.values())}, conteo)
+
+    def test_consume_hasta_la_rafaga_y_recarga_a_la_tasa(self):
+        self.assertEqual(self.cobrar('org:1', Counter({7: 20})), 0)
+        # Sin fichas: informa la espera y no descuenta nada
+        self.assertAlmostEqual(self.cobrar('org:1', Counter({7: 5})), 0.5)
+        self.assertAlmostEqual(self.cobrar('org:1', Counter({7: 5})), 0.5)
+        self.avanzar(0.5)
+        self.assertEqual(self.cobrar('org:1', Counter({7: 5})), 0)
+        self.assertGreater(self.cobrar('org:1', Counter({7: 1})), 0)
+
+    def test_la_recarga_no_pasa_de_la_rafaga(self):
+        self.assertEqual(self.cobrar('org:1', Counter({7: 20})), 0)
+        self.avanzar(3600)
+        self.assertEqual(self.cobrar('org:1', Counter({7: 20})), 0)
+        self.assertAlmostEqual(self.cobrar('org:1', Counter({7: 1})), 0.1)
+
+    def test_lote_mayor_que_la_rafaga_deja_deuda(self):
+        self.assertEqual(self.cobrar('org:1', Counter({7: 50})), 0)
+        # 30 fichas de deuda más 1 para la lectura siguiente, a 10 por segundo
+        self.assertAlmostEqual(self.cobrar('org:1', Counter({7: 1})), 3.1)
+
+    def test_dispositivos_y_organizaciones_son_independientes(self):
+        self.assertEqual(self.cobrar('org:1', Counter({7: 20})), 0)
+        self.assertEqual(self.cobrar('org:1', Counter({8: 20})), 0)
+        self.assertEqual(self.cobrar('org:2', Counter({9: 20})), 0)
+        # La organización 1 gastó 40 de 50 y recarga una por segundo
+        self.assertAlmostEqual(self.cobrar('org:1', Counter({10: 20})), 10)
+
+    def test_comprobar_no_descuenta(self):
+        organizacion = Organizacion(id=1)
+        self.assertEqual(comprobar_organizacion(organizacion, 50), 0)
+        self.assertEqual(comprobar_organizacion(organizacion, 50), 0)
+        self.assertEqual(self.cobrar('org:1', Counter({7: 10, 8: 10, 9: 10})), 0)
+        self.assertAlmostEqual(comprobar_organizacion(organizacion, 30), 10)
+        self.assertEqual(comprobar_organizacion(None, 1000), 0)
+
+    @override_settings(INGESTA_LIMITE_ACTIVO=False)
+    def test_desactivado(self):
+        for _ in range(5):
+            self.assertEqual(self.cobrar('org:1', Counter({7: 20})), 0)
+
+    def test_retry_after_redondea_hacia_arriba(self):
+        self.assertEqual(segundos_retry_after(0.1), '1')
+        self.assertEqual(segundos_retry_after(3.1), '4')
+
+
+@override_settings(**LIMITES, ALERTAS_ACTIVAS=False, ANOMALIAS_ACTIVAS=False)
+class LimiteIngestaApiTests(DatosIngestaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.otro_propio = Dispositivo.objects.create(nombre='Otro propio', zona=cls.zona)
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+    def enviar_a(self, dispositivo, cantidad, **extra):
+        return self.enviar([{'dispositivo': dispositivo.id, 'consumo': 1.5} for _ in range(cantidad)], **extra)
+
+    def fichas(self, clave):
+        return cache.get(f'ingesta:{clave}', (None, None))[0]
+
+    def test_responde_429_con_retry_after(self):
+        self.assertEqual(self.enviar_a(self.propio, 20).status_code, 200)
+        respuesta = self.enviar_a(self.propio, 5)
+        self.assertEqual(respuesta.status_code, 429)
+        self.assertEqual(respuesta['Retry-After'], '1')
+        self.assertFalse(respuesta.json()['ok'])
+        self.assertAlmostEqual(respuesta.json()['reintentar_en'], 0.5, delta=0.1)
+        # El lote limitado no se guarda
+        self.assertEqual(Medicion.objects.count(), 20)
+
+    def test_dispositivos_ajenos_no_gastan_su_bucket(self):
+        respuesta = self.enviar_a(self.ajeno, 20)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['creadas'], 0)
+        self.assertIsNone(self.fichas(f'disp:{self.ajeno.id}'))
+        # La organización sí paga las lecturas rechazadas: 40 de 50 gastadas
+        self.assertEqual(self.enviar_a(self.propio, 20).status_code, 200)
+        self.assertEqual(self.enviar_a(self.otro_propio, 20).status_code, 429)
+        self.assertIsNone(self.fichas(f'disp:{self.otro_propio.id}'))
+
+    def test_organizacion_sin_fichas_no_consulta_dispositivos(self):
+        self.assertEqual(self.enviar_a(self.propio, 20).status_code, 200)
+        self.assertEqual(self.enviar_a(self.otro_propio, 20).status_code, 200)
+        with mock.patch('api.limites.organizaciones_de_dispositivos') as organizaciones:
+            self.assertEqual(self.enviar_a(self.ajeno, 20).status_code, 429)
+        organizaciones.assert_not_called()
+
+    def test_clave_global_paga_la_organizacion_de_cada_dispositivo(self):
+        self.client.logout()
+        instancia, clave = ClaveIngesta.generar('global')
+        lecturas = [{'dispositivo': self.propio.id, 'consumo': 1}] * 5
+        lecturas += [{'dispositivo': self.ajeno.id, 'consumo': 1}] * 3
+        # Los dispositivos inexistentes no cobran a nadie
+        lecturas.append({'dispositivo': 999999, 'consumo': 1})
+        self.assertEqual(self.enviar(lecturas, HTTP_AUTHORIZATION=f'Token {clave}').status_code, 200)
+        self.assertAlmostEqual(self.fichas(f'org:{self.organizacion.id}'), 45, delta=0.1)
+        self.assertAlmostEqual(self.fichas(f'org:{self.ajena.id}'), 47, delta=0.1)
+        self.assertIsNone(self.fichas(f'clave:{instancia.id}'))
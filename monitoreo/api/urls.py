@@ -1,6 +1,16 @@
 from django.urls import path
-from .views import info
+from .views import (
+    info,
+    ingestar_mediciones,
+    ingestar_mediciones_flujo,
+    listar_dispositivos,
+    listar_mediciones,
+)
 
 urlpatterns = [
     path('info/', info),
-]
\ No newline at end of file
+    path('mediciones/lote/', ingestar_mediciones, name='api_mediciones_lote'),
+    path('mediciones/flujo/', ingestar_mediciones_flujo, name='api_mediciones_flujo'),
+    path('dispositivos/', listar_dispositivos, name='api_dispositivos'),
+    path('dispositivos/<int:dispositivo_id>/mediciones/', listar_mediciones, name='api_dispositivo_mediciones'),
+]
@@ -1,5 +1,36 @@
+import json
+import logging
+from collections import Counter
+
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from django.views.decorators.http import require_GET, require_POST
+
+from dispositivos.binario import LoteDemasiadoGrande, decodificar_lote
+from dispositivos.ingesta import (
+    MAX_LECTURAS_POR_LOTE,
+    LecturaInvalida,
+    guardar_validas,
+    leer_csv,
+    leer_ndjson,
+    procesar_flujo,
+    procesar_lote,
+)
+from dispositivos.models import Dispositivo, Medicion
+from dispositivos.replicas import solo_lectura
+from usuarios.decorators import get_user_role
+from .decorators import api_login_required
+from .limites import (
+    contar_por_dispositivo,
+    esperar_y_consumir,
+    limitar_lote,
+    segundos_retry_after,
+)
+
+logger = logging.getLogger(__name__)
 
 def info(request):
     datos = {
@@ -8,4 +39,209 @@ def info(request):
         "autor": "matias"  # <--- ¡Pon tu nombre aquí!
     }
     return JsonResponse(datos)
-# Create your views here.
+
+
+def alcance_organizacion(request):
+    """
+    Devuelve (permitido, organizacion) para la petición. Las claves de ingesta
+    quedan limitadas a su organización (None = todas). Entre los usuarios con
+    sesión, el encargado y los superusuarios acceden a cualquier dispositivo
+    (organizacion=None) y el resto solo a los de su organización.
+    """
+    if request.clave_ingesta is not None:
+        return True, request.clave_ingesta.organizacion
+
+    user = request.user
+    if user.is_superuser or get_user_role(user) == 'encargado_ecoenergy':
+        return True, None
+    try:
+        organizacion = user.perfil.organizacion
+    except Exception:
+        organizacion = None
+    return organizacion is not None, organizacion
+
+
+def autor_peticion(request):
+    if request.clave_ingesta is not None:
+        return f'clave {request.clave_ingesta.prefijo}'
+    return f'usuario {request.user.id}'
+
+
+def _respuesta_limitada(request, espera):
+    logger.warning(f'Ingesta por lote de {autor_peticion(request)} limitada, reintentar en {espera:.1f}s')
+    respuesta = JsonResponse(
+        {"ok": False, "message": "Límite de ingesta excedido.", "reintentar_en": round(espera, 1)},
+        status=429,
+    )
+    respuesta['Retry-After'] = segundos_retry_after(espera)
+    return respuesta
+
+
+@api_login_required
+@require_POST
+def ingestar_mediciones(request):
+    """
+    Ingesta de un lote de lecturas: lista JSON o, con Content-Type
+    application/octet-stream, el formato binario de dispositivos.binario.
+    """
+    permitido, organizacion = alcance_organizacion(request)
+    if not permitido:
+        return JsonResponse({"ok": False, "message": "No tienes una organización asignada."}, status=403)
+
+    if request.content_type == 'application/octet-stream':
+        return _ingestar_binario(request, organizacion)
+
+    try:
+        lecturas = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({"ok": False, "message": "JSON inválido."}, status=400)
+
+    if not isinstance(lecturas, list):
+        return JsonResponse({"ok": False, "message": "Se esperaba una lista de lecturas."}, status=400)
+    if len(lecturas) > MAX_LECTURAS_POR_LOTE:
+        return JsonResponse(
+            {"ok": False, "message": f"Máximo {MAX_LECTURAS_POR_LOTE} lecturas por lote."},
+            status=413,
+        )
+
+    espera = limitar_lote(contar_por_dispositivo(lecturas), organizacion, len(lecturas))
+    if espera:
+        return _respuesta_limitada(request, espera)
+
+    resultado = procesar_lote(lecturas, organizacion=organizacion, usar_buffer=True)
+    logger.info(
+        f'Ingesta por lote de {autor_peticion(request)}: '
+        f'{resultado["creadas"]}/{resultado["recibidas"]} lecturas guardadas'
+    )
+    return JsonResponse({"ok": not resultado['errores'], **resultado})
+
+
+def _ingestar_binario(request, organizacion):
+    try:
+        validas, errores = decodificar_lote(request.body)
+    except LoteDemasiadoGrande as e:
+        return JsonResponse({"ok": False, "message": str(e)}, status=413)
+    except LecturaInvalida as e:
+        return JsonResponse({"ok": False, "message": str(e)}, status=400)
+
+    recibidas = len(validas) + len(errores)
+
+    espera = limitar_lote(Counter(v[1] for v in validas), organizacion, recibidas)
+    if espera:
+        return _respuesta_limitada(request, espera)
+
+    resultado = guardar_validas(validas, errores, recibidas, organizacion, usar_buffer=True)
+    logger.info(
+        f'Ingesta binaria de {autor_peticion(request)}: '
+        f'{resultado["creadas"]}/{resultado["recibidas"]} lecturas guardadas'
+    )
+    return JsonResponse({"ok": not resultado['errores'], **resultado})
+
+
+LECTORES_FLUJO = {
+    'application/x-ndjson': leer_ndjson,
+    'application/jsonl': leer_ndjson,
+    'text/csv': leer_csv,
+}
+
+
+@api_login_required
+@require_POST
+def ingestar_mediciones_flujo(request):
+    """
+    Ingesta de archivos NDJSON o CSV de cualquier tamaño. El cuerpo se lee
+    directamente del stream de la petición (sin pasar por request.body ni por
+    DATA_UPLOAD_MAX_MEMORY_SIZE) y la respuesta es NDJSON con una línea de
+    progreso por cada chunk confirmado. Necesita un servidor WSGI: bajo ASGI
+    Django lee el cuerpo completo y junta la respuesta antes de enviarla.
+    """
+    lector = LECTORES_FLUJO.get(request.content_type)
+    if lector is None:
+        return JsonResponse(
+            {"ok": False, "message": "Content-Type debe ser application/x-ndjson o text/csv."},
+            status=415,
+        )
+
+    permitido, organizacion = alcance_organizacion(request)
+    if not permitido:
+        return JsonResponse({"ok": False, "message": "No tienes una organización asignada."}, status=403)
+
+    def limitar(chunk):
+        # Durante el streaming no se puede responder 429: se deja de leer el
+        # cuerpo mientras se espera, lo que frena al cliente vía TCP
+        conteo = contar_por_dispositivo(chunk)
+        if not esperar_y_consumir(conteo, organizacion, settings.INGESTA_LIMITE_MAX_ESPERA_FLUJO, len(chunk)):
+            return 'Límite de ingesta excedido.'
+        return None
+
+    def progreso():
+        for resumen in procesar_flujo(lector(request), organizacion=organizacion, control=limitar):
+            if resumen.get('fin'):
+                logger.info(
+                    f'Ingesta por streaming de {autor_peticion(request)}: '
+                    f'{resumen["creadas"]}/{resumen["procesadas"]} lecturas guardadas'
+                )
+            yield json.dumps(resumen) + '\n'
+
+    return StreamingHttpResponse(progreso(), content_type='application/x-ndjson')
+
+
+def _fecha_param(valor):
+    if not valor:
+        return None
+    fecha = parse_datetime(valor)
+    if fecha is None:
+        raise ValueError(valor)
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    return fecha
+
+
+@api_login_required
+@require_GET
+@solo_lectura
+def listar_dispositivos(request):
+    permitido, organizacion = alcance_organizacion(request)
+    if not permitido:
+        return JsonResponse({"ok": False, "message": "No tienes una organización asignada."}, status=403)
+
+    qs = Dispositivo.objects.order_by('nombre')
+    if organizacion is not None:
+        qs = qs.filter(zona__organizacion=organizacion)
+
+    dispositivos = list(qs.values('id', 'nombre', 'categoria', 'zona_id', 'watts', 'last_consumo', 'last_fecha'))
+    return JsonResponse({"ok": True, "dispositivos": dispositivos})
+
+
+@api_login_required
+@require_GET
+@solo_lectura
+def listar_mediciones(request, dispositivo_id):
+    permitido, organizacion = alcance_organizacion(request)
+    if not permitido:
+        return JsonResponse({"ok": False, "message": "No tienes una organización asignada."}, status=403)
+
+    dispositivos = Dispositivo.objects.filter(id=dispositivo_id)
+    if organizacion is not None:
+        dispositivos = dispositivos.filter(zona__organizacion=organizacion)
+    if not dispositivos.exists():
+        return JsonResponse({"ok": False, "message": "Dispositivo no encontrado."}, status=404)
+
+    try:
+        desde = _fecha_param(request.GET.get('desde'))
+        hasta = _fecha_param(request.GET.get('hasta'))
+        limite = min(int(request.GET.get('limite', 100)), 1000)
+    except ValueError:
+        return JsonResponse({"ok": False, "message": "Parámetros inválidos."}, status=400)
+
+    qs = Medicion.objects.filter(dispositivo_id=dispositivo_id)
+    if desde is not None:
+        qs = qs.filter(fecha__gte=desde)
+    if hasta is not None:
+        qs = qs.filter(fecha__lt=hasta)
+
+    mediciones = [
+        {'fecha': fecha.isoformat(), 'consumo': consumo}
+        for fecha, consumo in qs.order_by('-fecha').values_list('fecha', 'consumo')[:max(limite, 0)]
+    ]
+    return JsonResponse({"ok": True, "dispositivo": dispositivo_id, "mediciones": mediciones})
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Zona, Dispositivo, Medicion, Alerta
+from .models import Zona, Dispositivo, Medicion, Alerta, PerfilUmbrales, PoliticaRetencion, Purga
 from usuarios.models import Organizacion
 
 def resetear_watts(modeladmin, request, queryset):
@@ -28,8 +28,31 @@ class MedicionAdmin(admin.ModelAdmin):
 
 @admin.register(Alerta)
 class AlertaAdmin(admin.ModelAdmin):
-    list_display = ('dispositivo', 'mensaje', 'gravedad', 'fecha')
-    list_filter = ('gravedad',)
+    list_display = ('dispositivo', 'mensaje', 'gravedad', 'tipo', 'fecha')
+    list_filter = ('gravedad', 'tipo')
     list_select_related = ('dispositivo',)
 
+@admin.register(PoliticaRetencion)
+class PoliticaRetencionAdmin(admin.ModelAdmin):
+    list_display = ('organizacion', 'dias_crudo', 'dias_horario', 'dias_diario', 'plegado_hasta', 'ultima_ejecucion')
+    list_select_related = ('organizacion',)
+    readonly_fields = ('plegado_hasta', 'ultima_ejecucion')
+
+@admin.register(PerfilUmbrales)
+class PerfilUmbralesAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'dispositivo', 'zona', 'categoria', 'organizacion', 'modo',
+                    'umbral_media', 'umbral_alta', 'umbral_grave')
+    list_filter = ('modo', 'categoria')
+    list_select_related = ('dispositivo', 'zona', 'organizacion')
+    raw_id_fields = ('dispositivo',)
+
+@admin.register(Purga)
+class PurgaAdmin(admin.ModelAdmin):
+    list_display = ('tipo', 'nombre', 'organizacion', 'estado', 'filas', 'created_at', 'terminada_en')
+    list_filter = ('estado', 'tipo')
+    readonly_fields = [f.name for f in Purga._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
 admin.site.register(Zona)
\ No newline at end of file
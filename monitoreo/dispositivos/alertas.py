@@ -0,0 +1,283 @@
+"""
+Motor de alertas. Se ejecuta una vez por lote de ingesta, dentro de la misma
+transacción que el INSERT de las mediciones: evalúa las reglas sobre las
+mediciones nuevas y guarda las alertas con un bulk_create y un bulk_update.
+El panel y el detalle leen esas alertas en vez de recalcularlas.
+
+Cada Alerta es un episodio: mientras el consumo de un dispositivo siga sobre
+el umbral, o dentro de la banda de histéresis bajo él, las lecturas que
+disparan suman ocurrencias a la misma alerta abierta en vez de crear filas
+nuevas. El episodio se cierra cuando el consumo baja de la banda y, si vuelve
+a dispararse dentro de la ventana de supresión, se reabre. El estado vive en
+la última Alerta de cada tipo del dispositivo, así que sobrevive a reinicios
+y es el mismo para todos los workers. El detector de anomalías
+(dispositivos.anomalias) usa los mismos episodios con tipo 'Anomalia'.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import OuterRef, Q, Subquery
+
+try:
+    import numpy as np
+except ImportError:
+    # Sin NumPy se evalúa medición por medición
+    np = None
+
+from .models import Alerta, Dispositivo
+from .umbrales import tabla as tabla_umbrales
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE_INSERT = 500
+
+# (gravedad, dispara también en el umbral, mensaje), de la más grave a la
+# más leve: cada medición genera a lo más una alerta
+GRAVEDADES = (
+    ('Grave', True, 'Consumo crítico'),
+    ('Alta', False, 'Consumo alto'),
+    ('Media', False, 'Consumo elevado'),
+)
+NIVELES = {gravedad: nivel for nivel, (gravedad, _, _) in enumerate(GRAVEDADES)}
+# Nivel de una lectura bajo la banda de histéresis: cierra el episodio abierto
+LIBERA = len(GRAVEDADES) + 1
+# Umbrales en kWh (grave, alta, media) de los dispositivos sin PerfilUmbrales
+UMBRALES_POR_DEFECTO = (100, 80, 60)
+# Desde cuántas mediciones conviene armar arreglos NumPy
+MIN_VECTORIZADO = 64
+# Mayor id de dispositivo para el que se arma un índice directo (4 bytes por id)
+MAX_ID_INDICE_DENSO = 1_000_000
+
+
+def clasificar(consumo, umbrales=UMBRALES_POR_DEFECTO, histeresis=0.0):
+    """
+    Devuelve (nivel, umbral) del nivel más grave que dispara, (LIBERA,
+    umbral de liberación) si el consumo quedó bajo la banda de histéresis
+    del umbral más bajo, o None. El nivel indexa GRAVEDADES.
+    """
+    for nivel, ((_, inclusivo, _), umbral) in enumerate(zip(GRAVEDADES, umbrales)):
+        if umbral is not None and (consumo > umbral or (inclusivo and consumo == umbral)):
+            return nivel, umbral
+    definidos = [umbral for umbral in umbrales if umbral is not None]
+    if definidos:
+        liberacion = min(definidos) * (1 - histeresis)
+        if consumo < liberacion:
+            return LIBERA, liberacion
+    return None
+
+
+class TablaVectorizada:
+    """
+    Tabla de umbrales como arreglos NumPy: una columna por nivel (grave,
+    alta, media) en kWh más la de liberación, donde la fila 0 son los
+    umbrales por defecto, y un índice de id de dispositivo a fila. Un nivel
+    sin umbral queda en infinito.
+    """
+
+    def __init__(self, umbrales, histeresis=0.0):
+        ids = sorted(umbrales)
+        filas = [UMBRALES_POR_DEFECTO] + [umbrales[i] for i in ids]
+        matriz = np.array([[np.inf if u is None else u for u in fila] for fila in filas], dtype=np.float64)
+        self.columnas = [np.ascontiguousarray(matriz[:, nivel]) for nivel in range(len(GRAVEDADES))]
+        # Una fila sin ningún umbral nunca dispara, así que nunca libera
+        minimo = matriz.min(axis=1)
+        self.liberacion = np.where(np.isinf(minimo), -np.inf, minimo * (1 - histeresis))
+        self.ids = np.array(ids, dtype=np.int64)
+        # Con ids chicos, un arreglo indexado por id (un gather por lectura);
+        # si no, búsqueda binaria. La última posición es la fila por defecto
+        # para dispositivos creados después de compilar la tabla
+        self.indice = None
+        if not ids or ids[-1] <= MAX_ID_INDICE_DENSO:
+            self.indice = np.zeros((ids[-1] if ids else 0) + 2, dtype=np.int32)
+            self.indice[self.ids] = np.arange(1, len(ids) + 1, dtype=np.int32)
+
+    def filas(self, dispositivos):
+        if self.indice is not None:
+            return self.indice[np.minimum(dispositivos, len(self.indice) - 1)]
+        posicion = np.minimum(np.searchsorted(self.ids, dispositivos), len(self.ids) - 1)
+        return np.where(self.ids[posicion] == dispositivos, posicion + 1, 0)
+
+    def evaluar(self, dispositivos, consumos, abiertos=None):
+        """
+        Evalúa arreglos paralelos de ids de dispositivo y consumos. Devuelve
+        (posiciones, niveles, umbrales) de las lecturas que disparan y de las
+        que liberan (nivel LIBERA). Con `abiertos`, arreglo de ids con
+        episodio abierto, solo se informan las que liberan de esos
+        dispositivos o de los que disparan en el mismo lote.
+        """
+        filas = self.filas(dispositivos)
+        sin_alerta = len(GRAVEDADES)
+        niveles = np.full(len(consumos), sin_alerta, dtype=np.int8)
+        liberacion = self.liberacion[filas]
+        niveles[consumos < liberacion] = LIBERA
+        # De la más leve a la más grave, para que gane el nivel más grave
+        for nivel in reversed(range(len(GRAVEDADES))):
+            umbral = self.columnas[nivel][filas]
+            inclusivo = GRAVEDADES[nivel][1]
+            niveles[(consumos >= umbral) if inclusivo else (consumos > umbral)] = nivel
+        disparan = niveles < sin_alerta
+        liberan = niveles == LIBERA
+        if abiertos is not None:
+            liberan &= np.isin(dispositivos, np.union1d(abiertos, dispositivos[disparan]))
+        posiciones = np.flatnonzero(disparan | liberan)
+        niveles = niveles[posiciones]
+        # np.choose indexa por nivel: sin_alerta no aparece, LIBERA sí
+        liberacion = liberacion[posiciones]
+        columnas = [columna[filas[posiciones]] for columna in self.columnas] + [liberacion, liberacion]
+        return posiciones, niveles, np.choose(niveles, columnas)
+
+
+_vectorizada = None
+
+
+def tabla_vectorizada(umbrales, histeresis=0.0):
+    """TablaVectorizada de `umbrales`, reutilizada mientras la tabla no cambie."""
+    global _vectorizada
+    actual = _vectorizada
+    if actual is None or actual[0] is not umbrales or actual[1] != histeresis:
+        actual = _vectorizada = (umbrales, histeresis, TablaVectorizada(umbrales, histeresis))
+    return actual[2]
+
+
+def evaluar(mediciones, umbrales=None, abiertos=None):
+    """
+    Lista de (medicion, nivel, umbral) de las mediciones que disparan algún
+    umbral o que liberan un episodio, en el orden del lote. `umbrales` es la
+    tabla por dispositivo (por defecto la vigente, ver dispositivos.umbrales)
+    y `abiertos` los ids de dispositivos con episodio abierto (None: todos).
+    Con NumPy y lotes grandes se evalúa el lote completo vectorizado.
+    """
+    if umbrales is None:
+        umbrales = tabla_umbrales()
+    histeresis = settings.ALERTAS_HISTERESIS
+    if np is not None and len(mediciones) >= MIN_VECTORIZADO:
+        n = len(mediciones)
+        posiciones, niveles, valores = tabla_vectorizada(umbrales, histeresis).evaluar(
+            np.fromiter((m.dispositivo_id for m in mediciones), dtype=np.int64, count=n),
+            np.fromiter((m.consumo for m in mediciones), dtype=np.float64, count=n),
+            None if abiertos is None else np.fromiter(abiertos, dtype=np.int64, count=len(abiertos)),
+        )
+        return [
+            (mediciones[posicion], nivel, umbral)
+            for posicion, nivel, umbral in zip(posiciones.tolist(), niveles.tolist(), valores.tolist())
+        ]
+
+    eventos = []
+    for medicion in mediciones:
+        resultado = clasificar(
+            medicion.consumo, umbrales.get(medicion.dispositivo_id, UMBRALES_POR_DEFECTO), histeresis
+        )
+        if resultado is not None:
+            eventos.append((medicion, *resultado))
+    if abiertos is not None:
+        relevantes = set(abiertos) | {m.dispositivo_id for m, nivel, _ in eventos if nivel != LIBERA}
+        eventos = [e for e in eventos if e[1] != LIBERA or e[0].dispositivo_id in relevantes]
+    return eventos
+
+
+def _mensaje(medicion, nivel, umbral):
+    return f'{GRAVEDADES[nivel][2]}: {medicion.consumo} kWh (umbral {umbral:g} kWh)'
+
+
+def cargar_episodios(dispositivo_ids, desde, tipo='Umbral'):
+    """
+    {dispositivo_id: Alerta} con el último episodio de `tipo` de cada
+    dispositivo, si sigue abierto o se cerró después de `desde` y aún puede
+    reabrirse.
+    """
+    ultimo = Alerta.objects.filter(dispositivo=OuterRef('pk'), tipo=tipo).order_by('-fecha', '-id')
+    return {
+        alerta.dispositivo_id: alerta
+        for alerta in Alerta.objects.filter(
+            pk__in=Dispositivo.todos.filter(id__in=dispositivo_ids).annotate(
+                episodio=Subquery(ultimo.values('id')[:1])
+            ).values('episodio')
+        ).filter(Q(cerrada_en__isnull=True) | Q(cerrada_en__gte=desde))
+    }
+
+
+def actualizar_ultima_alerta(dispositivo_ids):
+    """Apunta last_alerta a la alerta más reciente de cada dispositivo."""
+    ultima = Alerta.objects.filter(dispositivo=OuterRef('pk')).order_by('-fecha', '-id')
+    Dispositivo.todos.filter(id__in=dispositivo_ids).update(last_alerta=Subquery(ultima.values('id')[:1]))
+
+
+def ventana_supresion():
+    return timedelta(minutes=settings.ALERTAS_VENTANA_SUPRESION)
+
+
+def registrar_episodios(eventos, episodios, mensaje=_mensaje, tipo='Umbral'):
+    """
+    Aplica eventos (medicion, nivel, dato) en orden a los episodios de
+    cargar_episodios: abre, suma ocurrencias, escala la gravedad, cierra
+    (nivel LIBERA) o reabre dentro de la ventana de supresión.
+    `mensaje(medicion, nivel, dato)` arma el texto de la alerta. Guarda los
+    cambios con un bulk_create y un bulk_update y devuelve los episodios
+    nuevos.
+    """
+    ventana = ventana_supresion()
+    nuevas = []
+    modificadas = {}
+    for medicion, nivel, dato in eventos:
+        episodio = episodios.get(medicion.dispositivo_id)
+        ultima_vez = episodio and (episodio.ultima_vez or episodio.fecha)
+        if nivel == LIBERA:
+            # Una lectura atrasada no cierra un episodio con lecturas posteriores
+            if episodio is not None and episodio.cerrada_en is None and medicion.fecha >= ultima_vez:
+                episodio.cerrada_en = medicion.fecha
+                modificadas[id(episodio)] = episodio
+            continue
+
+        if episodio is not None and (
+            episodio.cerrada_en is None or medicion.fecha - episodio.cerrada_en <= ventana
+        ):
+            episodio.ocurrencias += 1
+            episodio.ultima_vez = max(ultima_vez, medicion.fecha)
+            episodio.cerrada_en = None
+            if nivel < NIVELES.get(episodio.gravedad, len(GRAVEDADES)):
+                episodio.gravedad = GRAVEDADES[nivel][0]
+                episodio.mensaje = mensaje(medicion, nivel, dato)
+            modificadas[id(episodio)] = episodio
+            continue
+
+        episodio = episodios[medicion.dispositivo_id] = Alerta(
+            dispositivo_id=medicion.dispositivo_id,
+            organizacion_id=medicion.organizacion_id,
+            gravedad=GRAVEDADES[nivel][0],
+            mensaje=mensaje(medicion, nivel, dato),
+            tipo=tipo,
+            fecha=medicion.fecha,
+            ultima_vez=medicion.fecha,
+        )
+        nuevas.append(episodio)
+
+    if nuevas:
+        Alerta.objects.bulk_create(nuevas, batch_size=TAMANO_LOTE_INSERT)
+        # bulk_create no pasa por Alerta.save: last_alerta se actualiza aparte
+        actualizar_ultima_alerta({alerta.dispositivo_id for alerta in nuevas})
+    # Los episodios abiertos en este lote ya se insertaron con su estado final
+    recien_creadas = {id(alerta) for alerta in nuevas}
+    existentes = [e for clave, e in modificadas.items() if clave not in recien_creadas]
+    if existentes:
+        Alerta.objects.bulk_update(
+            existentes, ['gravedad', 'mensaje', 'ocurrencias', 'ultima_vez', 'cerrada_en'],
+            batch_size=TAMANO_LOTE_INSERT,
+        )
+    return nuevas
+
+
+def generar_alertas(mediciones):
+    """
+    Evalúa un lote de mediciones ya guardadas (con organizacion_id asignada,
+    ordenadas por dispositivo y fecha) contra los umbrales y actualiza sus
+    episodios. Debe llamarse dentro de la transacción del INSERT, que ya
+    bloqueó los dispositivos del lote. Devuelve los episodios nuevos.
+    """
+    if not mediciones:
+        return []
+    episodios = cargar_episodios(
+        {m.dispositivo_id for m in mediciones}, min(m.fecha for m in mediciones) - ventana_supresion()
+    )
+    abiertos = [dispositivo_id for dispositivo_id, e in episodios.items() if e.cerrada_en is None]
+    return registrar_episodios(evaluar(mediciones, abiertos=abiertos), episodios)
@@ -0,0 +1,282 @@
+"""
+Detector de anomalías por dispositivo. Lleva, para cada dispositivo, la media
+y la varianza exponenciales (EWMA) de su consumo y puntúa cada lectura
+ingerida con su desvío respecto de ese comportamiento normal, en tiempo
+constante y sin consultas: detecta picos y cambios de nivel que los umbrales
+fijos de dispositivos.alertas no ven. Las lecturas que se desvían abren
+episodios de Alerta de tipo 'Anomalia' con la misma histéresis y ventana de
+supresión que las de umbral.
+
+El estado vive en arreglos en memoria del worker (48 bytes por dispositivo
+más su entrada en el índice) y se guarda cada tanto en EstadoAnomalia; un
+worker que reinicia lo lee de ahí la primera vez que ve cada dispositivo. Con
+varios workers cada uno ve solo parte de las lecturas de un dispositivo: el
+punto de control bloquea la fila (select_for_update), combina el estado
+guardado por los demás con el propio, ponderados por las lecturas nuevas de
+cada uno, y el worker sigue desde el combinado.
+"""
+import logging
+import math
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .alertas import LIBERA, NIVELES, cargar_episodios, registrar_episodios, ventana_supresion
+from .models import EstadoAnomalia
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 500
+# Piso del desvío, relativo a la media y absoluto (kWh): evita que un
+# dispositivo de consumo casi constante alerte por variaciones mínimas
+DESVIO_RELATIVO_MIN = 0.05
+DESVIO_MIN = 0.001
+# Desde cuántas veces el umbral z una anomalía es 'Alta' en vez de 'Media'
+FACTOR_ALTA = 2
+
+
+def combinar(guardado, base, local):
+    """
+    Estado (media, varianza, lecturas) que resulta de juntar el `guardado`
+    por otros workers con el `local`, si ambos partieron de `base`. Las medias
+    se ponderan por las lecturas que cada uno sumó desde `base` y la varianza
+    incluye la distancia de cada media a la combinada.
+    """
+    propias = local[2] - base[2]
+    ajenas = guardado[2] - base[2]
+    if ajenas <= 0:
+        return local
+    if propias <= 0:
+        return guardado
+    peso = propias / (propias + ajenas)
+    media = peso * local[0] + (1 - peso) * guardado[0]
+    varianza = (
+        peso * (local[1] + (local[0] - media) ** 2)
+        + (1 - peso) * (guardado[1] + (guardado[0] - media) ** 2)
+    )
+    return media, varianza, guardado[2] + propias
+
+
+class AlmacenEstados:
+    """
+    Media, varianza y cantidad de lecturas por dispositivo en arreglos
+    paralelos; `posiciones` lleva de id de dispositivo a posición. `base` es
+    el estado guardado en el último punto de control que vio este worker.
+    """
+
+    def __init__(self):
+        self.posiciones = {}
+        self.media = array('d')
+        self.varianza = array('d')
+        self.lecturas = array('q')
+        self.base_media = array('d')
+        self.base_varianza = array('d')
+        self.base_lecturas = array('q')
+        self.sucias = set()
+        self.lock = threading.Lock()
+        self.ultimo_punto_control = time.monotonic()
+
+    def agregar(self, dispositivo_id, media=0.0, varianza=0.0, lecturas=0):
+        posicion = self.posiciones[dispositivo_id] = len(self.media)
+        for columna, valor in (
+            (self.media, media), (self.varianza, varianza), (self.lecturas, lecturas),
+            (self.base_media, media), (self.base_varianza, varianza), (self.base_lecturas, lecturas),
+        ):
+            columna.append(valor)
+        return posicion
+
+    def estado(self, dispositivo_id):
+        posicion = self.posiciones[dispositivo_id]
+        return self.media[posicion], self.varianza[posicion], self.lecturas[posicion]
+
+    def cargar(self, dispositivo_ids):
+        """Agrega los dispositivos que faltan, desde el punto de control si existe."""
+        faltantes = {d for d in dispositivo_ids if d not in self.posiciones}
+        if not faltantes:
+            return
+        guardados = {
+            dispositivo_id: (media, varianza, lecturas)
+            for dispositivo_id, media, varianza, lecturas in EstadoAnomalia.objects.filter(
+                dispositivo_id__in=faltantes
+            ).values_list('dispositivo_id', 'media', 'varianza', 'lecturas')
+        }
+        with self.lock:
+            for dispositivo_id in faltantes:
+                # Otro hilo pudo agregarlo mientras se consultaba
+                if dispositivo_id not in self.posiciones:
+                    self.agregar(dispositivo_id, *guardados.get(dispositivo_id, ()))
+
+    def pendientes(self):
+        """
+        Saca los estados modificados desde el último punto de control:
+        {dispositivo_id: (estado local, base)}, cada uno (media, varianza, lecturas).
+        """
+        with self.lock:
+            sucias, self.sucias = self.sucias, set()
+            self.ultimo_punto_control = time.monotonic()
+            return {
+                dispositivo_id: (
+                    (self.media[posicion], self.varianza[posicion], self.lecturas[posicion]),
+                    (self.base_media[posicion], self.base_varianza[posicion], self.base_lecturas[posicion]),
+                )
+                for dispositivo_id, posicion in ((d, self.posiciones[d]) for d in sucias)
+            }
+
+    def aplicar(self, combinados, enviados):
+        """
+        Adopta los estados `combinados` del punto de control como nueva base.
+        Las lecturas puntuadas mientras se guardaba se suman como diferencia
+        respecto del estado `enviado` y quedan para el próximo punto de control.
+        """
+        with self.lock:
+            for dispositivo_id, (media, varianza, lecturas) in combinados.items():
+                posicion = self.posiciones[dispositivo_id]
+                enviado = enviados[dispositivo_id][0]
+                self.base_media[posicion] = media
+                self.base_varianza[posicion] = varianza
+                self.base_lecturas[posicion] = lecturas
+                nuevas = self.lecturas[posicion] - enviado[2]
+                self.media[posicion] = media + (self.media[posicion] - enviado[0])
+                self.varianza[posicion] = max(varianza + (self.varianza[posicion] - enviado[1]), 0.0)
+                self.lecturas[posicion] = lecturas + nuevas
+
+
+almacen = AlmacenEstados()
+
+
+def _mensaje(medicion, nivel, dato):
+    media, desvio = dato
+    return f'Consumo anómalo: {medicion.consumo} kWh (habitual {media:.3g} ± {desvio:.2g} kWh)'
+
+
+def puntuar(mediciones, abiertos):
+    """
+    Actualiza el estado con las mediciones, en orden, y devuelve los eventos
+    (medicion, nivel, (media, desvio)) para registrar_episodios: lecturas
+    anómalas y, en los dispositivos de `abiertos` (set, se modifica), las
+    que vuelven a lo habitual. Cada lectura se compara con el estado previo
+    a ella y después se suma.
+    """
+    alfa = settings.ANOMALIAS_ALFA
+    umbral = settings.ANOMALIAS_UMBRAL_Z
+    liberacion = umbral * (1 - settings.ALERTAS_HISTERESIS)
+    min_lecturas = settings.ANOMALIAS_MIN_LECTURAS
+    media_ = almacen.media
+    varianza_ = almacen.varianza
+    lecturas_ = almacen.lecturas
+    dispositivo_ids = {m.dispositivo_id for m in mediciones}
+    almacen.cargar(dispositivo_ids)
+    eventos = []
+    with almacen.lock:
+        posiciones = almacen.posiciones
+        for medicion in mediciones:
+            posicion = posiciones[medicion.dispositivo_id]
+            consumo = medicion.consumo
+            media = media_[posicion]
+            varianza = varianza_[posicion]
+            lecturas = lecturas_[posicion]
+
+            if lecturas >= min_lecturas:
+                desvio = max(math.sqrt(varianza), abs(media) * DESVIO_RELATIVO_MIN, DESVIO_MIN)
+                z = abs(consumo - media) / desvio
+                if z >= umbral:
+                    nivel = NIVELES['Alta'] if z >= umbral * FACTOR_ALTA else NIVELES['Media']
+                    eventos.append((medicion, nivel, (media, desvio)))
+                    abiertos.add(medicion.dispositivo_id)
+                elif z < liberacion and medicion.dispositivo_id in abiertos:
+                    eventos.append((medicion, LIBERA, None))
+                    abiertos.discard(medicion.dispositivo_id)
+
+            # Media y varianza exponenciales incrementales
+            if lecturas == 0:
+                media_[posicion] = consumo
+            else:
+                diferencia = consumo - media
+                incremento = alfa * diferencia
+                media_[posicion] = media + incremento
+                varianza_[posicion] = (1 - alfa) * (varianza + diferencia * incremento)
+            lecturas_[posicion] = lecturas + 1
+        almacen.sucias.update(dispositivo_ids)
+    return eventos
+
+
+def _bloquear_estados(dispositivo_ids):
+    return {
+        estado.dispositivo_id: estado
+        for estado in EstadoAnomalia.objects.select_for_update().filter(
+            dispositivo_id__in=dispositivo_ids
+        ).order_by('dispositivo_id')
+    }
+
+
+def guardar_punto_control():
+    """
+    Combina en EstadoAnomalia los estados modificados desde la última vez
+    con lo que guardaron los otros workers. Devuelve los dispositivos guardados.
+    """
+    pendientes = almacen.pendientes()
+    if not pendientes:
+        return 0
+    try:
+        ahora = timezone.now()
+        combinados = {}
+        with transaction.atomic():
+            # Filas bloqueadas hasta el commit: otro worker que guarde a la
+            # vez espera y combina sobre este resultado en vez de pisarlo
+            guardados = _bloquear_estados(pendientes)
+            faltantes = [d for d in pendientes if d not in guardados]
+            if faltantes:
+                # Filas vacías (0 lecturas) para poder bloquearlas; si otro
+                # worker la creó a la vez, se combina con la suya
+                EstadoAnomalia.objects.bulk_create(
+                    [EstadoAnomalia(dispositivo_id=d, media=0, varianza=0, lecturas=0) for d in faltantes],
+                    batch_size=TAMANO_LOTE, ignore_conflicts=True,
+                )
+                guardados.update(_bloquear_estados(faltantes))
+            for dispositivo_id, (local, base) in pendientes.items():
+                estado = guardados[dispositivo_id]
+                guardado = (estado.media, estado.varianza, estado.lecturas)
+                combinados[dispositivo_id] = combinar(guardado, base, local)
+                estado.media, estado.varianza, estado.lecturas = combinados[dispositivo_id]
+                estado.updated_at = ahora
+            EstadoAnomalia.objects.bulk_update(
+                list(guardados.values()), ['media', 'varianza', 'lecturas', 'updated_at'],
+                batch_size=TAMANO_LOTE,
+            )
+    except Exception as e:
+        logger.warning(f'No se pudo guardar el estado del detector de anomalías: {str(e)}')
+        with almacen.lock:
+            almacen.sucias.update(pendientes)
+        return 0
+    almacen.aplicar(combinados, pendientes)
+    logger.info(f'Estado del detector de anomalías guardado: {len(pendientes)} dispositivos')
+    return len(pendientes)
+
+
+def detectar_anomalias(mediciones):
+    """
+    Puntúa un lote de mediciones ya guardadas (ordenadas por dispositivo y
+    fecha) y actualiza los episodios de anomalía. Debe llamarse dentro de la
+    transacción del INSERT. Si el lote se revierte, el estado en memoria ya
+    incluye sus lecturas: para una media de largo plazo no importa. Devuelve
+    los episodios nuevos.
+    """
+    if not mediciones:
+        return []
+    episodios = cargar_episodios(
+        {m.dispositivo_id for m in mediciones},
+        min(m.fecha for m in mediciones) - ventana_supresion(),
+        tipo='Anomalia',
+    )
+    abiertos = {dispositivo_id for dispositivo_id, e in episodios.items() if e.cerrada_en is None}
+    nuevas = registrar_episodios(puntuar(mediciones, abiertos), episodios, _mensaje, tipo='Anomalia')
+
+    if time.monotonic() - almacen.ultimo_punto_control >= settings.ANOMALIAS_INTERVALO_PUNTO_CONTROL:
+        # Tras el commit y fuera de su transacción: un fallo no revierte el lote
+        almacen.ultimo_punto_control = time.monotonic()
+        transaction.on_commit(guardar_punto_control)
+    return nuevas
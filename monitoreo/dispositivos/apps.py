@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DispositivosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dispositivos'
+
+    def ready(self):
+        # Señales que invalidan la tabla de umbrales de alerta
+        from . import umbrales  # noqa: F401
@@ -0,0 +1,297 @@
+"""
+Archivo frío de mediciones: un archivo columnar comprimido por dispositivo y
+mes local, en ARCHIVO_MEDICIONES_DIR/<dispositivo_id>/<AAAA-MM>.eca.
+
+Cabecera de 72 bytes, little-endian:
+    4s  magia b'ECOA'
+    B   versión (1)
+    3x  relleno
+    I   id del dispositivo
+    I   cantidad de mediciones
+    q   primera fecha (microsegundos desde epoch, UTC)
+    q   última fecha
+    d   suma de consumo
+    d   consumo mínimo
+    d   consumo máximo
+    d   consumo de la última medición
+    I   bytes de la columna de fechas
+    I   bytes de la columna de consumos
+
+Seguida de las dos columnas comprimidas con zlib:
+    fechas    int64, la primera absoluta y el resto como diferencia con la
+              anterior (lecturas periódicas: valores pequeños y repetidos)
+    consumos  float64 como enteros de 64 bits, cada uno XOR con el anterior
+              (valores parecidos comparten signo, exponente y bits altos)
+
+Los totales de la cabecera permiten responder agregados del mes sin
+descomprimir nada; el lector usa mmap para leer solo lo que necesita.
+"""
+import logging
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import numpy as np
+except ImportError:
+    # Sin NumPy las columnas se reconstruyen valor por valor
+    np = None
+
+from .models import Medicion
+from .resumenes import limites_dia
+
+logger = logging.getLogger(__name__)
+
+MAGIA = b'ECOA'
+VERSION = 1
+CABECERA = struct.Struct('<4sB3xIIqqddddII')
+EXTENSION = '.eca'
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class ArchivoInvalido(ValueError):
+    pass
+
+
+def _a_micros(fecha):
+    delta = fecha - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _desde_micros(micros):
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def _little_endian(columna):
+    if sys.byteorder == 'big':
+        columna.byteswap()
+    return columna
+
+
+def mes_siguiente(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def limites_mes(mes):
+    """(inicio, fin) del mes local `mes` (date del día 1) como datetimes aware."""
+    siguiente = mes_siguiente(mes)
+    return (
+        timezone.make_aware(datetime(mes.year, mes.month, 1)),
+        timezone.make_aware(datetime(siguiente.year, siguiente.month, 1)),
+    )
+
+
+def directorio():
+    return Path(settings.ARCHIVO_MEDICIONES_DIR)
+
+
+def ruta_mes(dispositivo_id, mes):
+    return directorio() / str(dispositivo_id) / f'{mes:%Y-%m}{EXTENSION}'
+
+
+def codificar(dispositivo_id, filas):
+    """Codifica [(fecha, consumo), ...] ordenadas por fecha."""
+    if not filas:
+        raise ArchivoInvalido('No se puede archivar un mes sin mediciones')
+    valores = array('d', (consumo for _, consumo in filas))
+    fechas = array('q')
+    bits = array('Q')
+    bits.frombytes(valores.tobytes())
+    anterior_fecha = 0
+    anterior_bits = 0
+    for i, (fecha, _) in enumerate(filas):
+        micros = _a_micros(fecha)
+        fechas.append(micros - anterior_fecha)
+        anterior_fecha = micros
+        anterior_bits, bits[i] = bits[i], bits[i] ^ anterior_bits
+
+    bloque_fechas = zlib.compress(_little_endian(fechas).tobytes(), 9)
+    bloque_consumos = zlib.compress(_little_endian(bits).tobytes(), 9)
+    cabecera = CABECERA.pack(
+        MAGIA, VERSION, dispositivo_id, len(filas),
+        _a_micros(filas[0][0]), _a_micros(filas[-1][0]),
+        sum(valores), min(valores), max(valores), valores[-1],
+        len(bloque_fechas), len(bloque_consumos),
+    )
+    return cabecera + bloque_fechas + bloque_consumos
+
+
+class ArchivoMes:
+    """Lector de un archivo mensual. Usar como context manager."""
+
+    def __init__(self, ruta):
+        self.ruta = Path(ruta)
+        self._archivo = open(self.ruta, 'rb')
+        try:
+            self._datos = mmap.mmap(self._archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._archivo.close()
+            raise ArchivoInvalido(f'{self.ruta}: archivo vacío')
+        if len(self._datos) < CABECERA.size:
+            self.cerrar()
+            raise ArchivoInvalido(f'{self.ruta}: cabecera incompleta')
+        (magia, version, self.dispositivo_id, self.cantidad, primera, ultima,
+         self.suma, self.minimo, self.maximo, self.ultimo,
+         self._bytes_fechas, self._bytes_consumos) = CABECERA.unpack_from(self._datos)
+        if magia != MAGIA or version != VERSION:
+            self.cerrar()
+            raise ArchivoInvalido(f'{self.ruta}: formato desconocido')
+        if CABECERA.size + self._bytes_fechas + self._bytes_consumos > len(self._datos):
+            self.cerrar()
+            raise ArchivoInvalido(f'{self.ruta}: archivo truncado')
+        self.desde = _desde_micros(primera)
+        self.hasta = _desde_micros(ultima)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def cerrar(self):
+        if getattr(self, '_datos', None) is not None:
+            self._datos.close()
+            self._datos = None
+        self._archivo.close()
+
+    @property
+    def promedio(self):
+        return self.suma / self.cantidad if self.cantidad else 0
+
+    def resumen(self):
+        return {
+            'cantidad': self.cantidad, 'suma': self.suma, 'minimo': self.minimo,
+            'maximo': self.maximo, 'promedio': self.promedio, 'desde': self.desde, 'hasta': self.hasta,
+        }
+
+    def _bloque(self, inicio, largo):
+        # Descomprime directo desde el mmap, sin copiar antes el bloque
+        with memoryview(self._datos)[inicio:inicio + largo] as bloque:
+            return zlib.decompress(bloque)
+
+    def _columna(self, tipo, inicio, largo):
+        datos = self._bloque(inicio, largo)
+        if np is not None:
+            columna = np.frombuffer(datos, dtype='<i8' if tipo == 'q' else '<u8')
+        else:
+            columna = array(tipo)
+            columna.frombytes(datos)
+            _little_endian(columna)
+        if len(columna) != self.cantidad:
+            raise ArchivoInvalido(f'{self.ruta}: columna con {len(columna)} valores, se esperaban {self.cantidad}')
+        return columna
+
+    def columnas(self):
+        """
+        (fechas en microsegundos desde epoch, consumos): arrays de NumPy
+        (int64 y float64), o array.array si NumPy no está instalado.
+        """
+        fechas = self._columna('q', CABECERA.size, self._bytes_fechas)
+        bits = self._columna('Q', CABECERA.size + self._bytes_fechas, self._bytes_consumos)
+        if np is not None:
+            return np.cumsum(fechas), np.bitwise_xor.accumulate(bits).view('<f8')
+
+        micros = 0
+        anterior = 0
+        for i in range(self.cantidad):
+            micros += fechas[i]
+            fechas[i] = micros
+            anterior ^= bits[i]
+            bits[i] = anterior
+        consumos = array('d')
+        consumos.frombytes(bits.tobytes())
+        return fechas, consumos
+
+    def serie(self):
+        """Lista [(fecha, consumo), ...] en orden cronológico."""
+        fechas, consumos = self.columnas()
+        return [
+            (_desde_micros(micros), consumo) for micros, consumo in zip(fechas.tolist(), consumos.tolist())
+        ]
+
+    def por_dia(self):
+        """Agregados por día local: [{'dia', 'cantidad', 'suma', 'minimo', 'maximo'}, ...]."""
+        fechas, consumos = (columna.tolist() for columna in self.columnas())
+        dias = []
+        inicio = 0
+        while inicio < len(fechas):
+            # Solo se convierte a hora local una vez por día: el fin del día
+            # se busca en las fechas ordenadas
+            dia = timezone.localdate(_desde_micros(fechas[inicio]))
+            fin = bisect_left(fechas, _a_micros(limites_dia(dia)[1]), inicio)
+            tramo = consumos[inicio:fin]
+            dias.append({
+                'dia': dia, 'cantidad': len(tramo), 'suma': sum(tramo),
+                'minimo': min(tramo), 'maximo': max(tramo),
+            })
+            inicio = fin
+        return dias
+
+
+def leer_mes(dispositivo_id, mes):
+    """ArchivoMes del mes, o None si no está archivado."""
+    ruta = ruta_mes(dispositivo_id, mes)
+    if not ruta.exists():
+        return None
+    return ArchivoMes(ruta)
+
+
+def meses_archivados(dispositivo_id):
+    """[(mes, resumen), ...] de los meses archivados del dispositivo, del más reciente al más antiguo."""
+    carpeta = directorio() / str(dispositivo_id)
+    if not carpeta.is_dir():
+        return []
+    meses = []
+    for ruta in sorted(carpeta.glob(f'*{EXTENSION}'), reverse=True):
+        try:
+            mes = date.fromisoformat(f'{ruta.stem}-01')
+            with ArchivoMes(ruta) as archivo:
+                meses.append((mes, archivo.resumen()))
+        except (ValueError, OSError) as e:
+            logger.warning(f'Archivo de mediciones ilegible {ruta}: {str(e)}')
+    return meses
+
+
+def archivar_mes(dispositivo_id, mes):
+    """
+    Escribe (o completa) el archivo del mes con las mediciones que hay en la
+    base. Si ya existía se fusiona con lo archivado como multiconjunto: de
+    cada (fecha, consumo) queda la mayor cantidad entre archivo y base, así
+    repetir el comando tras una carga tardía no duplica lo ya archivado ni
+    pierde lecturas idénticas legítimas.
+    La escritura es atómica (archivo temporal + rename). No borra de la base:
+    eso lo hacen aplicar_retencion o el particionado. Devuelve la cantidad
+    de mediciones del archivo, o 0 si no había nada que archivar.
+    """
+    inicio, fin = limites_mes(mes)
+    filas = list(
+        Medicion.objects.filter(dispositivo_id=dispositivo_id, fecha__gte=inicio, fecha__lt=fin)
+        .order_by('fecha').values_list('fecha', 'consumo')
+    )
+    if not filas:
+        return 0
+
+    ruta = ruta_mes(dispositivo_id, mes)
+    if ruta.exists():
+        with ArchivoMes(ruta) as existente:
+            filas = sorted((Counter(existente.serie()) | Counter(filas)).elements())
+
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.with_suffix(f'{EXTENSION}.tmp')
+    with open(temporal, 'wb') as archivo:
+        archivo.write(codificar(dispositivo_id, filas))
+        archivo.flush()
+        os.fsync(archivo.fileno())
+    os.replace(temporal, ruta)
+    return len(filas)
@@ -0,0 +1,64 @@
+"""
+Entorno de los comandos benchmark_*: se ejecutan en una base de datos de
+prueba creada para la ocasión (test_<NAME>, como los tests), nunca en la real,
+y sus datos se borran con los mismos lotes acotados que purgar_eliminados.
+"""
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+from usuarios.models import Organizacion
+
+from .models import Dispositivo, Zona
+from .purga import marcar_eliminado, purgar
+
+
+@contextmanager
+def base_de_prueba(conservar=False):
+    """
+    Crea la base de prueba, apunta a ella todas las conexiones (también las
+    de otros hilos) y la destruye al salir. Con `conservar` se reutiliza entre
+    ejecuciones, como `test --keepdb`. En SQLite se usa un archivo temporal:
+    la base en memoria compartida no admite escrituras desde varios hilos.
+    """
+    config_test = connection.settings_dict['TEST']
+    nombre_test_original = config_test.get('NAME')
+    if connection.vendor == 'sqlite' and not nombre_test_original:
+        config_test['NAME'] = os.path.join(tempfile.gettempdir(), 'benchmark_monitoreo.sqlite3')
+    nombre_original = connection.settings_dict['NAME']
+    try:
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=conservar)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0, keepdb=conservar)
+    finally:
+        config_test['NAME'] = nombre_test_original
+
+
+def _purgar(objeto):
+    purga = purgar(marcar_eliminado(objeto), pausa_ms=0)
+    if purga.estado != 'terminada':
+        raise RuntimeError(f'No se pudo borrar {purga.tipo} {purga.objeto_id}: {purga.error}')
+    purga.delete()
+
+
+@contextmanager
+def organizacion_temporal(nombre):
+    """
+    Organización para los datos sintéticos. Al salir se borra con purga (por
+    lotes, dispositivo por dispositivo) en vez de un delete() en cascada que
+    borraría todas sus mediciones en una sola transacción.
+    """
+    organizacion = Organizacion.objects.create(nombre=f'{nombre} {time.time():.0f}')
+    try:
+        yield organizacion
+    finally:
+        for dispositivo in Dispositivo.todos.filter(zona__organizacion=organizacion):
+            _purgar(dispositivo)
+        for zona in Zona.todos.filter(organizacion=organizacion):
+            _purgar(zona)
+        organizacion.delete()
@@ -0,0 +1,125 @@
+"""
+Formato binario compacto para gateways con ancho de banda limitado.
+
+Cabecera de 16 bytes, little-endian:
+    3s  magia b'ECO'
+    B   versión (1, 2 o 3)
+    I   cantidad de registros (a lo más ingesta.MAX_LECTURAS_POR_LOTE)
+    q   timestamp base en milisegundos desde epoch (UTC)
+
+Seguida de `cantidad` registros, según la versión:
+    I   id del dispositivo
+    i   milisegundos desde el registro anterior (el primero, desde la base);
+        con signo desde la versión 2, así los registros no necesitan ir
+        ordenados por fecha, pero dos consecutivos distan a lo más ~24,8 días
+    f   consumo en kWh (float32)
+    Q   solo en la versión 3: número de secuencia del gateway
+
+La versión 1 (delta sin signo, registros ordenados) se sigue aceptando para
+el firmware ya desplegado.
+"""
+import math
+import struct
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+from .ingesta import CONSUMO_MAXIMO, MAX_ADELANTO_FECHA, MAX_LECTURAS_POR_LOTE, LecturaInvalida
+
+MAGIA = b'ECO'
+VERSION = 2
+VERSION_SECUENCIA = 3
+CABECERA = struct.Struct('<3sBIq')
+REGISTROS = {
+    1: struct.Struct('<IIf'),
+    VERSION: struct.Struct('<Iif'),
+    VERSION_SECUENCIA: struct.Struct('<IifQ'),
+}
+DELTA_MIN = -2 ** 31
+DELTA_MAX = 2 ** 31 - 1
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class LoteDemasiadoGrande(LecturaInvalida):
+    pass
+
+
+def codificar_lote(lecturas):
+    """
+    Codifica [(dispositivo_id, fecha, consumo[, secuencia]), ...]. Si las
+    lecturas traen secuencia se usa la versión 3 y todas deben traerla.
+    Lo usan los clientes de prueba y el benchmark; los gateways implementan
+    el mismo formato en su firmware.
+    """
+    if not lecturas:
+        return CABECERA.pack(MAGIA, VERSION, 0, 0)
+    version = VERSION_SECUENCIA if len(lecturas[0]) > 3 else VERSION
+    registro = REGISTROS[version]
+    base = int(lecturas[0][1].timestamp() * 1000)
+    partes = [CABECERA.pack(MAGIA, version, len(lecturas), base)]
+    anterior = base
+    for dispositivo_id, fecha, consumo, *secuencia in lecturas:
+        actual = int(fecha.timestamp() * 1000)
+        if not DELTA_MIN <= actual - anterior <= DELTA_MAX:
+            raise ValueError('Dos lecturas consecutivas distan más de lo que admite el formato.')
+        if len(secuencia) != (version == VERSION_SECUENCIA):
+            raise ValueError('O todas las lecturas traen secuencia o ninguna.')
+        partes.append(registro.pack(dispositivo_id, actual - anterior, consumo, *secuencia))
+        anterior = actual
+    return b''.join(partes)
+
+
+def decodificar_lote(datos, inicio=0):
+    """
+    Decodifica un lote binario sin copiar el buffer (memoryview +
+    struct.iter_unpack). Devuelve (validas, errores) con el mismo formato que
+    espera ingesta.guardar_validas. Un lote con más de MAX_LECTURAS_POR_LOTE
+    registros lanza LoteDemasiadoGrande.
+    """
+    vista = memoryview(datos)
+    if len(vista) < CABECERA.size:
+        raise LecturaInvalida('Lote binario incompleto.')
+    magia, version, cantidad, base_ms = CABECERA.unpack_from(vista)
+    if magia != MAGIA or version not in REGISTROS:
+        raise LecturaInvalida('Formato binario desconocido.')
+    # Antes de decodificar: un lote enorme se rechaza mirando solo la cabecera
+    if cantidad > MAX_LECTURAS_POR_LOTE:
+        raise LoteDemasiadoGrande(f'Máximo {MAX_LECTURAS_POR_LOTE} lecturas por lote.')
+    registro = REGISTROS[version]
+    if len(vista) != CABECERA.size + cantidad * registro.size:
+        raise LecturaInvalida('El tamaño del lote no coincide con la cabecera.')
+
+    limite_ms = (timezone.now() + MAX_ADELANTO_FECHA).timestamp() * 1000
+    validas = []
+    errores = []
+    instante_ms = base_ms
+    for indice, (dispositivo_id, delta_ms, consumo, *secuencia) in enumerate(
+        registro.iter_unpack(vista[CABECERA.size:]), inicio
+    ):
+        instante_ms += delta_ms
+        # Mismas reglas que ingesta.validar_lectura
+        if not math.isfinite(consumo) or consumo < 0:
+            errores.append({'indice': indice, 'error': 'Consumo inválido.'})
+            continue
+        # float32 guarda 0.01 como 0.0099999998 y 9999.99 como 9999.9902: se
+        # compara con las 7 cifras significativas que float32 sí conserva
+        consumo = float(f'{consumo:.7g}')
+        if consumo > CONSUMO_MAXIMO:
+            errores.append({'indice': indice, 'error': 'El consumo no puede exceder 9,999.99 kWh.'})
+            continue
+        if 0 < consumo < 0.01:
+            errores.append({'indice': indice, 'error': 'El consumo mínimo registrable es 0.01 kWh.'})
+            continue
+        if instante_ms > limite_ms:
+            errores.append({'indice': indice, 'error': 'La fecha de la lectura está en el futuro.'})
+            continue
+        try:
+            fecha = _EPOCH + timedelta(milliseconds=instante_ms)
+        except OverflowError:
+            errores.append({'indice': indice, 'error': 'Fecha inválida.'})
+            continue
+        secuencia = secuencia[0] if secuencia else None
+        validas.append((indice, dispositivo_id, round(consumo, 2), fecha, secuencia))
+
+    return validas, errores
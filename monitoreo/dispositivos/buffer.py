@@ -0,0 +1,153 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .ingesta import guardar_mediciones
+from .replicas import marcar_escritura
+
+logger = logging.getLogger(__name__)
+
+
+class _Pendiente:
+    """Mediciones de una petición esperando a que el buffer las confirme."""
+    __slots__ = ('mediciones', 'evento', 'guardadas', 'error')
+
+    def __init__(self, mediciones):
+        self.mediciones = mediciones
+        self.evento = threading.Event()
+        self.guardadas = []
+        self.error = None
+
+
+class BufferMediciones:
+    """
+    Agrupa las Medicion de peticiones concurrentes de un mismo worker y las
+    inserta con un solo bulk_create cuando se juntan `max_filas` o pasan
+    `max_espera_ms` desde la primera pendiente. Cada petición espera a que su
+    lote quede confirmado, así que no se pierde durabilidad.
+    """
+
+    def __init__(self, max_filas=500, max_espera_ms=5):
+        self.max_filas = max_filas
+        self.max_espera = max_espera_ms / 1000
+        self._condicion = threading.Condition()
+        self._cola = []
+        self._filas = 0
+        self._hilo = None
+        self._cerrado = False
+
+    def agregar(self, mediciones):
+        """
+        Encola mediciones para el próximo vaciado, bloquea hasta que se
+        guardan y devuelve las que se insertaron. Si no se pudieron guardar,
+        lanza el error del guardado.
+        """
+        pendiente = _Pendiente(list(mediciones))
+        # Las inserta otro hilo, fuera del contexto de la petición: sin esto
+        # el usuario no quedaría pegado a la primaria y podría no ver su medición
+        marcar_escritura()
+        with self._condicion:
+            if self._cerrado:
+                return guardar_mediciones(pendiente.mediciones)
+            self._cola.append(pendiente)
+            self._filas += len(pendiente.mediciones)
+            if self._hilo is None:
+                self._hilo = threading.Thread(
+                    target=self._bucle, name='buffer-mediciones', daemon=True
+                )
+                self._hilo.start()
+            self._condicion.notify()
+
+        pendiente.evento.wait()
+        if pendiente.error is not None:
+            raise pendiente.error
+        return pendiente.guardadas
+
+    def cerrar(self):
+        """Vacía lo pendiente y detiene el hilo. Se llama al terminar el worker."""
+        with self._condicion:
+            self._cerrado = True
+            self._condicion.notify()
+            hilo = self._hilo
+        if hilo is not None:
+            hilo.join()
+
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                while not self._cola and not self._cerrado:
+                    self._condicion.wait()
+                if not self._cola:
+                    return
+                limite = time.monotonic() + self.max_espera
+                while self._filas < self.max_filas and not self._cerrado:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._condicion.wait(restante)
+                lote, self._cola, self._filas = self._cola, [], 0
+            try:
+                self._vaciar(lote)
+            except Exception as e:
+                # El hilo no puede morir: las peticiones del lote y las
+                # siguientes quedarían esperando para siempre
+                logger.error(f'Error inesperado en el buffer de mediciones: {str(e)}')
+                for pendiente in lote:
+                    if not pendiente.evento.is_set():
+                        pendiente.error = e
+                        pendiente.evento.set()
+
+    def _vaciar(self, lote):
+        try:
+            # El hilo mantiene su propia conexión; respetar CONN_MAX_AGE.
+            # Dentro del try: con la base caída también puede fallar
+            close_old_connections()
+            guardadas = guardar_mediciones([m for p in lote for m in p.mediciones])
+        except Exception as e:
+            logger.error(f'Error vaciando buffer de mediciones ({len(lote)} peticiones): {str(e)}')
+            # Reintentar petición por petición para que una sola lectura
+            # problemática no haga perder las demás
+            for pendiente in lote:
+                try:
+                    pendiente.guardadas = guardar_mediciones(pendiente.mediciones)
+                except Exception as e:
+                    pendiente.error = e
+                pendiente.evento.set()
+            return
+
+        ids = {id(m) for m in guardadas}
+        for pendiente in lote:
+            pendiente.guardadas = [m for m in pendiente.mediciones if id(m) in ids]
+            pendiente.evento.set()
+
+
+_buffer = None
+_buffer_pid = None
+_buffer_lock = threading.Lock()
+
+
+def obtener_buffer():
+    """Devuelve el buffer del worker actual, o None si está desactivado."""
+    global _buffer, _buffer_pid
+    if not getattr(settings, 'INGESTA_BUFFER_ACTIVO', False):
+        return None
+    with _buffer_lock:
+        # Tras un fork (gunicorn --preload) cada worker crea su propio buffer
+        if _buffer is None or _buffer_pid != os.getpid():
+            _buffer = BufferMediciones(
+                max_filas=settings.INGESTA_BUFFER_MAX_FILAS,
+                max_espera_ms=settings.INGESTA_BUFFER_MAX_ESPERA_MS,
+            )
+            _buffer_pid = os.getpid()
+        return _buffer
+
+
+@atexit.register
+def _cerrar_buffer():
+    if _buffer is not None and _buffer_pid == os.getpid():
+        _buffer.cerrar()
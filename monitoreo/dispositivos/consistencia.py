@@ -0,0 +1,98 @@
+"""
+Verificación de la organización desnormalizada en Medicion y Alerta: debe
+coincidir con la organización actual de la zona del dispositivo. Al mover un
+dispositivo de organización la vista solo lo marca (organizacion_pendiente) y
+corregir_pendientes actualiza después sus filas por lotes.
+"""
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import Alerta, Dispositivo, Medicion, organizacion_de
+
+logger = logging.getLogger(__name__)
+
+MODELOS = (Medicion, Alerta)
+TAMANO_CHUNK = 1000
+
+
+def inconsistentes(modelo):
+    """Filas cuya organización no coincide con la de su dispositivo (incluye las vacías)."""
+    esperada = F('dispositivo__zona__organizacion_id')
+    return modelo.objects.filter(
+        Q(organizacion_id__isnull=True, dispositivo__zona__organizacion_id__isnull=False)
+        | Q(organizacion_id__isnull=False, dispositivo__zona__organizacion_id__isnull=True)
+        | (
+            Q(organizacion_id__isnull=False, dispositivo__zona__organizacion_id__isnull=False)
+            & ~Q(organizacion_id=esperada)
+        )
+    )
+
+
+def contar():
+    """{nombre del modelo: filas inconsistentes}."""
+    return {modelo.__name__: inconsistentes(modelo).count() for modelo in MODELOS}
+
+
+def corregir_dispositivo(dispositivo_id, organizacion_id, tamano=TAMANO_CHUNK, pausa_ms=0):
+    """
+    Asigna `organizacion_id` a las mediciones y alertas del dispositivo que
+    tengan otra, en transacciones de a lo más `tamano` filas. Devuelve las
+    filas corregidas.
+    """
+    corregidas = 0
+    for modelo in MODELOS:
+        pendientes = modelo.objects.filter(dispositivo_id=dispositivo_id)
+        if organizacion_id is None:
+            pendientes = pendientes.filter(organizacion_id__isnull=False)
+        else:
+            pendientes = pendientes.exclude(organizacion_id=organizacion_id)
+        while True:
+            pks = list(pendientes.order_by().values_list('pk', flat=True)[:tamano])
+            if not pks:
+                break
+            with transaction.atomic():
+                corregidas += modelo.objects.filter(pk__in=pks).update(organizacion_id=organizacion_id)
+            if pausa_ms:
+                time.sleep(pausa_ms / 1000)
+    return corregidas
+
+
+def marcar_pendiente(dispositivo_id):
+    """Encola la corrección de las filas de un dispositivo que cambió de organización."""
+    Dispositivo.todos.filter(pk=dispositivo_id).update(organizacion_pendiente=True)
+
+
+def corregir_pendientes(tamano=TAMANO_CHUNK, pausa_ms=0):
+    """
+    Corrige los dispositivos marcados con marcar_pendiente, sin recorrer toda
+    la tabla como corregir(). Devuelve las filas corregidas.
+    """
+    corregidas = 0
+    for dispositivo_id in list(Dispositivo.todos.filter(organizacion_pendiente=True).values_list('id', flat=True)):
+        # Se desmarca antes de leer la organización: si vuelve a cambiar
+        # durante la corrección queda marcado y se corrige en la siguiente pasada
+        Dispositivo.todos.filter(pk=dispositivo_id).update(organizacion_pendiente=False)
+        corregidas += corregir_dispositivo(dispositivo_id, organizacion_de(dispositivo_id), tamano, pausa_ms)
+    if corregidas:
+        logger.info(f'Organización desnormalizada corregida en {corregidas} filas de dispositivos movidos')
+    return corregidas
+
+
+def corregir(tamano=TAMANO_CHUNK, pausa_ms=0):
+    """Corrige todos los dispositivos con filas inconsistentes. Devuelve las filas corregidas."""
+    dispositivo_ids = set()
+    for modelo in MODELOS:
+        dispositivo_ids.update(
+            inconsistentes(modelo).order_by().values_list('dispositivo_id', flat=True).distinct()
+        )
+    corregidas = 0
+    for dispositivo_id, organizacion_id in Dispositivo.objects.filter(id__in=dispositivo_ids).values_list(
+        'id', 'zona__organizacion_id'
+    ):
+        corregidas += corregir_dispositivo(dispositivo_id, organizacion_id, tamano, pausa_ms)
+    if corregidas:
+        logger.info(f'Organización desnormalizada corregida en {corregidas} filas')
+    return corregidas
@@ -0,0 +1,407 @@
+import csv
+import json
+import logging
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .alertas import generar_alertas
+from .anomalias import detectar_anomalias
+from .models import Dispositivo, Medicion
+from .resumenes import actualizar_resumenes, ubicaciones_de_dispositivos
+
+logger = logging.getLogger(__name__)
+
+# Filas por sentencia INSERT en bulk_create
+TAMANO_LOTE_INSERT = 500
+# Máximo de lecturas aceptadas en una sola petición
+MAX_LECTURAS_POR_LOTE = 5000
+CONSUMO_MAXIMO = 9999.99
+# Filas confirmadas por transacción en la ingesta por streaming
+TAMANO_CHUNK_STREAMING = 1000
+# Longitud máxima de una línea NDJSON/CSV; evita leer líneas sin fin a memoria
+MAX_BYTES_LINEA = 4096
+# Tolerancia para relojes de gateways adelantados
+MAX_ADELANTO_FECHA = timedelta(minutes=5)
+
+
+class LecturaInvalida(ValueError):
+    pass
+
+
+def validar_fecha(valor):
+    """
+    Convierte la hora de origen de una lectura (ISO 8601 o epoch en segundos)
+    a datetime aware. Sin zona horaria se asume la de settings.TIME_ZONE.
+    """
+    if isinstance(valor, bool):
+        raise LecturaInvalida('Fecha inválida.')
+    if isinstance(valor, (int, float)):
+        try:
+            fecha = datetime.fromtimestamp(valor, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise LecturaInvalida('Fecha inválida.')
+    else:
+        try:
+            fecha = parse_datetime(str(valor).strip())
+        except ValueError:
+            fecha = None
+        if fecha is None:
+            raise LecturaInvalida('Fecha inválida, use ISO 8601 o epoch en segundos.')
+        if timezone.is_naive(fecha):
+            fecha = timezone.make_aware(fecha)
+
+    if fecha > timezone.now() + MAX_ADELANTO_FECHA:
+        raise LecturaInvalida('La fecha de la lectura está en el futuro.')
+    return fecha
+
+
+def validar_lectura(dato):
+    """
+    Valida una lectura cruda y devuelve (dispositivo_id, consumo, fecha, secuencia).
+    `fecha` y `secuencia` son None si la lectura no los trae.
+    """
+    if isinstance(dato, LecturaInvalida):
+        # Error de parseo detectado al leer el flujo
+        raise dato
+    if not isinstance(dato, dict):
+        raise LecturaInvalida('La lectura debe ser un objeto.')
+
+    dispositivo_id = dato.get('dispositivo')
+    if isinstance(dispositivo_id, bool):
+        raise LecturaInvalida('El campo "dispositivo" debe ser un ID numérico.')
+    try:
+        dispositivo_id = int(dispositivo_id)
+    except (TypeError, ValueError):
+        raise LecturaInvalida('El campo "dispositivo" debe ser un ID numérico.')
+
+    consumo = dato.get('consumo')
+    if isinstance(consumo, bool):
+        raise LecturaInvalida('El consumo debe ser numérico.')
+    try:
+        consumo = float(consumo)
+    except (TypeError, ValueError):
+        raise LecturaInvalida('El consumo debe ser numérico.')
+    # Mismas reglas que MedicionForm.clean_consumo
+    if not math.isfinite(consumo):
+        raise LecturaInvalida('El consumo debe ser numérico.')
+    if consumo < 0:
+        raise LecturaInvalida('El consumo no puede ser negativo.')
+    if consumo > CONSUMO_MAXIMO:
+        raise LecturaInvalida('El consumo no puede exceder 9,999.99 kWh.')
+    if 0 < consumo < 0.01:
+        raise LecturaInvalida('El consumo mínimo registrable es 0.01 kWh.')
+
+    fecha = dato.get('fecha')
+    if fecha not in (None, ''):
+        fecha = validar_fecha(fecha)
+    else:
+        fecha = None
+
+    secuencia = dato.get('secuencia')
+    if secuencia in (None, ''):
+        secuencia = None
+    else:
+        if isinstance(secuencia, bool):
+            raise LecturaInvalida('La secuencia debe ser un entero no negativo.')
+        try:
+            secuencia = int(secuencia)
+        except (TypeError, ValueError):
+            raise LecturaInvalida('La secuencia debe ser un entero no negativo.')
+        if secuencia < 0:
+            raise LecturaInvalida('La secuencia debe ser un entero no negativo.')
+
+    return dispositivo_id, round(consumo, 2), fecha, secuencia
+
+
+def organizaciones_de_dispositivos(dispositivo_ids):
+    """Devuelve {dispositivo_id: organizacion_id} con una sola consulta."""
+    return dict(
+        Dispositivo.objects.filter(id__in=set(dispositivo_ids))
+        .values_list('id', 'zona__organizacion_id')
+    )
+
+
+def descartar_duplicadas(mediciones):
+    """
+    Quita las mediciones cuya (dispositivo, secuencia) ya está en el lote o en
+    la base de datos. Consulta las existentes en un solo viaje, usando el
+    índice único, en vez de comprobar fila por fila.
+    """
+    vistas = set()
+    unicas = []
+    for medicion in mediciones:
+        if medicion.secuencia is None:
+            unicas.append(medicion)
+            continue
+        clave = (medicion.dispositivo_id, medicion.secuencia)
+        if clave not in vistas:
+            vistas.add(clave)
+            unicas.append(medicion)
+
+    if vistas:
+        existentes = set(
+            Medicion.objects.filter(
+                dispositivo_id__in={d for d, _ in vistas},
+                secuencia__in={s for _, s in vistas},
+            ).values_list('dispositivo_id', 'secuencia')
+        )
+        if existentes:
+            unicas = [
+                m for m in unicas
+                if (m.dispositivo_id, m.secuencia) not in existentes
+            ]
+    return unicas
+
+
+def actualizar_ultima_lectura(mediciones):
+    """
+    Actualiza last_consumo/last_fecha de los dispositivos del lote. Las filas
+    se bloquean en orden de id (como los resúmenes) y una lectura atrasada no
+    pisa una más reciente. Debe llamarse dentro de la transacción del INSERT.
+    """
+    ultimas = {}
+    for medicion in mediciones:
+        actual = ultimas.get(medicion.dispositivo_id)
+        if actual is None or medicion.fecha >= actual.fecha:
+            ultimas[medicion.dispositivo_id] = medicion
+
+    cambiados = []
+    for dispositivo in Dispositivo.objects.select_for_update().filter(id__in=ultimas).order_by('id').only(
+        'id', 'last_consumo', 'last_fecha'
+    ):
+        medicion = ultimas[dispositivo.id]
+        if dispositivo.last_fecha is None or medicion.fecha >= dispositivo.last_fecha:
+            dispositivo.last_consumo = medicion.consumo
+            dispositivo.last_fecha = medicion.fecha
+            cambiados.append(dispositivo)
+    if cambiados:
+        Dispositivo.objects.bulk_update(cambiados, ['last_consumo', 'last_fecha'], batch_size=TAMANO_LOTE_INSERT)
+
+
+def recalcular_ultima_lectura(dispositivo_ids):
+    """Recalcula last_consumo/last_fecha desde Medicion tras editar o borrar mediciones."""
+    ultima = Medicion.objects.filter(dispositivo=OuterRef('pk')).order_by('-fecha', '-id')
+    Dispositivo.objects.filter(id__in=dispositivo_ids).update(
+        last_consumo=Subquery(ultima.values('consumo')[:1]),
+        last_fecha=Subquery(ultima.values('fecha')[:1]),
+    )
+
+
+def bloquear_dispositivos(dispositivo_ids):
+    """
+    Bloquea con FOR UPDATE, en orden de id, las filas de los dispositivos.
+    Serializa los lotes concurrentes de un mismo dispositivo hasta el commit.
+    """
+    list(
+        Dispositivo.todos.select_for_update().filter(id__in=set(dispositivo_ids))
+        .order_by('id').values_list('id', flat=True)
+    )
+
+
+def guardar_mediciones(mediciones, ubicaciones=None):
+    """
+    Inserta un lote de Medicion ya validadas dentro de una transacción y
+    devuelve las que se guardaron (sin los reintentos ya registrados).
+    `ubicaciones`, {dispositivo_id: (zona_id, organizacion_id)} de
+    ubicaciones_de_dispositivos, evita consultarlas de nuevo si quien llama
+    ya lo hizo.
+    """
+    if not mediciones:
+        return []
+    ahora = timezone.now()
+    for medicion in mediciones:
+        if medicion.fecha is None:
+            medicion.fecha = ahora
+    with transaction.atomic():
+        # Un gateway que reintenta mientras el primer envío aún confirma manda
+        # las mismas secuencias en paralelo. Con los dispositivos bloqueados
+        # antes de buscar duplicados, el segundo lote espera al commit del
+        # primero y ve sus filas: ningún duplicado llega al INSERT, que ya no
+        # necesita ignore_conflicts (que los descartaría sin avisar y los
+        # contaría en los resúmenes y en `creadas`). Es la primera consulta de
+        # la transacción: en MySQL la lectura consistente empieza después.
+        bloquear_dispositivos(m.dispositivo_id for m in mediciones)
+        mediciones = descartar_duplicadas(mediciones)
+        if not mediciones:
+            return []
+        # Los gateways reenvían lecturas atrasadas y desordenadas; insertarlas
+        # ordenadas por (dispositivo, fecha) mantiene la localidad del índice.
+        mediciones = sorted(mediciones, key=lambda m: (m.dispositivo_id, m.fecha))
+        if ubicaciones is None:
+            ubicaciones = ubicaciones_de_dispositivos(m.dispositivo_id for m in mediciones)
+        for medicion in mediciones:
+            medicion.organizacion_id = ubicaciones.get(medicion.dispositivo_id, (None, None))[1]
+        Medicion.objects.bulk_create(mediciones, batch_size=TAMANO_LOTE_INSERT)
+        actualizar_resumenes(mediciones, ubicaciones)
+        actualizar_ultima_lectura(mediciones)
+        if settings.ALERTAS_ACTIVAS:
+            generar_alertas(mediciones)
+        if settings.ANOMALIAS_ACTIVAS:
+            detectar_anomalias(mediciones)
+    return mediciones
+
+
+def procesar_lote(lecturas, organizacion=None, inicio=0, usar_buffer=False):
+    """
+    Valida y guarda un lote de lecturas crudas.
+
+    Si se indica `organizacion`, solo se aceptan dispositivos de esa
+    organización. Los errores se informan por fila sin rechazar el lote;
+    `inicio` desplaza los índices informados. Con `usar_buffer` el guardado
+    pasa por el buffer de escritura del worker, si está activo.
+    """
+    errores = []
+    validas = []
+
+    for indice, dato in enumerate(lecturas, inicio):
+        try:
+            validas.append((indice, *validar_lectura(dato)))
+        except LecturaInvalida as e:
+            errores.append({'indice': indice, 'error': str(e)})
+
+    return guardar_validas(validas, errores, len(lecturas), organizacion, usar_buffer)
+
+
+def guardar_validas(validas, errores, recibidas, organizacion=None, usar_buffer=False):
+    """
+    Comprueba la organización de lecturas ya validadas, tuplas
+    (indice, dispositivo_id, consumo, fecha, secuencia), y las guarda.
+    """
+    ubicaciones = ubicaciones_de_dispositivos(v[1] for v in validas)
+
+    mediciones = []
+    for indice, dispositivo_id, consumo, fecha, secuencia in validas:
+        if dispositivo_id not in ubicaciones:
+            errores.append({'indice': indice, 'error': 'Dispositivo no encontrado.'})
+            continue
+        if organizacion is not None and ubicaciones[dispositivo_id][1] != organizacion.id:
+            errores.append({'indice': indice, 'error': 'Dispositivo no encontrado.'})
+            continue
+        mediciones.append(Medicion(
+            dispositivo_id=dispositivo_id, consumo=consumo, fecha=fecha, secuencia=secuencia
+        ))
+
+    buffer = None
+    if usar_buffer:
+        from .buffer import obtener_buffer
+        buffer = obtener_buffer()
+    if buffer is not None:
+        creadas = buffer.agregar(mediciones)
+    else:
+        creadas = guardar_mediciones(mediciones, ubicaciones)
+    errores.sort(key=lambda e: e['indice'])
+
+    return {
+        'recibidas': recibidas,
+        'creadas': len(creadas),
+        'duplicadas': len(mediciones) - len(creadas),
+        'errores': errores,
+    }
+
+
+def _lineas(flujo):
+    """Itera las líneas de un flujo binario sin cargarlo completo en memoria."""
+    while True:
+        linea = flujo.readline(MAX_BYTES_LINEA)
+        if not linea:
+            return
+        if len(linea) == MAX_BYTES_LINEA and not linea.endswith(b'\n'):
+            # Descartar el resto de la línea demasiado larga
+            while len(linea) == MAX_BYTES_LINEA and not linea.endswith(b'\n'):
+                linea = flujo.readline(MAX_BYTES_LINEA)
+            yield None
+            continue
+        yield linea
+
+
+def leer_ndjson(flujo):
+    """Genera una lectura (dict) por cada línea JSON del flujo."""
+    for linea in _lineas(flujo):
+        if linea is None:
+            yield LecturaInvalida('Línea demasiado larga.')
+            continue
+        if not linea.strip():
+            continue
+        try:
+            yield json.loads(linea)
+        except (ValueError, UnicodeDecodeError):
+            yield LecturaInvalida('JSON inválido.')
+
+
+def leer_csv(flujo):
+    """Genera una lectura por fila de un CSV con cabecera dispositivo,consumo[,fecha][,secuencia]."""
+    cabecera = None
+    for linea in _lineas(flujo):
+        if linea is None:
+            yield LecturaInvalida('Línea demasiado larga.')
+            continue
+        texto = linea.decode('utf-8', errors='replace').strip()
+        if not texto:
+            continue
+        # Cada lectura ocupa una línea, así que se parsea línea a línea
+        valores = next(csv.reader([texto]))
+        if cabecera is None:
+            cabecera = [v.strip().lower() for v in valores]
+            continue
+        yield dict(zip(cabecera, valores))
+
+
+def procesar_flujo(lecturas, organizacion=None, tamano_chunk=TAMANO_CHUNK_STREAMING, control=None):
+    """
+    Procesa un iterable de lecturas de tamaño arbitrario en chunks de
+    `tamano_chunk` filas, confirmando cada chunk en su propia transacción.
+
+    Genera un resumen de progreso por cada chunk guardado, con los errores de
+    ese chunk; la memoria usada no depende del tamaño total del flujo.
+    `control(chunk)` se llama antes de guardar cada chunk; si devuelve un
+    mensaje, el procesamiento se detiene con ese error.
+    """
+    procesadas = 0
+    creadas = 0
+    duplicadas = 0
+    total_errores = 0
+    iterador = iter(lecturas)
+
+    while True:
+        chunk = list(islice(iterador, tamano_chunk))
+        if not chunk:
+            break
+        if control is not None:
+            mensaje = control(chunk)
+            if mensaje:
+                yield {
+                    'fin': True,
+                    'procesadas': procesadas,
+                    'creadas': creadas,
+                    'duplicadas': duplicadas,
+                    'total_errores': total_errores,
+                    'error': mensaje,
+                }
+                return
+        resultado = procesar_lote(chunk, organizacion=organizacion, inicio=procesadas)
+        procesadas += resultado['recibidas']
+        creadas += resultado['creadas']
+        duplicadas += resultado['duplicadas']
+        total_errores += len(resultado['errores'])
+        logger.info(f'Ingesta por streaming: {procesadas} filas procesadas, {creadas} guardadas')
+        yield {
+            'procesadas': procesadas,
+            'creadas': creadas,
+            'duplicadas': duplicadas,
+            'errores': resultado['errores'],
+        }
+
+    yield {
+        'fin': True,
+        'procesadas': procesadas,
+        'creadas': creadas,
+        'duplicadas': duplicadas,
+        'total_errores': total_errores,
+    }
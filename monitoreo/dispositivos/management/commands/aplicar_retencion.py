@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dispositivos.models import PoliticaRetencion
+from dispositivos.retencion import PAUSA_MS, TAMANO_CHUNK, aplicar
+
+
+class Command(BaseCommand):
+    help = (
+        'Aplica las políticas de retención: pliega en los resúmenes las mediciones '
+        'crudas vencidas y las borra en lotes pequeños, y borra los resúmenes '
+        'vencidos. Las organizaciones sin política no se tocan. Pensado para cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organizacion', help='Nombre de la organización; por defecto todas las que tienen política')
+        parser.add_argument('--tamano-chunk', type=int, default=TAMANO_CHUNK, help='Filas por transacción de borrado')
+        parser.add_argument('--pausa-ms', type=float, default=PAUSA_MS, help='Pausa entre transacciones de borrado')
+        parser.add_argument('--simular', action='store_true', help='Solo contar lo que se borraría')
+
+    def handle(self, *args, **options):
+        if options['tamano_chunk'] < 1:
+            raise CommandError('--tamano-chunk debe ser mayor que 0')
+
+        politicas = PoliticaRetencion.objects.select_related('organizacion').order_by('organizacion__nombre')
+        if options['organizacion']:
+            politicas = politicas.filter(organizacion__nombre=options['organizacion'])
+            if not politicas.exists():
+                raise CommandError(f"La organización '{options['organizacion']}' no tiene política de retención")
+
+        for politica in politicas:
+            resultado = aplicar(
+                politica, tamano=options['tamano_chunk'], pausa_ms=options['pausa_ms'], simular=options['simular']
+            )
+            prefijo = 'Se borrarían' if options['simular'] else 'Borradas'
+            self.stdout.write(
+                f"{politica.organizacion.nombre}: {prefijo} {resultado['mediciones']} mediciones, "
+                f"{resultado['horario']} resúmenes horarios y {resultado['diario']} diarios"
+                + ('' if options['simular'] else f" ({resultado['dias_plegados']} días plegados)")
+            )
+        self.stdout.write(self.style.SUCCESS('Retención aplicada'))
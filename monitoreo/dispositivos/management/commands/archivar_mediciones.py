@@ -0,0 +1,64 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from dispositivos.archivo import archivar_mes, limites_mes, mes_siguiente
+from dispositivos.models import Dispositivo, Medicion
+
+
+def _mes_anterior(mes):
+    return date(mes.year - (mes.month == 1), (mes.month - 2) % 12 + 1, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        'Exporta las mediciones de meses cerrados a archivos columnares comprimidos '
+        'por dispositivo y mes (ver dispositivos.archivo). No borra de la base: '
+        'ejecutar antes de aplicar_retencion para conservar el historial en frío.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hasta', help='Último mes a archivar (AAAA-MM); por defecto el mes pasado')
+        parser.add_argument('--desde', help='Primer mes a archivar (AAAA-MM); por defecto el de la medición más antigua')
+        parser.add_argument('--dispositivo', type=int, help='Limitar a un dispositivo')
+
+    def handle(self, *args, **options):
+        try:
+            hasta = (
+                date.fromisoformat(f"{options['hasta']}-01") if options['hasta']
+                else _mes_anterior(timezone.localdate().replace(day=1))
+            )
+            desde = date.fromisoformat(f"{options['desde']}-01") if options['desde'] else None
+        except ValueError as e:
+            raise CommandError(f'Mes inválido: {e}')
+        if hasta >= timezone.localdate().replace(day=1):
+            raise CommandError('Solo se pueden archivar meses cerrados')
+
+        dispositivos = Dispositivo.objects.order_by('id')
+        if options['dispositivo']:
+            dispositivos = dispositivos.filter(id=options['dispositivo'])
+
+        archivos = filas = 0
+        for dispositivo_id in dispositivos.values_list('id', flat=True):
+            mediciones = Medicion.objects.filter(dispositivo_id=dispositivo_id, fecha__lt=limites_mes(hasta)[1])
+            mes = desde or date.min
+            while mes <= hasta:
+                # Primera medición desde el inicio del mes: salta los meses sin datos
+                siguiente = mediciones
+                if mes != date.min:
+                    siguiente = siguiente.filter(fecha__gte=limites_mes(mes)[0])
+                siguiente = siguiente.order_by('fecha').values_list('fecha', flat=True).first()
+                if siguiente is None:
+                    break
+                mes = timezone.localdate(siguiente).replace(day=1)
+                if mes > hasta:
+                    break
+                cantidad = archivar_mes(dispositivo_id, mes)
+                if cantidad:
+                    archivos += 1
+                    filas += cantidad
+                    self.stdout.write(f'Dispositivo {dispositivo_id} {mes:%Y-%m}: {cantidad} mediciones')
+                mes = mes_siguiente(mes)
+
+        self.stdout.write(self.style.SUCCESS(f'{archivos} archivos escritos con {filas} mediciones'))
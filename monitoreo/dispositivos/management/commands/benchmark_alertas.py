@@ -0,0 +1,110 @@
+import json
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from dispositivos.alertas import LIBERA, UMBRALES_POR_DEFECTO, TablaVectorizada, clasificar, np
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara la evaluación de umbrales de alerta lectura por lectura con la '
+        'vectorizada en NumPy, sobre lotes sintéticos en memoria (no usa la base).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--dispositivos', type=int, default=5000)
+        parser.add_argument('--con-perfil', type=float, default=0.5,
+                            help='Fracción de dispositivos con umbrales propios')
+        parser.add_argument('--repeticiones', type=int, default=3)
+        parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('NumPy no está instalado')
+
+        rng = random.Random(1)
+        dispositivo_ids = rng.sample(range(1, options['dispositivos'] * 10), options['dispositivos'])
+        umbrales = {}
+        for dispositivo_id in dispositivo_ids:
+            if rng.random() < options['con_perfil']:
+                watts = rng.choice([15, 120, 2500]) / 1000
+                umbrales[dispositivo_id] = (3 * watts, 2 * watts, None if rng.random() < 0.3 else 1.5 * watts)
+        histeresis = settings.ALERTAS_HISTERESIS
+        tabla = TablaVectorizada(umbrales, histeresis)
+
+        resultados = []
+        for tamano in options['tamanos']:
+            dispositivos = [rng.choice(dispositivo_ids) for _ in range(tamano)]
+            consumos = [round(rng.uniform(0, 120), 2) for _ in range(tamano)]
+            resultados.append(self._medir(tabla, umbrales, histeresis, dispositivos, consumos, options['repeticiones']))
+            self.stderr.write(f'{tamano} lecturas medidas')
+
+        resultado = {
+            'fecha': timezone.now().isoformat(),
+            'numpy': np.__version__,
+            'parametros': {
+                'dispositivos': options['dispositivos'],
+                'histeresis': histeresis,
+                'con_perfil': options['con_perfil'],
+                'repeticiones': options['repeticiones'],
+            },
+            'resultados': resultados,
+        }
+        self.stdout.write(json.dumps(resultado, indent=2))
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                json.dump(resultado, archivo, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['salida']}"))
+
+    def _medir(self, tabla, umbrales, histeresis, dispositivos, consumos, repeticiones):
+        def escalar():
+            disparos = []
+            for posicion, (dispositivo_id, consumo) in enumerate(zip(dispositivos, consumos)):
+                resultado = clasificar(consumo, umbrales.get(dispositivo_id, UMBRALES_POR_DEFECTO), histeresis)
+                if resultado is not None:
+                    disparos.append((posicion, resultado[0]))
+            return disparos
+
+        arreglo_dispositivos = np.array(dispositivos, dtype=np.int64)
+        arreglo_consumos = np.array(consumos, dtype=np.float64)
+
+        def vectorizado():
+            return tabla.evaluar(arreglo_dispositivos, arreglo_consumos)
+
+        def vectorizado_con_conversion():
+            # Incluye pasar las listas de Python a arreglos, como en la ingesta
+            return tabla.evaluar(
+                np.fromiter(dispositivos, dtype=np.int64, count=len(dispositivos)),
+                np.fromiter(consumos, dtype=np.float64, count=len(consumos)),
+            )
+
+        tiempos = {}
+        for nombre, funcion in (('escalar', escalar), ('vectorizado', vectorizado),
+                                ('vectorizado_con_conversion', vectorizado_con_conversion)):
+            muestras = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                funcion()
+                muestras.append(time.perf_counter() - inicio)
+            tiempos[nombre] = statistics.median(muestras)
+
+        # Ambas implementaciones deben disparar y liberar en las mismas lecturas y niveles
+        posiciones, niveles, _ = vectorizado()
+        coinciden = escalar() == list(zip(posiciones.tolist(), niveles.tolist()))
+
+        return {
+            'lecturas': len(consumos),
+            'disparos': int((niveles != LIBERA).sum()),
+            'liberaciones': int((niveles == LIBERA).sum()),
+            'coinciden': coinciden,
+            'escalar_ms': round(tiempos['escalar'] * 1000, 2),
+            'vectorizado_ms': round(tiempos['vectorizado'] * 1000, 2),
+            'vectorizado_con_conversion_ms': round(tiempos['vectorizado_con_conversion'] * 1000, 2),
+            'aceleracion': round(tiempos['escalar'] / tiempos['vectorizado'], 1),
+        }
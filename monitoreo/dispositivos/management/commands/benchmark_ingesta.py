@@ -0,0 +1,174 @@
+import json
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from dispositivos.benchmark import base_de_prueba, organizacion_temporal
+from dispositivos.binario import codificar_lote, decodificar_lote
+from dispositivos.ingesta import guardar_validas, procesar_lote
+from dispositivos.models import Dispositivo, Zona
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el rendimiento de la ingesta de mediciones con gateways sintéticos '
+        'concurrentes. Se ejecuta en una base de datos de prueba (test_<NAME>) '
+        'que crea y destruye, nunca en la real; en MySQL el usuario necesita '
+        'permiso para crear bases de datos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gateways', type=int, default=4, help='Hilos concurrentes')
+        parser.add_argument('--lotes', type=int, default=20, help='Lotes por gateway')
+        parser.add_argument('--tamano-lote', type=int, default=500)
+        parser.add_argument('--dispositivos', type=int, default=50)
+        parser.add_argument('--formato', choices=['json', 'binario'], default='json')
+        parser.add_argument('--con-secuencia', action='store_true', help='Incluir secuencias (deduplicación)')
+        parser.add_argument('--sin-alertas', action='store_true', help='Desactivar el motor de alertas y el detector de anomalías')
+        parser.add_argument('--medir-memoria', action='store_true', help='Usar tracemalloc (reduce el rendimiento)')
+        parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+        parser.add_argument('--conservar-base', action='store_true',
+                            help='Reutilizar la base de prueba entre ejecuciones (como test --keepdb)')
+
+    def handle(self, *args, **options):
+        with base_de_prueba(options['conservar_base']), organizacion_temporal('Benchmark ingesta') as organizacion:
+            zona = Zona.objects.create(nombre='Benchmark', organizacion=organizacion)
+            Dispositivo.objects.bulk_create([
+                Dispositivo(nombre=f'Bench {i}', zona=zona, watts=random.choice([15, 120, 2500]))
+                for i in range(options['dispositivos'])
+            ])
+            dispositivo_ids = list(Dispositivo.objects.filter(zona=zona).values_list('id', flat=True))
+            with override_settings(ALERTAS_ACTIVAS=not options['sin_alertas'],
+                                   ANOMALIAS_ACTIVAS=not options['sin_alertas']):
+                resultado = self._ejecutar(options, organizacion, dispositivo_ids)
+
+        self.stdout.write(json.dumps(resultado, indent=2))
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                json.dump(resultado, archivo, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['salida']}"))
+
+    def _lote_sintetico(self, dispositivo_ids, tamano, secuencias):
+        ahora = timezone.now()
+        lecturas = []
+        for i in range(tamano):
+            dispositivo_id = random.choice(dispositivo_ids)
+            lectura = {
+                'dispositivo': dispositivo_id,
+                'consumo': round(random.uniform(0.5, 120), 2),
+                'fecha': ahora - timedelta(seconds=random.randint(0, 3600)),
+            }
+            if secuencias is not None:
+                secuencias[dispositivo_id] += 1
+                lectura['secuencia'] = secuencias[dispositivo_id]
+            lecturas.append(lectura)
+        return lecturas
+
+    def _ejecutar(self, options, organizacion, dispositivo_ids):
+        latencias = []
+        creadas = []
+        errores = []
+        lock = threading.Lock()
+        # Cada gateway lleva sus propias secuencias para no chocar con otro
+        secuencias_por_gateway = [
+            {d: g * 10_000_000 for d in dispositivo_ids} if options['con_secuencia'] else None
+            for g in range(options['gateways'])
+        ]
+
+        def gateway(numero):
+            try:
+                for _ in range(options['lotes']):
+                    lecturas = self._lote_sintetico(
+                        dispositivo_ids, options['tamano_lote'], secuencias_por_gateway[numero]
+                    )
+                    if options['formato'] == 'binario':
+                        cuerpo = codificar_lote(sorted(
+                            ((l['dispositivo'], l['fecha'], l['consumo']) for l in lecturas),
+                            key=lambda l: l[1],
+                        ))
+                    else:
+                        for lectura in lecturas:
+                            lectura['fecha'] = lectura['fecha'].isoformat()
+                    # Lote completo: validación, deduplicación, INSERT, resúmenes,
+                    # alertas y commit. No es solo la latencia del commit.
+                    inicio = time.perf_counter()
+                    try:
+                        if options['formato'] == 'binario':
+                            validas, errores_lote = decodificar_lote(cuerpo)
+                            r = guardar_validas(validas, errores_lote, len(lecturas), organizacion)
+                        else:
+                            r = procesar_lote(lecturas, organizacion=organizacion)
+                    except Exception as e:
+                        with lock:
+                            errores.append(str(e))
+                        continue
+                    transcurrido = time.perf_counter() - inicio
+                    with lock:
+                        latencias.append(transcurrido)
+                        creadas.append(r['creadas'])
+            finally:
+                connections.close_all()
+
+        if options['medir_memoria']:
+            tracemalloc.start()
+        hilos = [threading.Thread(target=gateway, args=(g,)) for g in range(options['gateways'])]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        total = time.perf_counter() - inicio
+        memoria_pico = None
+        if options['medir_memoria']:
+            _, memoria_pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        filas = sum(creadas)
+        resultado = {
+            'fecha': timezone.now().isoformat(),
+            'django': django.get_version(),
+            'motor': connection.vendor,
+            'parametros': {
+                'gateways': options['gateways'],
+                'lotes': options['lotes'],
+                'tamano_lote': options['tamano_lote'],
+                'dispositivos': options['dispositivos'],
+                'formato': options['formato'],
+                'con_secuencia': options['con_secuencia'],
+                'alertas': not options['sin_alertas'],
+            },
+            'resultados': {
+                'filas': filas,
+                'segundos': round(total, 3),
+                'filas_por_segundo': round(filas / total, 1) if total else 0,
+                'lotes_ok': len(latencias),
+                'lotes_con_error': len(errores),
+                'latencia_lote_p50_ms': round(percentil(latencias, 50) * 1000, 2),
+                'latencia_lote_p99_ms': round(percentil(latencias, 99) * 1000, 2),
+                'latencia_lote_media_ms': round(statistics.mean(latencias) * 1000, 2) if latencias else 0,
+            },
+        }
+        if memoria_pico is not None:
+            # Con varios gateways el pico incluye los lotes en vuelo de todos
+            resultado['resultados']['memoria_pico_kb'] = round(memoria_pico / 1024, 1)
+            resultado['resultados']['memoria_por_lote_kb'] = round(memoria_pico / 1024 / options['gateways'], 1)
+        if errores:
+            resultado['errores'] = errores[:10]
+        return resultado
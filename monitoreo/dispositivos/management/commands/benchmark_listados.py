@@ -0,0 +1,120 @@
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import django
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils import timezone
+
+from dispositivos.benchmark import base_de_prueba, organizacion_temporal
+from dispositivos.models import Dispositivo, Medicion, Zona
+from dispositivos.views import filtrar_rango_fechas
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide la latencia del listado de mediciones filtrado por dispositivo y '
+        'fecha a medida que crece la tabla. La densidad por día es constante, '
+        'así que con índices la latencia no debería crecer con el tamaño. '
+        'Se ejecuta en una base de datos de prueba (test_<NAME>) que crea y '
+        'destruye, nunca en la real.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', type=int, nargs='+', default=[10000, 50000, 200000],
+                            help='Filas totales de la organización en cada medición')
+        parser.add_argument('--dispositivos', type=int, default=20)
+        parser.add_argument('--por-dia', type=int, default=2000, help='Mediciones por día')
+        parser.add_argument('--repeticiones', type=int, default=20)
+        parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+        parser.add_argument('--conservar-base', action='store_true',
+                            help='Reutilizar la base de prueba entre ejecuciones (como test --keepdb)')
+
+    def handle(self, *args, **options):
+        with base_de_prueba(options['conservar_base']), organizacion_temporal('Benchmark listados') as organizacion:
+            zona = Zona.objects.create(nombre='Benchmark', organizacion=organizacion)
+            Dispositivo.objects.bulk_create([
+                Dispositivo(nombre=f'Bench {i}', zona=zona, watts=100)
+                for i in range(options['dispositivos'])
+            ])
+            dispositivo_ids = list(Dispositivo.objects.filter(zona=zona).values_list('id', flat=True))
+            resultado = self._ejecutar(options, dispositivo_ids)
+
+        self.stdout.write(json.dumps(resultado, indent=2))
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                json.dump(resultado, archivo, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['salida']}"))
+
+    def _sembrar(self, dispositivo_ids, desde_fila, hasta_fila, por_dia, hoy):
+        # Se llena hacia atrás desde hoy: el día consultado siempre tiene la
+        # misma cantidad de filas y solo crece el historial. Se inserta directo
+        # en Medicion (sin resúmenes) porque aquí solo interesa el listado.
+        segundos_por_fila = 86400 / por_dia
+        lote = []
+        for fila in range(desde_fila, hasta_fila):
+            dia = hoy - timedelta(days=fila // por_dia)
+            lote.append(Medicion(
+                dispositivo_id=dispositivo_ids[fila % len(dispositivo_ids)],
+                consumo=round(random.uniform(0.5, 120), 2),
+                fecha=timezone.make_aware(datetime(dia.year, dia.month, dia.day))
+                + timedelta(seconds=(fila % por_dia) * segundos_por_fila),
+            ))
+            if len(lote) >= 5000:
+                Medicion.objects.bulk_create(lote)
+                lote = []
+        if lote:
+            Medicion.objects.bulk_create(lote)
+
+    def _medir(self, construir, repeticiones):
+        latencias = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            # Lo mismo que hace la vista: COUNT del paginador y primera página
+            pagina = Paginator(construir().order_by('-fecha'), 10).get_page(1)
+            list(pagina.object_list)
+            latencias.append(time.perf_counter() - inicio)
+        return round(statistics.median(latencias) * 1000, 3)
+
+    def _ejecutar(self, options, dispositivo_ids):
+        hoy = timezone.localdate()
+        dia = hoy.isoformat()
+        dispositivo_id = dispositivo_ids[0]
+        base = Medicion.objects.select_related('dispositivo', 'dispositivo__zona').filter(
+            dispositivo_id=dispositivo_id
+        )
+
+        def por_rango():
+            return filtrar_rango_fechas(base, dia, dia)[0]
+
+        def por_fecha_date():
+            return base.filter(fecha__date__gte=dia, fecha__date__lte=dia)
+
+        filas = 0
+        mediciones = []
+        for tamano in sorted(options['tamanos']):
+            self._sembrar(dispositivo_ids, filas, tamano, options['por_dia'], hoy)
+            filas = tamano
+            mediciones.append({
+                'filas': filas,
+                'rango_semiabierto_ms': self._medir(por_rango, options['repeticiones']),
+                'fecha_date_ms': self._medir(por_fecha_date, options['repeticiones']),
+            })
+            self.stderr.write(f'{filas} filas medidas')
+
+        return {
+            'fecha': timezone.now().isoformat(),
+            'django': django.get_version(),
+            'motor': connection.vendor,
+            'parametros': {
+                'dispositivos': options['dispositivos'],
+                'por_dia': options['por_dia'],
+                'repeticiones': options['repeticiones'],
+            },
+            'consulta': str(por_rango().order_by('-fecha')[:10].query),
+            'resultados': mediciones,
+        }
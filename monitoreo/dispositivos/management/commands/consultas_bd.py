@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dispositivos.replicas import INTERVALO_VOLCADO, consultas_acumuladas, reiniciar_consultas
+from monitoreo.pool_mysql.pool import CONTADORES, estadisticas_acumuladas, reiniciar_estadisticas
+
+
+def _aliases_con_pool():
+    return [alias for alias, db in settings.DATABASES.items() if db['ENGINE'] == 'monitoreo.pool_mysql']
+
+
+class Command(BaseCommand):
+    help = (
+        'Muestra las consultas SQL hechas por las peticiones web en cada base '
+        '(primaria y réplicas) y las estadísticas del pool de conexiones, sumadas '
+        f'entre todos los workers. Los workers vuelcan sus contadores cada {INTERVALO_VOLCADO} s '
+        'aproximadamente.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reiniciar', action='store_true', help='Poner los contadores en cero')
+
+    def handle(self, *args, **options):
+        if options['reiniciar']:
+            reiniciar_consultas()
+            reiniciar_estadisticas(_aliases_con_pool())
+            self.stdout.write(self.style.SUCCESS('Contadores reiniciados'))
+            return
+
+        consultas = consultas_acumuladas()
+        total = sum(consultas.values())
+        for alias, cantidad in consultas.items():
+            porcentaje = 100 * cantidad / total if total else 0
+            self.stdout.write(f'{alias:<12} {cantidad:>12} consultas  {porcentaje:5.1f}%')
+        replicas = total - consultas.get('default', 0)
+        if total:
+            self.stdout.write(self.style.SUCCESS(f'{100 * replicas / total:.1f}% de las consultas en réplicas'))
+
+        for alias, contadores in estadisticas_acumuladas(_aliases_con_pool()).items():
+            self.stdout.write(f'\nPool de conexiones {alias}:')
+            for nombre in CONTADORES:
+                self.stdout.write(f'  {nombre:<16} {contadores[nombre]:>12}')
+            if contadores['pedidas']:
+                reuso = 100 * contadores['reutilizadas'] / contadores['pedidas']
+                self.stdout.write(self.style.SUCCESS(f'  {reuso:.1f}% de las conexiones reutilizadas'))
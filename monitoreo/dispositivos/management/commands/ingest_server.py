@@ -0,0 +1,382 @@
+import asyncio
+import json
+import logging
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from dispositivos.ingesta import LecturaInvalida, guardar_mediciones, validar_lectura
+from dispositivos.models import Dispositivo, Medicion
+
+logger = logging.getLogger('dispositivos')
+
+
+def parsear_linea(linea):
+    """
+    Convierte una línea del protocolo en un dict de lectura.
+    Formato: "<dispositivo_id> <timestamp> <kwh> [secuencia]", separado por
+    espacios o comas; el timestamp es epoch en segundos o ISO 8601.
+    """
+    partes = linea.replace(',', ' ').split()
+    if len(partes) not in (3, 4):
+        raise LecturaInvalida('Formato esperado: dispositivo timestamp kwh [secuencia]')
+    dato = {'dispositivo': partes[0], 'consumo': partes[2]}
+    try:
+        dato['fecha'] = float(partes[1])
+    except ValueError:
+        dato['fecha'] = partes[1]
+    if len(partes) == 4:
+        dato['secuencia'] = partes[3]
+    return dato
+
+
+class LimitesLocales:
+    """
+    Token buckets por dispositivo y por organización en la memoria del
+    servidor, con las mismas tasas que la API (INGESTA_LIMITE_*). El servidor
+    es un solo proceso, así que no necesita la caché compartida, y comprobar
+    cada línea cuesta una operación en memoria.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+
+    def _espera(self, clave, tasa, rafaga, ahora):
+        fichas, instante = self.buckets.get(clave, (rafaga, ahora))
+        fichas = min(rafaga, fichas + (ahora - instante) * tasa)
+        self.buckets[clave] = (fichas, ahora)
+        return 0 if fichas >= 1 else (1 - fichas) / tasa
+
+    def consumir(self, dispositivo_id, organizacion_id):
+        """Descuenta una lectura y devuelve 0, o los segundos a esperar sin descontar nada."""
+        if not settings.INGESTA_LIMITE_ACTIVO:
+            return 0
+        ahora = time.monotonic()
+        limite_disp = settings.INGESTA_LIMITE_DISPOSITIVO
+        limite_org = settings.INGESTA_LIMITE_ORGANIZACION
+        claves = (
+            (('disp', dispositivo_id), limite_disp['TASA'], limite_disp['RAFAGA']),
+            (('org', organizacion_id), limite_org['TASA'], limite_org['RAFAGA']),
+        )
+        espera = max(self._espera(clave, tasa, rafaga, ahora) for clave, tasa, rafaga in claves)
+        if espera:
+            return espera
+        for clave, _, _ in claves:
+            fichas, instante = self.buckets[clave]
+            self.buckets[clave] = (fichas - 1, instante)
+        return 0
+
+
+class Metricas:
+    def __init__(self):
+        self.recibidas = 0
+        self.invalidas = 0
+        self.descartadas = 0
+        self.limitadas = 0
+        self.guardadas = 0
+        self.duplicadas = 0
+        self.vaciados = 0
+        self.errores_escritura = 0
+        self.perdidas = 0
+        self.latencia_ultima_ms = 0.0
+        self.latencia_max_ms = 0.0
+        self.latencia_total_ms = 0.0
+        self.conexiones = 0
+
+    def como_dict(self, profundidad_cola):
+        return {
+            'cola': profundidad_cola,
+            'conexiones': self.conexiones,
+            'recibidas': self.recibidas,
+            'invalidas': self.invalidas,
+            'descartadas': self.descartadas,
+            'limitadas': self.limitadas,
+            'guardadas': self.guardadas,
+            'duplicadas': self.duplicadas,
+            'vaciados': self.vaciados,
+            'errores_escritura': self.errores_escritura,
+            'perdidas': self.perdidas,
+            'latencia_ultima_ms': round(self.latencia_ultima_ms, 2),
+            'latencia_max_ms': round(self.latencia_max_ms, 2),
+            'latencia_media_ms': round(self.latencia_total_ms / self.vaciados, 2) if self.vaciados else 0.0,
+        }
+
+
+class ServidorIngesta:
+    def __init__(self, max_filas, max_espera_ms, max_cola, intervalo_metricas, refresco_dispositivos):
+        self.max_filas = max_filas
+        self.max_espera = max_espera_ms / 1000
+        self.intervalo_metricas = intervalo_metricas
+        self.refresco_dispositivos = refresco_dispositivos
+        self.cola = asyncio.Queue(maxsize=max_cola)
+        self.metricas = Metricas()
+        self.limites = LimitesLocales()
+        # {dispositivo_id: organizacion_id}
+        self.dispositivos = {}
+        # Un solo hilo para el ORM: una conexión a la base de datos y
+        # escrituras en orden
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingesta-db')
+        self.detener = asyncio.Event()
+
+    def _cargar_dispositivos(self):
+        close_old_connections()
+        return dict(Dispositivo.objects.values_list('id', 'zona__organizacion_id'))
+
+    def _guardar(self, lote):
+        close_old_connections()
+        return len(guardar_mediciones(lote))
+
+    def _guardar_por_fila(self, lote):
+        """
+        Reintento de un lote fallido fila por fila, para que una sola lectura
+        problemática (p. ej. de un dispositivo borrado después del último
+        refresco) no haga perder las demás. Devuelve (guardadas, fallidas,
+        ids de los dispositivos de las fallidas que ya no existen).
+        """
+        close_old_connections()
+        guardadas = 0
+        fallidas = []
+        for medicion in lote:
+            try:
+                guardadas += len(guardar_mediciones([medicion]))
+            except Exception as e:
+                logger.warning(
+                    f'ingest_server: lectura de dispositivo {medicion.dispositivo_id} descartada: {str(e)}'
+                )
+                fallidas.append(medicion)
+        inexistentes = set()
+        if fallidas:
+            ids = {m.dispositivo_id for m in fallidas}
+            inexistentes = ids - set(Dispositivo.todos.filter(id__in=ids).values_list('id', flat=True))
+        return guardadas, fallidas, inexistentes
+
+    async def _ejecutar_db(self, funcion, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, funcion, *args)
+
+    def _validar(self, linea):
+        dispositivo_id, consumo, fecha, secuencia = validar_lectura(parsear_linea(linea))
+        if dispositivo_id not in self.dispositivos:
+            raise LecturaInvalida('Dispositivo no encontrado.')
+        return Medicion(dispositivo_id=dispositivo_id, consumo=consumo, fecha=fecha, secuencia=secuencia)
+
+    async def _esperar_limite(self, medicion):
+        """
+        Espera a que el dispositivo y su organización tengan fichas. Mientras,
+        no se lee más de esta conexión: el gateway recibe contrapresión vía
+        TCP sin frenar a los demás. Devuelve False si la espera se agota.
+        """
+        organizacion_id = self.dispositivos.get(medicion.dispositivo_id)
+        limite = time.monotonic() + settings.INGESTA_LIMITE_MAX_ESPERA_FLUJO
+        while True:
+            espera = self.limites.consumir(medicion.dispositivo_id, organizacion_id)
+            if not espera:
+                return True
+            if time.monotonic() + espera > limite:
+                return False
+            await asyncio.sleep(espera)
+
+    async def atender_tcp(self, reader, writer):
+        self.metricas.conexiones += 1
+        try:
+            while not self.detener.is_set():
+                linea = await reader.readline()
+                if not linea:
+                    break
+                texto = linea.decode('utf-8', errors='replace').strip()
+                if not texto:
+                    continue
+                if texto.upper() == 'STATS':
+                    writer.write((json.dumps(self.metricas.como_dict(self.cola.qsize())) + '\n').encode())
+                    await writer.drain()
+                    continue
+                self.metricas.recibidas += 1
+                try:
+                    medicion = self._validar(texto)
+                except LecturaInvalida as e:
+                    self.metricas.invalidas += 1
+                    writer.write(f'ERR {e}\n'.encode())
+                    await writer.drain()
+                    continue
+                if not await self._esperar_limite(medicion):
+                    self.metricas.limitadas += 1
+                    writer.write('ERR Límite de ingesta excedido.\n'.encode())
+                    await writer.drain()
+                    continue
+                # Si la cola está llena se deja de leer el socket: el gateway
+                # recibe contrapresión vía TCP en vez de perder lecturas
+                await self.cola.put(medicion)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            self.metricas.conexiones -= 1
+            writer.close()
+
+    def recibir_udp(self, datos):
+        for linea in datos.decode('utf-8', errors='replace').splitlines():
+            linea = linea.strip()
+            if not linea:
+                continue
+            self.metricas.recibidas += 1
+            try:
+                medicion = self._validar(linea)
+            except LecturaInvalida:
+                self.metricas.invalidas += 1
+                continue
+            # UDP no tiene contrapresión: lo que excede el límite se descarta
+            if self.limites.consumir(medicion.dispositivo_id, self.dispositivos.get(medicion.dispositivo_id)):
+                self.metricas.limitadas += 1
+                continue
+            try:
+                self.cola.put_nowait(medicion)
+            except asyncio.QueueFull:
+                # UDP no tiene contrapresión: se descarta y se cuenta
+                self.metricas.descartadas += 1
+
+    async def escritor(self):
+        # Se sondea la cola con get_nowait en vez de wait_for(cola.get()), que
+        # en algunas versiones de Python puede perder un elemento al expirar.
+        while True:
+            if self.cola.empty():
+                if self.detener.is_set():
+                    return
+                await asyncio.sleep(self.max_espera)
+                continue
+            lote = []
+            limite = time.monotonic() + self.max_espera
+            while True:
+                while len(lote) < self.max_filas and not self.cola.empty():
+                    lote.append(self.cola.get_nowait())
+                restante = limite - time.monotonic()
+                if len(lote) >= self.max_filas or restante <= 0 or self.detener.is_set():
+                    break
+                await asyncio.sleep(min(restante, 0.005))
+            await self._vaciar(lote)
+
+    async def _vaciar(self, lote):
+        inicio = time.perf_counter()
+        fallidas = []
+        try:
+            guardadas = await self._ejecutar_db(self._guardar, lote)
+        except Exception as e:
+            self.metricas.errores_escritura += 1
+            logger.error(
+                f'ingest_server: error guardando lote de {len(lote)} lecturas, reintentando por fila: {str(e)}'
+            )
+            try:
+                guardadas, fallidas, inexistentes = await self._ejecutar_db(self._guardar_por_fila, lote)
+            except Exception as e:
+                # Sin base de datos no tiene sentido seguir fila por fila
+                logger.error(f'ingest_server: {len(lote)} lecturas perdidas: {str(e)}')
+                self.metricas.perdidas += len(lote)
+                return
+            self.metricas.perdidas += len(fallidas)
+            # Los dispositivos que ya no existen dejan de aceptarse sin esperar al refresco
+            for dispositivo_id in inexistentes:
+                self.dispositivos.pop(dispositivo_id, None)
+        latencia = (time.perf_counter() - inicio) * 1000
+        self.metricas.vaciados += 1
+        self.metricas.guardadas += guardadas
+        self.metricas.duplicadas += len(lote) - len(fallidas) - guardadas
+        self.metricas.latencia_ultima_ms = latencia
+        self.metricas.latencia_max_ms = max(self.metricas.latencia_max_ms, latencia)
+        self.metricas.latencia_total_ms += latencia
+
+    async def refrescar_dispositivos(self):
+        while not self.detener.is_set():
+            try:
+                await asyncio.wait_for(self.detener.wait(), timeout=self.refresco_dispositivos)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                self.dispositivos = await self._ejecutar_db(self._cargar_dispositivos)
+            except Exception as e:
+                logger.error(f'ingest_server: error refrescando dispositivos: {str(e)}')
+
+    async def informar_metricas(self):
+        while not self.detener.is_set():
+            try:
+                await asyncio.wait_for(self.detener.wait(), timeout=self.intervalo_metricas)
+            except asyncio.TimeoutError:
+                pass
+            logger.info(f'ingest_server: {json.dumps(self.metricas.como_dict(self.cola.qsize()))}')
+
+
+class _ProtocoloUDP(asyncio.DatagramProtocol):
+    def __init__(self, servidor):
+        self.servidor = servidor
+
+    def datagram_received(self, data, addr):
+        self.servidor.recibir_udp(data)
+
+
+class Command(BaseCommand):
+    help = (
+        'Servidor asyncio TCP/UDP para gateways con protocolo de líneas '
+        '"dispositivo timestamp kwh [secuencia]". No autentica: escuche solo '
+        'en redes privadas o detrás de un túnel.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--puerto-tcp', type=int, default=9400, help='0 desactiva TCP')
+        parser.add_argument('--puerto-udp', type=int, default=9400, help='0 desactiva UDP')
+        parser.add_argument('--max-filas', type=int, default=1000, help='Filas máximas por INSERT')
+        parser.add_argument('--max-espera-ms', type=float, default=50, help='Espera máxima antes de vaciar un lote')
+        parser.add_argument('--max-cola', type=int, default=100000, help='Lecturas pendientes antes de aplicar contrapresión')
+        parser.add_argument('--intervalo-metricas', type=float, default=10, help='Segundos entre reportes de métricas')
+        parser.add_argument('--refresco-dispositivos', type=float, default=60, help='Segundos entre recargas de dispositivos')
+
+    def handle(self, *args, **options):
+        asyncio.run(self._servir(options))
+
+    async def _servir(self, options):
+        servidor = ServidorIngesta(
+            max_filas=options['max_filas'],
+            max_espera_ms=options['max_espera_ms'],
+            max_cola=options['max_cola'],
+            intervalo_metricas=options['intervalo_metricas'],
+            refresco_dispositivos=options['refresco_dispositivos'],
+        )
+        servidor.dispositivos = await servidor._ejecutar_db(servidor._cargar_dispositivos)
+
+        loop = asyncio.get_running_loop()
+        for senal in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(senal, servidor.detener.set)
+            except NotImplementedError:
+                pass
+
+        tcp = udp = None
+        if options['puerto_tcp']:
+            tcp = await asyncio.start_server(
+                servidor.atender_tcp, options['host'], options['puerto_tcp'], backlog=4096
+            )
+            self.stdout.write(f"Escuchando TCP en {options['host']}:{options['puerto_tcp']}")
+        if options['puerto_udp']:
+            udp, _ = await loop.create_datagram_endpoint(
+                lambda: _ProtocoloUDP(servidor), local_addr=(options['host'], options['puerto_udp'])
+            )
+            self.stdout.write(f"Escuchando UDP en {options['host']}:{options['puerto_udp']}")
+
+        tareas = [
+            asyncio.create_task(servidor.escritor()),
+            asyncio.create_task(servidor.refrescar_dispositivos()),
+            asyncio.create_task(servidor.informar_metricas()),
+        ]
+        await servidor.detener.wait()
+
+        # Dejar de aceptar lecturas y vaciar la cola antes de salir
+        if tcp is not None:
+            tcp.close()
+        if udp is not None:
+            udp.close()
+        await asyncio.gather(*tareas)
+        servidor.executor.shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'Servidor detenido: {servidor.metricas.guardadas} lecturas guardadas'
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dispositivos.particiones import (
+    ErrorParticiones, activar, crear_futuras, eliminar_vencidas, limite_vencido, particiones,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Particionado mensual de la tabla de mediciones (solo MySQL). Sin opciones '
+        'lista las particiones. --activar convierte la tabla (reescritura completa, '
+        'usar en mantenimiento); --crear-futuras y --eliminar-vencidas son para cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--activar', action='store_true', help='Particionar la tabla por mes')
+        parser.add_argument('--crear-futuras', action='store_true', help='Crear las particiones de los próximos meses')
+        parser.add_argument('--eliminar-vencidas', action='store_true',
+                            help='Eliminar los meses vencidos según las políticas de retención')
+        parser.add_argument('--meses-adelante', type=int, default=3)
+        parser.add_argument('--sin-plegar', action='store_true',
+                            help='No plegar en los resúmenes antes de eliminar (los datos se pierden)')
+
+    def handle(self, *args, **options):
+        if options['meses_adelante'] < 0:
+            raise CommandError('--meses-adelante no puede ser negativo')
+        try:
+            if options['activar']:
+                creadas = activar(options['meses_adelante'])
+                self.stdout.write(self.style.SUCCESS(f'Tabla particionada en {creadas} meses'))
+            if options['crear_futuras']:
+                nuevos = crear_futuras(options['meses_adelante'])
+                self.stdout.write(f"Particiones creadas: {', '.join(f'{m:%Y-%m}' for m in nuevos) or 'ninguna'}")
+            if options['eliminar_vencidas']:
+                if limite_vencido() is None:
+                    self.stdout.write(self.style.WARNING(
+                        'Hay organizaciones con dispositivos y sin política de retención: no se elimina nada'
+                    ))
+                eliminados = eliminar_vencidas(plegar_antes=not options['sin_plegar'])
+                self.stdout.write(f"Particiones eliminadas: {', '.join(f'{m:%Y-%m}' for m in eliminados) or 'ninguna'}")
+
+            meses = particiones()
+        except ErrorParticiones as e:
+            raise CommandError(str(e))
+
+        if not meses:
+            self.stdout.write('La tabla de mediciones no está particionada.')
+            return
+        self.stdout.write(f'{len(meses)} particiones mensuales: {meses[0]:%Y-%m} a {meses[-1]:%Y-%m}')
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from dispositivos.purga import PAUSA_MS, TAMANO_CHUNK, pendientes, purgar
+
+
+class Command(BaseCommand):
+    help = (
+        'Borra por lotes las mediciones, alertas y resúmenes de los dispositivos y '
+        'zonas marcados como eliminados, y luego el objeto. El avance queda en '
+        'Purga (admin). Ejecutar una sola instancia, por cron o con --continuo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamano-chunk', type=int, default=TAMANO_CHUNK, help='Filas por transacción')
+        parser.add_argument('--pausa-ms', type=float, default=PAUSA_MS, help='Pausa entre transacciones')
+        parser.add_argument('--reintentar-errores', action='store_true')
+        parser.add_argument('--continuo', type=float, metavar='SEGUNDOS',
+                            help='No terminar: buscar purgas pendientes cada SEGUNDOS')
+
+    def handle(self, *args, **options):
+        if options['tamano_chunk'] < 1:
+            raise CommandError('--tamano-chunk debe ser mayor que 0')
+
+        while True:
+            for purga in pendientes(options['reintentar_errores']):
+                self.stdout.write(f'Purgando {purga.get_tipo_display().lower()} {purga.nombre} (#{purga.objeto_id})...')
+                purga = purgar(purga, options['tamano_chunk'], options['pausa_ms'])
+                if purga.estado == 'terminada':
+                    self.stdout.write(self.style.SUCCESS(f'  {purga.filas} filas: {purga.progreso}'))
+                else:
+                    self.stdout.write(self.style.ERROR(f'  Error: {purga.error}'))
+            if not options['continuo']:
+                return
+            close_old_connections()
+            time.sleep(options['continuo'])
@@ -0,0 +1,40 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from dispositivos.models import Medicion
+from dispositivos.resumenes import reconstruir
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula desde Medicion los resúmenes horarios y diarios de un rango de '
+        'días (hora local). Útil tras cargas masivas fuera de la ingesta o '
+        'correcciones manuales.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Primer día (YYYY-MM-DD); por defecto el de la medición más antigua')
+        parser.add_argument('--hasta', help='Último día incluido (YYYY-MM-DD); por defecto hoy')
+        parser.add_argument('--dispositivo', type=int, help='Limitar a un dispositivo')
+
+    def handle(self, *args, **options):
+        try:
+            desde = date.fromisoformat(options['desde']) if options['desde'] else None
+            hasta = date.fromisoformat(options['hasta']) if options['hasta'] else timezone.localdate()
+        except ValueError as e:
+            raise CommandError(f'Fecha inválida: {e}')
+
+        if desde is None:
+            primera = Medicion.objects.order_by('fecha').values_list('fecha', flat=True).first()
+            if primera is None:
+                self.stdout.write('No hay mediciones.')
+                return
+            desde = timezone.localdate(primera)
+        if desde > hasta:
+            raise CommandError('--desde debe ser anterior o igual a --hasta')
+
+        self.stdout.write(f'Reconstruyendo resúmenes del {desde} al {hasta}...')
+        leidas = reconstruir(desde, hasta, dispositivo_id=options['dispositivo'])
+        self.stdout.write(self.style.SUCCESS(f'Resúmenes reconstruidos a partir de {leidas} mediciones'))
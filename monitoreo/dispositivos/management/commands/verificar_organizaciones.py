@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from dispositivos.consistencia import TAMANO_CHUNK, contar, corregir, corregir_pendientes
+
+
+class Command(BaseCommand):
+    help = (
+        'Verifica que la organización guardada en mediciones y alertas coincida con '
+        'la de la zona de su dispositivo. Con --corregir rellena y corrige las '
+        'filas en lotes pequeños (también sirve para el relleno inicial). Con '
+        '--pendientes solo corrige los dispositivos movidos de organización desde '
+        'la vista, sin recorrer toda la tabla.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corregir', action='store_true')
+        parser.add_argument('--pendientes', action='store_true',
+                            help='Corregir solo los dispositivos que cambiaron de organización')
+        parser.add_argument('--continuo', type=float, metavar='SEGUNDOS',
+                            help='Con --pendientes, no terminar: buscar pendientes cada SEGUNDOS')
+        parser.add_argument('--tamano-chunk', type=int, default=TAMANO_CHUNK, help='Filas por transacción')
+        parser.add_argument('--pausa-ms', type=float, default=0, help='Pausa entre transacciones')
+
+    def handle(self, *args, **options):
+        if options['tamano_chunk'] < 1:
+            raise CommandError('--tamano-chunk debe ser mayor que 0')
+        if options['continuo'] and not options['pendientes']:
+            raise CommandError('--continuo solo se puede usar con --pendientes')
+
+        if options['pendientes']:
+            while True:
+                corregidas = corregir_pendientes(options['tamano_chunk'], options['pausa_ms'])
+                if corregidas:
+                    self.stdout.write(self.style.SUCCESS(f'{corregidas} filas corregidas'))
+                if not options['continuo']:
+                    return
+                close_old_connections()
+                time.sleep(options['continuo'])
+
+        conteo = contar()
+        for modelo, filas in conteo.items():
+            self.stdout.write(f'{modelo}: {filas} filas inconsistentes')
+        if not any(conteo.values()):
+            self.stdout.write(self.style.SUCCESS('Organizaciones consistentes'))
+            return
+        if not options['corregir']:
+            raise CommandError('Hay filas inconsistentes; ejecute con --corregir')
+
+        corregidas = corregir(options['tamano_chunk'], options['pausa_ms'])
+        self.stdout.write(self.style.SUCCESS(f'{corregidas} filas corregidas'))
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:47
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0004_remove_zona_empresa_zona_organizacion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='medicion',
+            name='fecha',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0005_medicion_fecha_origen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicion',
+            name='secuencia',
+            field=models.PositiveBigIntegerField(blank=True, help_text='Número de secuencia del gateway, evita duplicados en reintentos', null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='medicion',
+            constraint=models.UniqueConstraint(fields=('dispositivo', 'secuencia'), name='medicion_dispositivo_secuencia_unica'),
+        ),
+    ]
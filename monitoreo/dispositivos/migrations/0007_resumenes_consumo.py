@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0006_medicion_secuencia'),
+        ('usuarios', '0003_organizacion_perfil_organizacion_perfil_rol'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.DateTimeField(help_text='Inicio del periodo')),
+                ('cantidad', models.PositiveIntegerField(default=0)),
+                ('suma', models.FloatField(default=0)),
+                ('minimo', models.FloatField()),
+                ('maximo', models.FloatField()),
+                ('ultimo', models.FloatField(help_text='Consumo de la medición más reciente del periodo')),
+                ('ultima_fecha', models.DateTimeField()),
+                ('dispositivo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dispositivos.dispositivo')),
+                ('organizacion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='usuarios.organizacion')),
+                ('zona', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='dispositivos.zona')),
+            ],
+            options={
+                'verbose_name': 'Resumen diario',
+                'verbose_name_plural': 'Resúmenes diarios',
+                'ordering': ['-periodo'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['organizacion', 'periodo'], name='resumen_dia_org_periodo'), models.Index(fields=['zona', 'periodo'], name='resumen_dia_zona_periodo')],
+                'constraints': [models.UniqueConstraint(fields=('dispositivo', 'periodo'), name='resumen_diario_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenHorario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.DateTimeField(help_text='Inicio del periodo')),
+                ('cantidad', models.PositiveIntegerField(default=0)),
+                ('suma', models.FloatField(default=0)),
+                ('minimo', models.FloatField()),
+                ('maximo', models.FloatField()),
+                ('ultimo', models.FloatField(help_text='Consumo de la medición más reciente del periodo')),
+                ('ultima_fecha', models.DateTimeField()),
+                ('dispositivo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dispositivos.dispositivo')),
+                ('organizacion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='usuarios.organizacion')),
+                ('zona', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='dispositivos.zona')),
+            ],
+            options={
+                'verbose_name': 'Resumen horario',
+                'verbose_name_plural': 'Resúmenes horarios',
+                'ordering': ['-periodo'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['organizacion', 'periodo'], name='resumen_hora_org_periodo'), models.Index(fields=['zona', 'periodo'], name='resumen_hora_zona_periodo')],
+                'constraints': [models.UniqueConstraint(fields=('dispositivo', 'periodo'), name='resumen_horario_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0007_resumenes_consumo'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alerta',
+            index=models.Index(fields=['dispositivo', 'fecha'], name='alerta_disp_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='alerta',
+            index=models.Index(fields=['fecha'], name='alerta_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='medicion',
+            index=models.Index(fields=['dispositivo', 'fecha'], name='medicion_disp_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='medicion',
+            index=models.Index(fields=['fecha'], name='medicion_fecha'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:58
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0008_indices_fecha'),
+        ('usuarios', '0003_organizacion_perfil_organizacion_perfil_rol'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PoliticaRetencion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dias_crudo', models.PositiveIntegerField(default=90, help_text='Días que se conservan las mediciones crudas', validators=[django.core.validators.MinValueValidator(1)])),
+                ('dias_horario', models.PositiveIntegerField(blank=True, default=730, help_text='Días que se conservan los resúmenes horarios; vacío = para siempre', null=True, validators=[django.core.validators.MinValueValidator(1)])),
+                ('dias_diario', models.PositiveIntegerField(blank=True, help_text='Días que se conservan los resúmenes diarios; vacío = para siempre', null=True, validators=[django.core.validators.MinValueValidator(1)])),
+                ('plegado_hasta', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('ultima_ejecucion', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('organizacion', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='politica_retencion', to='usuarios.organizacion')),
+            ],
+            options={
+                'verbose_name': 'Política de retención',
+                'verbose_name_plural': 'Políticas de retención',
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def rellenar_ultima_lectura(apps, schema_editor):
+    Dispositivo = apps.get_model('dispositivos', 'Dispositivo')
+    Medicion = apps.get_model('dispositivos', 'Medicion')
+    Alerta = apps.get_model('dispositivos', 'Alerta')
+    ultima = Medicion.objects.filter(dispositivo=OuterRef('pk')).order_by('-fecha', '-id')
+    Dispositivo.objects.update(
+        last_consumo=Subquery(ultima.values('consumo')[:1]),
+        last_fecha=Subquery(ultima.values('fecha')[:1]),
+        last_alerta=Subquery(
+            Alerta.objects.filter(dispositivo=OuterRef('pk')).order_by('-fecha', '-id').values('id')[:1]
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0009_politica_retencion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispositivo',
+            name='last_alerta',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='dispositivos.alerta'),
+        ),
+        migrations.AddField(
+            model_name='dispositivo',
+            name='last_consumo',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='dispositivo',
+            name='last_fecha',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(rellenar_ultima_lectura, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:05
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+TAMANO_CHUNK = 1000
+
+
+def rellenar_organizacion(apps, schema_editor):
+    # Recorre cada tabla por tramos de pk de a lo más TAMANO_CHUNK filas, cada
+    # tramo en su propia transacción (la migración no es atómica), como
+    # consistencia.corregir_dispositivo: nunca un UPDATE sobre la tabla
+    # entera. Si se interrumpe, se retoma con manage.py verificar_organizaciones --corregir
+    Dispositivo = apps.get_model('dispositivos', 'Dispositivo')
+    organizaciones = dict(
+        Dispositivo.objects.filter(zona__isnull=False).values_list('id', 'zona__organizacion_id')
+    )
+    for modelo in (apps.get_model('dispositivos', 'Medicion'), apps.get_model('dispositivos', 'Alerta')):
+        ultimo = 0
+        while True:
+            filas = list(
+                modelo.objects.filter(pk__gt=ultimo).order_by('pk')
+                .values_list('pk', 'dispositivo_id')[:TAMANO_CHUNK]
+            )
+            if not filas:
+                break
+            ultimo = filas[-1][0]
+            por_organizacion = {}
+            for pk, dispositivo_id in filas:
+                if dispositivo_id in organizaciones:
+                    por_organizacion.setdefault(organizaciones[dispositivo_id], []).append(pk)
+            with transaction.atomic():
+                for organizacion_id, pks in por_organizacion.items():
+                    modelo.objects.filter(pk__in=pks).update(organizacion_id=organizacion_id)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('dispositivos', '0010_ultima_lectura'),
+        ('usuarios', '0003_organizacion_perfil_organizacion_perfil_rol'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alerta',
+            name='organizacion',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='usuarios.organizacion'),
+        ),
+        migrations.AddField(
+            model_name='medicion',
+            name='organizacion',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='usuarios.organizacion'),
+        ),
+        migrations.AddIndex(
+            model_name='alerta',
+            index=models.Index(fields=['organizacion', 'fecha'], name='alerta_org_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='medicion',
+            index=models.Index(fields=['organizacion', 'fecha'], name='medicion_org_fecha'),
+        ),
+        migrations.RunPython(rellenar_organizacion, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0011_organizacion_mediciones'),
+        ('usuarios', '0003_organizacion_perfil_organizacion_perfil_rol'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispositivo',
+            name='eliminado',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='zona',
+            name='eliminado',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='Purga',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('dispositivo', 'Dispositivo'), ('zona', 'Zona')], max_length=20)),
+                ('objeto_id', models.PositiveBigIntegerField()),
+                ('nombre', models.CharField(max_length=100)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En curso'), ('terminada', 'Terminada'), ('error', 'Error')], default='pendiente', max_length=20)),
+                ('progreso', models.JSONField(blank=True, default=dict)),
+                ('error', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('terminada_en', models.DateTimeField(blank=True, null=True)),
+                ('organizacion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='usuarios.organizacion')),
+                ('solicitada_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['estado', 'created_at'], name='purga_estado')],
+            },
+        ),
+    ]
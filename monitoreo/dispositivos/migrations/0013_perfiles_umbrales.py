@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:14
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0012_eliminacion_diferida'),
+        ('usuarios', '0003_organizacion_perfil_organizacion_perfil_rol'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerfilUmbrales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100)),
+                ('categoria', models.CharField(blank=True, choices=[('Sensor', 'Sensor'), ('Actuador', 'Actuador'), ('General', 'General')], max_length=50)),
+                ('modo', models.CharField(choices=[('absoluto', 'kWh'), ('relativo', 'Múltiplo del consumo nominal')], default='absoluto', help_text='Relativo: el umbral multiplica el consumo nominal de una hora (watts / 1000 kWh)', max_length=10)),
+                ('umbral_media', models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)])),
+                ('umbral_alta', models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)])),
+                ('umbral_grave', models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)])),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('dispositivo', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='perfil_umbrales', to='dispositivos.dispositivo')),
+                ('organizacion', models.ForeignKey(blank=True, help_text='Solo para perfiles por categoría; vacío = todas las organizaciones', null=True, on_delete=django.db.models.deletion.CASCADE, to='usuarios.organizacion')),
+                ('zona', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='perfil_umbrales', to='dispositivos.zona')),
+            ],
+            options={
+                'verbose_name': 'Perfil de umbrales',
+                'verbose_name_plural': 'Perfiles de umbrales',
+            },
+        ),
+    ]
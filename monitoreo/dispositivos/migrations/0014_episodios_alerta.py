@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:20
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def cerrar_alertas_existentes(apps, schema_editor):
+    # Las alertas anteriores eran de una sola lectura: episodios ya cerrados
+    Alerta = apps.get_model('dispositivos', 'Alerta')
+    Alerta.objects.update(ultima_vez=F('fecha'), cerrada_en=F('fecha'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0013_perfiles_umbrales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alerta',
+            name='cerrada_en',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='alerta',
+            name='ocurrencias',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='alerta',
+            name='ultima_vez',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(cerrar_alertas_existentes, migrations.RunPython.noop),
+    ]
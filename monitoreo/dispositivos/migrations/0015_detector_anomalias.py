@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0014_episodios_alerta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoAnomalia',
+            fields=[
+                ('dispositivo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='dispositivos.dispositivo')),
+                ('media', models.FloatField()),
+                ('varianza', models.FloatField()),
+                ('lecturas', models.PositiveBigIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Estado de anomalías',
+                'verbose_name_plural': 'Estados de anomalías',
+            },
+        ),
+        migrations.AddField(
+            model_name='alerta',
+            name='tipo',
+            field=models.CharField(choices=[('Umbral', 'Umbral'), ('Anomalia', 'Anomalía')], default='Umbral', editable=False, max_length=10),
+        ),
+    ]
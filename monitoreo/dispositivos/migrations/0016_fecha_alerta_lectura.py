@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:33
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0015_detector_anomalias'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='alerta',
+            name='fecha',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
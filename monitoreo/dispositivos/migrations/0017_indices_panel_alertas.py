@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0016_fecha_alerta_lectura'),
+        ('usuarios', '0003_organizacion_perfil_organizacion_perfil_rol'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alerta',
+            index=models.Index(fields=['cerrada_en'], name='alerta_cerrada_en'),
+        ),
+        migrations.AddIndex(
+            model_name='alerta',
+            index=models.Index(fields=['ultima_vez'], name='alerta_ultima_vez'),
+        ),
+    ]
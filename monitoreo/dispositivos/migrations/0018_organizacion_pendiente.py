@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispositivos', '0017_indices_panel_alertas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispositivo',
+            name='organizacion_pendiente',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+    ]
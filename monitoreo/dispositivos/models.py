@@ -1,11 +1,24 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
+from django.utils import timezone
 from usuarios.models import Organizacion
 
+class ActivosManager(models.Manager):
+    """Oculta lo marcado como eliminado mientras se purga en segundo plano (ver dispositivos.purga)."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(eliminado=False)
+
+
 class Zona(models.Model):
     nombre = models.CharField(max_length=100)
     organizacion = models.ForeignKey(Organizacion, on_delete=models.CASCADE)
+    eliminado = models.BooleanField(default=False, editable=False)
+
+    objects = ActivosManager()
+    todos = models.Manager()
     
     class Meta:
         unique_together = ['nombre', 'organizacion']
@@ -23,6 +36,20 @@ class Dispositivo(models.Model):
     categoria = models.CharField(max_length=50, choices=CATEGORIAS, default="General")
     zona = models.ForeignKey(Zona, on_delete=models.CASCADE, null=True, blank=True)
     watts = models.FloatField(help_text="Consumo nominal en watts", default=0)
+    # Estado actual desnormalizado: lo mantiene la ingesta en la misma
+    # transacción que el INSERT (ver dispositivos.ingesta)
+    last_consumo = models.FloatField(null=True, blank=True, editable=False)
+    last_fecha = models.DateTimeField(null=True, blank=True, editable=False)
+    last_alerta = models.ForeignKey(
+        'Alerta', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+'
+    )
+    eliminado = models.BooleanField(default=False, editable=False)
+    # Cambió de organización y sus mediciones y alertas aún llevan la anterior:
+    # las corrige verificar_organizaciones --pendientes (ver dispositivos.consistencia)
+    organizacion_pendiente = models.BooleanField(default=False, editable=False, db_index=True)
+
+    objects = ActivosManager()
+    todos = models.Manager()
 
     def clean(self):
         if self.watts < 0:
@@ -31,13 +58,46 @@ class Dispositivo(models.Model):
     def __str__(self):
         return f"{self.nombre} - {self.categoria} ({self.watts}W)"
 
+def organizacion_de(dispositivo_id):
+    """Organización actual de un dispositivo (la de su zona), o None."""
+    return Dispositivo.todos.filter(pk=dispositivo_id).values_list('zona__organizacion_id', flat=True).first()
+
 class Medicion(models.Model):
     dispositivo = models.ForeignKey(Dispositivo, on_delete=models.CASCADE)
-    fecha = models.DateTimeField(auto_now_add=True)
+    # default en vez de auto_now_add para aceptar la hora de origen del gateway
+    fecha = models.DateTimeField(default=timezone.now)
     consumo = models.FloatField(help_text="Consumo en kWh")
+    secuencia = models.PositiveBigIntegerField(
+        null=True, blank=True,
+        help_text="Número de secuencia del gateway, evita duplicados en reintentos"
+    )
+    # Copia de la organización de la zona del dispositivo, para filtrar por
+    # tenant sin el join dispositivo -> zona -> organización. La llena la
+    # ingesta; ver dispositivos.consistencia. Sin restricción FK en la base:
+    # MySQL no las admite en tablas particionadas (ver dispositivos.particiones).
+    organizacion = models.ForeignKey(
+        Organizacion, on_delete=models.CASCADE, null=True, blank=True, editable=False,
+        db_constraint=False, db_index=False,
+    )
 
     class Meta:
         ordering = ['-fecha']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dispositivo', 'secuencia'],
+                name='medicion_dispositivo_secuencia_unica',
+            ),
+        ]
+        indexes = [
+            # Listados por dispositivo y rango de fechas, y orden por -fecha
+            models.Index(fields=['dispositivo', 'fecha'], name='medicion_disp_fecha'),
+            models.Index(fields=['fecha'], name='medicion_fecha'),
+            models.Index(fields=['organizacion', 'fecha'], name='medicion_org_fecha'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.organizacion_id = organizacion_de(self.dispositivo_id)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.dispositivo.nombre}: {self.consumo} kWh ({self.fecha.strftime('%Y-%m-%d %H:%M')})"
@@ -48,13 +108,269 @@ class Alerta(models.Model):
         ('Alta', 'Alta'),
         ('Media', 'Media'),
     ]
+    TIPO_CHOICES = [
+        ('Umbral', 'Umbral'),
+        ('Anomalia', 'Anomalía'),
+    ]
     dispositivo = models.ForeignKey(Dispositivo, on_delete=models.CASCADE)
-    fecha = models.DateTimeField(auto_now_add=True)
+    # default en vez de auto_now_add: el motor pone la hora de la lectura que
+    # la disparó, que puede ser atrasada
+    fecha = models.DateTimeField(default=timezone.now)
     mensaje = models.CharField(max_length=200)
     gravedad = models.CharField(max_length=10, choices=GRAVEDAD_CHOICES)
+    # Umbral: dispositivos.alertas; Anomalia: dispositivos.anomalias
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES, default='Umbral', editable=False)
+    organizacion = models.ForeignKey(
+        Organizacion, on_delete=models.CASCADE, null=True, blank=True, editable=False, db_index=False
+    )
+    # Episodio (ver dispositivos.alertas): lecturas que dispararon, hora de
+    # la última y hora de cierre; abierto mientras cerrada_en es nulo
+    ocurrencias = models.PositiveIntegerField(default=1, editable=False)
+    ultima_vez = models.DateTimeField(null=True, blank=True, editable=False)
+    cerrada_en = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-fecha']
+        indexes = [
+            models.Index(fields=['dispositivo', 'fecha'], name='alerta_disp_fecha'),
+            models.Index(fields=['fecha'], name='alerta_fecha'),
+            models.Index(fields=['organizacion', 'fecha'], name='alerta_org_fecha'),
+            # Panel: episodios abiertos o con lecturas recientes
+            models.Index(fields=['cerrada_en'], name='alerta_cerrada_en'),
+            models.Index(fields=['ultima_vez'], name='alerta_ultima_vez'),
+        ]
+
+    def save(self, *args, **kwargs):
+        nueva = self._state.adding
+        self.organizacion_id = organizacion_de(self.dispositivo_id)
+        super().save(*args, **kwargs)
+        if nueva:
+            Dispositivo.todos.filter(pk=self.dispositivo_id).update(last_alerta=self)
+
+    @property
+    def abierta(self):
+        return self.cerrada_en is None
+
+    def __str__(self):
+        return f"[{self.gravedad}] {self.mensaje} - {self.dispositivo.nombre}"
+
+
+class ResumenConsumo(models.Model):
+    """
+    Agregado de mediciones de un dispositivo en un periodo. Se mantiene de
+    forma incremental en cada lote de ingesta (ver dispositivos.resumenes);
+    zona y organización van desnormalizadas para agrupar sin joins.
+    """
+    dispositivo = models.ForeignKey(Dispositivo, on_delete=models.CASCADE)
+    zona = models.ForeignKey(Zona, on_delete=models.SET_NULL, null=True, blank=True)
+    organizacion = models.ForeignKey(Organizacion, on_delete=models.CASCADE, null=True, blank=True)
+    periodo = models.DateTimeField(help_text="Inicio del periodo")
+    cantidad = models.PositiveIntegerField(default=0)
+    suma = models.FloatField(default=0)
+    minimo = models.FloatField()
+    maximo = models.FloatField()
+    ultimo = models.FloatField(help_text="Consumo de la medición más reciente del periodo")
+    ultima_fecha = models.DateTimeField()
+
+    class Meta:
+        abstract = True
+        ordering = ['-periodo']
+
+    @property
+    def promedio(self):
+        return self.suma / self.cantidad if self.cantidad else 0
+
+    def __str__(self):
+        return f"{self.dispositivo_id} {self.periodo:%Y-%m-%d %H:%M}: {self.suma:.2f} kWh"
+
+
+class ResumenHorario(ResumenConsumo):
+    class Meta(ResumenConsumo.Meta):
+        verbose_name = "Resumen horario"
+        verbose_name_plural = "Resúmenes horarios"
+        constraints = [
+            models.UniqueConstraint(fields=['dispositivo', 'periodo'], name='resumen_horario_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['organizacion', 'periodo'], name='resumen_hora_org_periodo'),
+            models.Index(fields=['zona', 'periodo'], name='resumen_hora_zona_periodo'),
+        ]
+
+
+class ResumenDiario(ResumenConsumo):
+    class Meta(ResumenConsumo.Meta):
+        verbose_name = "Resumen diario"
+        verbose_name_plural = "Resúmenes diarios"
+        constraints = [
+            models.UniqueConstraint(fields=['dispositivo', 'periodo'], name='resumen_diario_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['organizacion', 'periodo'], name='resumen_dia_org_periodo'),
+            models.Index(fields=['zona', 'periodo'], name='resumen_dia_zona_periodo'),
+        ]
+
+
+class PoliticaRetencion(models.Model):
+    """
+    Cuánto se conserva de cada nivel de datos de una organización. Las
+    mediciones crudas vencidas se pliegan en los resúmenes antes de borrarse
+    (ver dispositivos.retencion y el comando aplicar_retencion).
+    """
+    organizacion = models.OneToOneField(Organizacion, on_delete=models.CASCADE, related_name='politica_retencion')
+    dias_crudo = models.PositiveIntegerField(
+        default=90, validators=[MinValueValidator(1)],
+        help_text="Días que se conservan las mediciones crudas"
+    )
+    dias_horario = models.PositiveIntegerField(
+        default=730, null=True, blank=True, validators=[MinValueValidator(1)],
+        help_text="Días que se conservan los resúmenes horarios; vacío = para siempre"
+    )
+    dias_diario = models.PositiveIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1)],
+        help_text="Días que se conservan los resúmenes diarios; vacío = para siempre"
+    )
+    # Todo lo anterior a esta fecha ya está plegado en los resúmenes: si un
+    # borrado se interrumpe, no se vuelve a reconstruir un día a medio borrar
+    plegado_hasta = models.DateTimeField(null=True, blank=True, editable=False)
+    ultima_ejecucion = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        verbose_name = "Política de retención"
+        verbose_name_plural = "Políticas de retención"
+
+    def clean(self):
+        if self.dias_horario is not None and self.dias_horario < self.dias_crudo:
+            raise ValidationError("Los resúmenes horarios deben conservarse al menos tanto como las mediciones crudas.")
+        if self.dias_diario is not None and self.dias_horario is not None and self.dias_diario < self.dias_horario:
+            raise ValidationError("Los resúmenes diarios deben conservarse al menos tanto como los horarios.")
+        if self.dias_diario is not None and self.dias_horario is None:
+            raise ValidationError("Si los resúmenes horarios son permanentes, los diarios también deben serlo.")
+
+    def __str__(self):
+        return f"Retención {self.organizacion.nombre}: {self.dias_crudo} días crudo"
+
+
+class Purga(models.Model):
+    """
+    Borrado en segundo plano de un dispositivo o zona marcado como eliminado:
+    sus filas dependientes se borran por lotes (comando purgar_eliminados) y
+    aquí queda el avance. Guarda el id y no una FK porque el objeto desaparece.
+    """
+    TIPOS = [
+        ('dispositivo', 'Dispositivo'),
+        ('zona', 'Zona'),
+    ]
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('en_curso', 'En curso'),
+        ('terminada', 'Terminada'),
+        ('error', 'Error'),
+    ]
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    objeto_id = models.PositiveBigIntegerField()
+    nombre = models.CharField(max_length=100)
+    organizacion = models.ForeignKey(Organizacion, on_delete=models.SET_NULL, null=True, blank=True)
+    solicitada_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
+    # {tabla: filas borradas o actualizadas}
+    progreso = models.JSONField(default=dict, blank=True)
+    error = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    terminada_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['estado', 'created_at'], name='purga_estado'),
+        ]
+
+    @property
+    def filas(self):
+        return sum(self.progreso.values())
+
+    def __str__(self):
+        return f"Purga {self.get_tipo_display()} {self.nombre} ({self.get_estado_display()})"
+
+
+class EstadoAnomalia(models.Model):
+    """
+    Punto de control del detector de anomalías (ver dispositivos.anomalias):
+    media y varianza exponenciales del consumo de un dispositivo. Los workers
+    lo guardan cada tanto y lo leen al reiniciar, sin recorrer el historial.
+    """
+    dispositivo = models.OneToOneField(Dispositivo, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    media = models.FloatField()
+    varianza = models.FloatField()
+    lecturas = models.PositiveBigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Estado de anomalías"
+        verbose_name_plural = "Estados de anomalías"
+
+    def __str__(self):
+        return f"{self.dispositivo_id}: {self.media:.3f} ± {self.varianza ** 0.5:.3f} kWh ({self.lecturas} lecturas)"
+
+
+class PerfilUmbrales(models.Model):
+    """
+    Umbrales de alerta de un dispositivo, una zona o una categoría de
+    dispositivos. Manda el más específico (dispositivo > zona > categoría);
+    sin perfil se usan los umbrales por defecto de dispositivos.alertas. Se
+    compilan en una tabla en memoria por dispositivo (ver dispositivos.umbrales).
+    """
+    MODOS = [
+        ('absoluto', 'kWh'),
+        ('relativo', 'Múltiplo del consumo nominal'),
+    ]
+    nombre = models.CharField(max_length=100)
+    dispositivo = models.OneToOneField(
+        Dispositivo, on_delete=models.CASCADE, null=True, blank=True, related_name='perfil_umbrales'
+    )
+    zona = models.OneToOneField(Zona, on_delete=models.CASCADE, null=True, blank=True, related_name='perfil_umbrales')
+    categoria = models.CharField(max_length=50, choices=Dispositivo.CATEGORIAS, blank=True)
+    organizacion = models.ForeignKey(
+        Organizacion, on_delete=models.CASCADE, null=True, blank=True,
+        help_text="Solo para perfiles por categoría; vacío = todas las organizaciones"
+    )
+    modo = models.CharField(
+        max_length=10, choices=MODOS, default='absoluto',
+        help_text="Relativo: el umbral multiplica el consumo nominal de una hora (watts / 1000 kWh)"
+    )
+    umbral_media = models.FloatField(null=True, blank=True, validators=[MinValueValidator(0)])
+    umbral_alta = models.FloatField(null=True, blank=True, validators=[MinValueValidator(0)])
+    umbral_grave = models.FloatField(null=True, blank=True, validators=[MinValueValidator(0)])
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Perfil de umbrales"
+        verbose_name_plural = "Perfiles de umbrales"
+
+    def clean(self):
+        alcances = [self.dispositivo_id is not None, self.zona_id is not None, bool(self.categoria)]
+        if sum(alcances) != 1:
+            raise ValidationError("Indique exactamente uno: dispositivo, zona o categoría.")
+        if self.organizacion_id is not None and not self.categoria:
+            raise ValidationError("La organización solo se indica en perfiles por categoría.")
+        umbrales = [u for u in (self.umbral_media, self.umbral_alta, self.umbral_grave) if u is not None]
+        if not umbrales:
+            raise ValidationError("Indique al menos un umbral.")
+        if umbrales != sorted(umbrales):
+            raise ValidationError("Los umbrales deben crecer de media a alta y a grave.")
+        if self.categoria:
+            repetidos = PerfilUmbrales.objects.filter(categoria=self.categoria, organizacion_id=self.organizacion_id)
+            if repetidos.exclude(pk=self.pk).exists():
+                raise ValidationError("Ya existe un perfil para esa categoría y organización.")
+
+    def umbrales_kwh(self, watts):
+        """(grave, alta, media) en kWh para un dispositivo de `watts`; None = nivel sin alerta."""
+        factor = watts / 1000 if self.modo == 'relativo' else 1
+        return tuple(
+            None if umbral is None else umbral * factor
+            for umbral in (self.umbral_grave, self.umbral_alta, self.umbral_media)
+        )
 
     def __str__(self):
-        return f"[{self.gravedad}] {self.mensaje} - {self.dispositivo.nombre}"
\ No newline at end of file
+        alcance = self.dispositivo or self.zona or self.categoria
+        return f"{self.nombre} ({alcance})"
@@ -0,0 +1,200 @@
+"""
+Particionado mensual opcional de dispositivos_medicion en MySQL.
+
+La tabla se particiona con RANGE COLUMNS(fecha), una partición por mes (UTC,
+que es como se guardan las fechas) más `pfuturo` para lo que quede fuera. Las
+consultas con rango sobre `fecha` (listados, API, resúmenes) solo leen las
+particiones que tocan, y borrar un mes vencido es un DROP PARTITION.
+
+MySQL exige que toda clave única incluya la columna de partición y no admite
+claves foráneas en tablas particionadas, así que al activarlo:
+- la clave primaria pasa a ser (id, fecha);
+- la unicidad de secuencia pasa a ser (dispositivo, secuencia, fecha): un
+  reintento idéntico se sigue descartando;
+- se elimina la FK a dispositivo (el borrado en cascada lo hace Django).
+"""
+import logging
+from datetime import date, datetime
+from datetime import timezone as dt_timezone
+
+from django.db import connection
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import Medicion, PoliticaRetencion
+from .resumenes import limites_dia
+from .retencion import cortes, plegar
+from usuarios.models import Organizacion
+
+logger = logging.getLogger(__name__)
+
+TABLA = Medicion._meta.db_table
+PARTICION_FUTURO = 'pfuturo'
+INDICE_SECUENCIA = 'medicion_dispositivo_secuencia_unica'
+
+
+class ErrorParticiones(Exception):
+    pass
+
+
+def _mes_siguiente(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def _mes_utc(fecha):
+    return fecha.astimezone(dt_timezone.utc).date().replace(day=1)
+
+
+def _inicio_utc(mes):
+    return datetime(mes.year, mes.month, 1, tzinfo=dt_timezone.utc)
+
+
+def _definicion(mes):
+    return f"PARTITION p{mes:%Y%m} VALUES LESS THAN ('{_mes_siguiente(mes):%Y-%m-%d} 00:00:00')"
+
+
+def _verificar_motor():
+    if connection.vendor != 'mysql':
+        raise ErrorParticiones(f'El particionado solo está disponible en MySQL (motor actual: {connection.vendor})')
+
+
+def particiones():
+    """Meses (date del día 1) con partición propia, en orden. Vacío si no está particionada."""
+    _verificar_motor()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION",
+            [TABLA],
+        )
+        nombres = [fila[0] for fila in cursor.fetchall()]
+    return [date(int(n[1:5]), int(n[5:7]), 1) for n in nombres if n != PARTICION_FUTURO]
+
+
+def esta_particionada():
+    return connection.vendor == 'mysql' and bool(particiones())
+
+
+def _claves_foraneas():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CONSTRAINT_NAME FROM information_schema.KEY_COLUMN_USAGE "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND REFERENCED_TABLE_NAME IS NOT NULL",
+            [TABLA],
+        )
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+def activar(meses_adelante=3):
+    """
+    Convierte la tabla en particionada, con un mes por cada mes con datos y
+    `meses_adelante` meses futuros. Reescribe la tabla completa: ejecutar en
+    una ventana de mantenimiento. Devuelve la cantidad de particiones mensuales.
+    """
+    if particiones():
+        raise ErrorParticiones('La tabla ya está particionada')
+
+    actual = _mes_utc(timezone.now())
+    primera = Medicion.objects.aggregate(primera=Min('fecha'))['primera']
+    mes = min(_mes_utc(primera), actual) if primera else actual
+    ultimo = actual
+    for _ in range(meses_adelante):
+        ultimo = _mes_siguiente(ultimo)
+
+    definiciones = []
+    while mes <= ultimo:
+        definiciones.append(_definicion(mes))
+        mes = _mes_siguiente(mes)
+    definiciones.append(f'PARTITION {PARTICION_FUTURO} VALUES LESS THAN (MAXVALUE)')
+
+    sentencias = [f'ALTER TABLE {TABLA} DROP FOREIGN KEY {nombre}' for nombre in _claves_foraneas()]
+    sentencias.append(
+        f'ALTER TABLE {TABLA} DROP PRIMARY KEY, ADD PRIMARY KEY (id, fecha), '
+        f'DROP INDEX {INDICE_SECUENCIA}, '
+        f'ADD UNIQUE KEY {INDICE_SECUENCIA} (dispositivo_id, secuencia, fecha)'
+    )
+    sentencias.append(f"ALTER TABLE {TABLA} PARTITION BY RANGE COLUMNS(fecha) ({', '.join(definiciones)})")
+    with connection.cursor() as cursor:
+        for sentencia in sentencias:
+            logger.info(f'Particiones: {sentencia}')
+            cursor.execute(sentencia)
+    return len(definiciones) - 1
+
+
+def crear_futuras(meses_adelante=3):
+    """
+    Crea las particiones que falten hasta `meses_adelante` meses después del
+    actual, dividiendo `pfuturo` (instantáneo mientras esté vacía). Devuelve
+    los meses creados.
+    """
+    existentes = particiones()
+    if not existentes:
+        raise ErrorParticiones('La tabla no está particionada; use --activar primero')
+
+    objetivo = _mes_utc(timezone.now())
+    for _ in range(meses_adelante):
+        objetivo = _mes_siguiente(objetivo)
+
+    nuevos = []
+    mes = _mes_siguiente(existentes[-1])
+    while mes <= objetivo:
+        nuevos.append(mes)
+        mes = _mes_siguiente(mes)
+    if not nuevos:
+        return []
+
+    definiciones = [_definicion(m) for m in nuevos]
+    definiciones.append(f'PARTITION {PARTICION_FUTURO} VALUES LESS THAN (MAXVALUE)')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE {TABLA} REORGANIZE PARTITION {PARTICION_FUTURO} INTO ({', '.join(definiciones)})"
+        )
+    return nuevos
+
+
+def limite_vencido():
+    """
+    Fecha antes de la cual ninguna organización necesita mediciones crudas,
+    según sus políticas de retención. None si alguna organización con
+    dispositivos no tiene política (se conserva todo).
+    """
+    sin_politica = Organizacion.objects.filter(
+        zona__dispositivo__isnull=False, politica_retencion__isnull=True
+    ).exists()
+    politicas = list(PoliticaRetencion.objects.all())
+    if sin_politica or not politicas:
+        return None
+    return min(cortes(politica)['crudo'] for politica in politicas)
+
+
+def eliminar_vencidas(plegar_antes=True):
+    """
+    Elimina las particiones mensuales que terminan antes de `limite_vencido()`,
+    de la más antigua a la más reciente. Antes de cada DROP pliega en los
+    resúmenes, por organización, los días que aún no lo estuvieran (igual que
+    aplicar_retencion). Devuelve los meses eliminados.
+    """
+    existentes = particiones()
+    limite = limite_vencido()
+    if not existentes or limite is None:
+        return []
+
+    eliminados = []
+    for mes in existentes:
+        fin = _inicio_utc(_mes_siguiente(mes))
+        if fin > limite:
+            break
+        if plegar_antes:
+            # Se pliegan días locales completos: el que cruza el fin del mes
+            # sigue entero en la base, parte en la partición siguiente
+            hasta = limites_dia(timezone.localdate(fin))[0]
+            if hasta < fin:
+                hasta = limites_dia(timezone.localdate(fin))[1]
+            for politica in PoliticaRetencion.objects.select_related('organizacion'):
+                plegar(politica, min(hasta, limite))
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {TABLA} DROP PARTITION p{mes:%Y%m}')
+        logger.info(f'Particiones: eliminada p{mes:%Y%m}')
+        eliminados.append(mes)
+    return eliminados
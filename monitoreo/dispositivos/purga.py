@@ -0,0 +1,126 @@
+"""
+Borrado diferido de dispositivos y zonas. La vista solo marca el objeto como
+eliminado (deja de verse en todas partes) y crea una Purga; el comando
+purgar_eliminados borra después las filas dependientes por lotes acotados,
+guardando el avance, y al final el propio objeto.
+"""
+import logging
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Alerta, Dispositivo, Medicion, Purga, ResumenDiario, ResumenHorario, Zona
+from .retencion import borrar_en_chunks
+
+logger = logging.getLogger(__name__)
+
+TAMANO_CHUNK = 1000
+PAUSA_MS = 50
+
+
+def marcar_eliminado(objeto, usuario=None):
+    """Marca un Dispositivo o Zona como eliminado y encola su purga. Devuelve la Purga."""
+    tipo = 'zona' if isinstance(objeto, Zona) else 'dispositivo'
+    organizacion_id = objeto.organizacion_id if tipo == 'zona' else (objeto.zona.organizacion_id if objeto.zona else None)
+    with transaction.atomic():
+        objeto.eliminado = True
+        objeto.save(update_fields=['eliminado'])
+        return Purga.objects.create(
+            tipo=tipo, objeto_id=objeto.id, nombre=objeto.nombre[:100],
+            organizacion_id=organizacion_id, solicitada_por=usuario,
+        )
+
+
+def dispositivos_eliminados():
+    """Ids de dispositivos marcados como eliminados y aún sin purgar (pocos)."""
+    return list(Dispositivo.todos.filter(eliminado=True).values_list('id', flat=True))
+
+
+class _Avance:
+    """Acumula el avance por tabla y lo guarda en la Purga tras cada lote."""
+
+    def __init__(self, purga):
+        self.purga = purga
+
+    def tabla(self, nombre):
+        def sumar(filas):
+            self.purga.progreso[nombre] = self.purga.progreso.get(nombre, 0) + filas
+            self.purga.save(update_fields=['progreso', 'updated_at'])
+        return sumar
+
+
+def _actualizar_en_chunks(queryset, valores, tamano, pausa_ms, al_avanzar):
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:tamano])
+        if not pks:
+            return
+        with transaction.atomic():
+            filas = queryset.model._base_manager.filter(pk__in=pks).update(**valores)
+        al_avanzar(filas)
+        if pausa_ms:
+            time.sleep(pausa_ms / 1000)
+
+
+def _purgar_dispositivo(dispositivo_id, avance, tamano, pausa_ms):
+    # Sin puntero a la última alerta, borrar alertas no actualiza el dispositivo
+    Dispositivo.todos.filter(pk=dispositivo_id).update(last_alerta=None)
+    for modelo, orden in ((Medicion, 'fecha'), (Alerta, 'fecha'), (ResumenHorario, 'periodo'), (ResumenDiario, 'periodo')):
+        borrar_en_chunks(
+            modelo.objects.filter(dispositivo_id=dispositivo_id).order_by(orden),
+            tamano, pausa_ms, avance.tabla(modelo._meta.db_table),
+        )
+    # Ya sin dependientes, el borrado del propio dispositivo es inmediato
+    Dispositivo.todos.filter(pk=dispositivo_id).delete()
+
+
+def _purgar_zona(zona_id, avance, tamano, pausa_ms):
+    pendientes = Dispositivo.todos.filter(zona_id=zona_id)
+    if pendientes.filter(eliminado=False).exists():
+        raise ValueError('La zona tiene dispositivos activos')
+    for dispositivo_id in pendientes.values_list('id', flat=True):
+        _purgar_dispositivo(dispositivo_id, avance, tamano, pausa_ms)
+    # Los resúmenes de dispositivos que pasaron por la zona la referencian
+    for modelo in (ResumenHorario, ResumenDiario):
+        _actualizar_en_chunks(
+            modelo.objects.filter(zona_id=zona_id).order_by('periodo'),
+            {'zona': None}, tamano, pausa_ms, avance.tabla(modelo._meta.db_table),
+        )
+    Zona.todos.filter(pk=zona_id).delete()
+
+
+def purgar(purga, tamano=TAMANO_CHUNK, pausa_ms=PAUSA_MS):
+    """
+    Ejecuta una purga. Es reanudable: si se interrumpe, volver a llamarla
+    sigue donde quedó porque cada lote ya confirmado no se repite.
+    """
+    purga.estado = 'en_curso'
+    purga.save(update_fields=['estado', 'updated_at'])
+    avance = _Avance(purga)
+    try:
+        if purga.tipo == 'zona':
+            _purgar_zona(purga.objeto_id, avance, tamano, pausa_ms)
+        else:
+            _purgar_dispositivo(purga.objeto_id, avance, tamano, pausa_ms)
+    except Exception as e:
+        logger.error(f'Error en purga {purga.id} ({purga.tipo} {purga.objeto_id}): {str(e)}')
+        purga.estado = 'error'
+        purga.error = str(e)[:200]
+        purga.save(update_fields=['estado', 'error', 'updated_at'])
+        return purga
+
+    purga.estado = 'terminada'
+    purga.error = ''
+    purga.terminada_en = timezone.now()
+    purga.save(update_fields=['estado', 'error', 'terminada_en', 'updated_at'])
+    logger.info(f'Purga {purga.id} terminada: {purga.nombre}, {purga.filas} filas')
+    return purga
+
+
+def pendientes(reintentar_errores=False):
+    """Purgas por ejecutar: primero los dispositivos, para que las zonas queden vacías."""
+    estados = ['pendiente', 'en_curso'] + (['error'] if reintentar_errores else [])
+    return sorted(
+        Purga.objects.filter(estado__in=estados),
+        key=lambda p: (p.tipo != 'dispositivo', p.created_at),
+    )
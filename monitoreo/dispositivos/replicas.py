@@ -0,0 +1,190 @@
+"""
+Réplicas de lectura. Las vistas marcadas con @solo_lectura (panel, listados,
+exportaciones, API de consulta) leen de una réplica; todo lo demás, y
+cualquier escritura, va a la primaria. Tras escribir, el usuario queda
+pegado a la primaria REPLICAS_RETRASO_MAX segundos (cookie) para que vea sus
+propios cambios aunque la réplica vaya atrasada.
+
+Además se cuentan las consultas por alias: por petición en la cabecera
+X-Consultas-BD (solo con DEBUG) y acumuladas en la caché compartida para el
+comando consultas_bd.
+"""
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+COOKIE_PRIMARIA = 'bd_primaria'
+CLAVE_CONSULTAS = 'replicas:consultas:{}'
+INTERVALO_VOLCADO = 10
+# Tablas que siempre se leen de la primaria (la sesión recién creada no
+# puede faltar en la réplica)
+APPS_PRIMARIA = {'sessions'}
+
+
+class _EstadoPeticion:
+    __slots__ = ('lectura', 'primaria', 'escribio', 'replica', 'consultas')
+
+    def __init__(self, primaria=False):
+        self.lectura = False
+        self.primaria = primaria
+        self.escribio = False
+        self.replica = None
+        self.consultas = Counter()
+
+
+_estado = ContextVar('estado_replicas', default=None)
+
+
+def replicas():
+    return getattr(settings, 'REPLICAS_LECTURA', [])
+
+
+class RouterReplicas:
+    """Router de DATABASE_ROUTERS: lecturas de vistas @solo_lectura a una réplica."""
+
+    def db_for_read(self, model, **hints):
+        estado = _estado.get()
+        if (
+            estado is None or not estado.lectura or estado.primaria
+            or model._meta.app_label in APPS_PRIMARIA
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+            or not replicas()
+        ):
+            return DEFAULT_DB_ALIAS
+        # Una sola réplica por petición, para que las lecturas sean coherentes
+        if estado.replica is None:
+            estado.replica = random.choice(replicas())
+        return estado.replica
+
+    def db_for_write(self, model, **hints):
+        # El resto de la petición también lee de la primaria
+        marcar_escritura()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Las réplicas son copias de la misma base
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def marcar_escritura():
+    """
+    Registra en la petición actual una escritura que el router no ve, por
+    ejemplo la que hace el hilo de BufferMediciones en nombre de la petición.
+    """
+    estado = _estado.get()
+    if estado is not None:
+        estado.escribio = True
+        estado.primaria = True
+
+
+def solo_lectura(view_func):
+    """Permite que la vista lea de una réplica (si no hay escritura reciente del usuario)."""
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        estado = _estado.get()
+        if estado is not None:
+            estado.lectura = True
+        return view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
+def _contar_consulta(execute, sql, params, many, context):
+    estado = _estado.get()
+    if estado is not None:
+        estado.consultas[context['connection'].alias] += 1
+    return execute(sql, params, many, context)
+
+
+def _instalar_contador():
+    # Las conexiones son por hilo; se revisa en cada petición porque pueden
+    # haberse abierto antes de cargar el middleware
+    for alias in settings.DATABASES:
+        conexion = connections[alias]
+        if _contar_consulta not in conexion.execute_wrappers:
+            conexion.execute_wrappers.append(_contar_consulta)
+
+
+_totales = Counter()
+_lock_totales = threading.Lock()
+_ultimo_volcado = time.monotonic()
+
+
+def _acumular(consultas):
+    """Suma las consultas de la petición y cada tanto las vuelca a la caché compartida."""
+    global _ultimo_volcado
+    with _lock_totales:
+        _totales.update(consultas)
+        if time.monotonic() - _ultimo_volcado < INTERVALO_VOLCADO:
+            return
+        pendientes = dict(_totales)
+        _totales.clear()
+        _ultimo_volcado = time.monotonic()
+    try:
+        for alias, cantidad in pendientes.items():
+            clave = CLAVE_CONSULTAS.format(alias)
+            cache.add(clave, 0, None)
+            cache.incr(clave, cantidad)
+    except Exception as e:
+        logger.warning(f'No se pudieron guardar los contadores de consultas: {str(e)}')
+
+
+def consultas_acumuladas():
+    """{alias: consultas} acumuladas por todos los workers desde el último reinicio."""
+    return {
+        alias: cache.get(CLAVE_CONSULTAS.format(alias), 0)
+        for alias in settings.DATABASES
+    }
+
+
+def reiniciar_consultas():
+    cache.delete_many([CLAVE_CONSULTAS.format(alias) for alias in settings.DATABASES])
+
+
+class ReplicasMiddleware:
+    """
+    Abre el estado de réplicas de cada petición y, si hubo escrituras, deja
+    al usuario leyendo de la primaria unos segundos.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            pegada = float(request.COOKIES.get(COOKIE_PRIMARIA, 0)) > time.time()
+        except ValueError:
+            pegada = False
+        _instalar_contador()
+        estado = _EstadoPeticion(primaria=pegada)
+        token = _estado.set(estado)
+        try:
+            response = self.get_response(request)
+        finally:
+            _estado.reset(token)
+
+        if estado.escribio:
+            retraso = settings.REPLICAS_RETRASO_MAX
+            response.set_cookie(
+                COOKIE_PRIMARIA, str(int(time.time() + retraso) + 1), max_age=int(retraso) + 1,
+                httponly=True, samesite='Lax', secure=request.is_secure(),
+            )
+        if settings.DEBUG:
+            response['X-Consultas-BD'] = ', '.join(
+                f'{alias}={cantidad}' for alias, cantidad in sorted(estado.consultas.items())
+            )
+        if estado.consultas:
+            _acumular(estado.consultas)
+        return response
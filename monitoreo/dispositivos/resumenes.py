@@ -0,0 +1,209 @@
+import logging
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Min, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from .models import Dispositivo, Medicion, ResumenDiario, ResumenHorario
+
+logger = logging.getLogger(__name__)
+
+CAMPOS_ACTUALIZABLES = ['zona', 'organizacion', 'cantidad', 'suma', 'minimo', 'maximo', 'ultimo', 'ultima_fecha']
+
+
+def inicio_hora(fecha):
+    return timezone.localtime(fecha).replace(minute=0, second=0, microsecond=0)
+
+
+def inicio_dia(fecha):
+    return timezone.localtime(fecha).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def limites_dia(dia):
+    """(inicio, fin) del día local `dia` (date) como datetimes aware."""
+    siguiente = dia + timedelta(days=1)
+    return (
+        timezone.make_aware(datetime(dia.year, dia.month, dia.day)),
+        timezone.make_aware(datetime(siguiente.year, siguiente.month, siguiente.day)),
+    )
+
+
+# (modelo, función que trunca una fecha al inicio de su periodo)
+NIVELES = (
+    (ResumenHorario, inicio_hora),
+    (ResumenDiario, inicio_dia),
+)
+
+
+def acumular(filas, truncar, parciales=None):
+    """
+    Agrega filas (dispositivo_id, fecha, consumo) en
+    {(dispositivo_id, periodo): [cantidad, suma, minimo, maximo, ultimo, ultima_fecha]}.
+    """
+    parciales = {} if parciales is None else parciales
+    for dispositivo_id, fecha, consumo in filas:
+        clave = (dispositivo_id, truncar(fecha))
+        actual = parciales.get(clave)
+        if actual is None:
+            parciales[clave] = [1, consumo, consumo, consumo, consumo, fecha]
+            continue
+        actual[0] += 1
+        actual[1] += consumo
+        if consumo < actual[2]:
+            actual[2] = consumo
+        if consumo > actual[3]:
+            actual[3] = consumo
+        if fecha >= actual[5]:
+            actual[4] = consumo
+            actual[5] = fecha
+    return parciales
+
+
+def _combinar(resumen, parcial):
+    cantidad, suma, minimo, maximo, ultimo, ultima_fecha = parcial
+    resumen.cantidad += cantidad
+    resumen.suma += suma
+    resumen.minimo = min(resumen.minimo, minimo)
+    resumen.maximo = max(resumen.maximo, maximo)
+    if ultima_fecha >= resumen.ultima_fecha:
+        resumen.ultimo = ultimo
+        resumen.ultima_fecha = ultima_fecha
+
+
+def ubicaciones_de_dispositivos(dispositivo_ids):
+    """{dispositivo_id: (zona_id, organizacion_id)} en una consulta."""
+    return {
+        dispositivo_id: (zona_id, organizacion_id)
+        for dispositivo_id, zona_id, organizacion_id in Dispositivo.objects.filter(
+            id__in=set(dispositivo_ids)
+        ).values_list('id', 'zona_id', 'zona__organizacion_id')
+    }
+
+
+def _fusionar(modelo, parciales, ubicaciones):
+    """
+    Suma los parciales a las filas existentes (bloqueadas con FOR UPDATE) y
+    crea las que faltan. Si otro lote crea la misma fila a la vez, el índice
+    único lo detecta y se reintenta sumando sobre la fila ya creada.
+    """
+    pendientes = dict(parciales)
+    for _ in range(3):
+        existentes = {
+            (r.dispositivo_id, r.periodo): r
+            for r in modelo.objects.select_for_update().filter(
+                dispositivo_id__in={d for d, _ in pendientes},
+                periodo__in={p for _, p in pendientes},
+            ).order_by('dispositivo_id', 'periodo')
+        }
+        actualizar = []
+        crear = []
+        for clave, parcial in pendientes.items():
+            zona_id, organizacion_id = ubicaciones.get(clave[0], (None, None))
+            resumen = existentes.get(clave)
+            if resumen is None:
+                cantidad, suma, minimo, maximo, ultimo, ultima_fecha = parcial
+                crear.append(modelo(
+                    dispositivo_id=clave[0], periodo=clave[1],
+                    zona_id=zona_id, organizacion_id=organizacion_id,
+                    cantidad=cantidad, suma=suma, minimo=minimo, maximo=maximo,
+                    ultimo=ultimo, ultima_fecha=ultima_fecha,
+                ))
+            else:
+                _combinar(resumen, parcial)
+                resumen.zona_id = zona_id
+                resumen.organizacion_id = organizacion_id
+                actualizar.append(resumen)
+
+        if actualizar:
+            modelo.objects.bulk_update(actualizar, CAMPOS_ACTUALIZABLES, batch_size=500)
+        if not crear:
+            return
+        try:
+            with transaction.atomic():
+                modelo.objects.bulk_create(crear, batch_size=500)
+            return
+        except IntegrityError:
+            # Solo quedan por aplicar los que se intentaron crear
+            pendientes = {(r.dispositivo_id, r.periodo): pendientes[(r.dispositivo_id, r.periodo)] for r in crear}
+    raise IntegrityError(f'No se pudo actualizar {modelo.__name__} por concurrencia')
+
+
+def actualizar_resumenes(mediciones, ubicaciones=None):
+    """
+    Suma un lote de Medicion recién insertadas a los resúmenes horarios y
+    diarios. Debe llamarse dentro de la misma transacción que el INSERT.
+    `ubicaciones` es el resultado de ubicaciones_de_dispositivos si quien
+    llama ya lo consultó.
+    """
+    if not mediciones:
+        return
+    filas = [(m.dispositivo_id, m.fecha, m.consumo) for m in mediciones]
+    if ubicaciones is None:
+        ubicaciones = ubicaciones_de_dispositivos({f[0] for f in filas})
+    for modelo, truncar in NIVELES:
+        _fusionar(modelo, acumular(filas, truncar), ubicaciones)
+
+
+def reconstruir(desde, hasta, dispositivo_id=None):
+    """
+    Recalcula desde Medicion los resúmenes de los días locales entre `desde`
+    y `hasta` (fechas, ambos incluidos). Procesa un día por transacción para
+    acotar memoria y bloqueos. Devuelve la cantidad de mediciones leídas.
+    """
+    leidas = 0
+    dia = desde
+    while dia <= hasta:
+        leidas += reconstruir_rango(*limites_dia(dia), dispositivo_id)
+        dia += timedelta(days=1)
+    return leidas
+
+
+def reconstruir_rango(inicio, fin, dispositivo_id=None, organizacion_id=None):
+    mediciones = Medicion.objects.filter(fecha__gte=inicio, fecha__lt=fin)
+    if dispositivo_id is not None:
+        mediciones = mediciones.filter(dispositivo_id=dispositivo_id)
+    if organizacion_id is not None:
+        mediciones = mediciones.filter(organizacion_id=organizacion_id)
+
+    with transaction.atomic():
+        for modelo, _ in NIVELES:
+            resumenes = modelo.objects.filter(periodo__gte=inicio, periodo__lt=fin)
+            if dispositivo_id is not None:
+                resumenes = resumenes.filter(dispositivo_id=dispositivo_id)
+            if organizacion_id is not None:
+                resumenes = resumenes.filter(organizacion_id=organizacion_id)
+            resumenes.delete()
+
+        parciales = {modelo: {} for modelo, _ in NIVELES}
+        leidas = 0
+        for fila in mediciones.order_by().values_list('dispositivo_id', 'fecha', 'consumo').iterator(chunk_size=5000):
+            leidas += 1
+            for modelo, truncar in NIVELES:
+                acumular((fila,), truncar, parciales[modelo])
+
+        ubicaciones = ubicaciones_de_dispositivos({d for p in parciales.values() for d, _ in p})
+        for modelo, _ in NIVELES:
+            _fusionar(modelo, parciales[modelo], ubicaciones)
+    return leidas
+
+
+def recalcular_medicion(dispositivo_id, fecha):
+    """Recalcula los resúmenes que contienen `fecha` tras editar o borrar una medición."""
+    reconstruir_rango(*limites_dia(timezone.localdate(fecha)), dispositivo_id)
+
+
+def consumo_por_zona(zonas, desde, hasta):
+    """Anota `consumo` (kWh) por zona entre `desde` y `hasta` usando ResumenDiario."""
+    suma = (
+        ResumenDiario.objects.filter(zona=OuterRef('pk'), periodo__gte=desde, periodo__lt=hasta)
+        .order_by().values('zona').annotate(total=Sum('suma')).values('total')
+    )
+    return zonas.annotate(consumo=Subquery(suma))
+
+
+def totales(resumenes):
+    """Totales de un queryset de resúmenes: cantidad, suma, mínimo y máximo."""
+    return resumenes.aggregate(
+        cantidad=Sum('cantidad'), suma=Sum('suma'), minimo=Min('minimo'), maximo=Max('maximo')
+    )
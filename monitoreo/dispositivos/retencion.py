@@ -0,0 +1,135 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Dispositivo, Medicion, ResumenDiario, ResumenHorario
+from .resumenes import reconstruir_rango, limites_dia
+
+logger = logging.getLogger(__name__)
+
+TAMANO_CHUNK = 1000
+PAUSA_MS = 50
+
+
+def cortes(politica, hoy=None):
+    """
+    Inicio del día local desde el que se conserva cada nivel
+    ({'crudo', 'horario', 'diario'}; None = para siempre). Se corta en días
+    completos para que un día quede entero en crudo o entero en resúmenes.
+    Un nivel agregado nunca se borra antes que el nivel más fino.
+    """
+    hoy = hoy or timezone.localdate()
+    dias_crudo = politica.dias_crudo
+    dias_horario = max(politica.dias_horario, dias_crudo) if politica.dias_horario is not None else None
+    dias_diario = None
+    if politica.dias_diario is not None and dias_horario is not None:
+        dias_diario = max(politica.dias_diario, dias_horario)
+
+    def inicio(dias):
+        return None if dias is None else limites_dia(hoy - timedelta(days=dias))[0]
+
+    return {'crudo': inicio(dias_crudo), 'horario': inicio(dias_horario), 'diario': inicio(dias_diario)}
+
+
+def _siguiente_medicion(organizacion_id, desde, hasta):
+    mediciones = Medicion.objects.filter(organizacion_id=organizacion_id, fecha__lt=hasta)
+    if desde is not None:
+        mediciones = mediciones.filter(fecha__gte=desde)
+    return mediciones.order_by('fecha').values_list('fecha', flat=True).first()
+
+
+def plegar(politica, hasta):
+    """
+    Reconstruye desde Medicion los resúmenes de cada día con datos crudos
+    anterior a `hasta`, un día por transacción, y avanza `plegado_hasta`.
+    Los días sin mediciones se saltan. Devuelve (días, mediciones leídas).
+    """
+    dias = leidas = 0
+    desde = politica.plegado_hasta
+    while True:
+        fecha = _siguiente_medicion(politica.organizacion_id, desde, hasta)
+        if fecha is None:
+            break
+        inicio, fin = limites_dia(timezone.localdate(fecha))
+        fin = min(fin, hasta)
+        with transaction.atomic():
+            leidas += reconstruir_rango(inicio, fin, organizacion_id=politica.organizacion_id)
+            politica.plegado_hasta = fin
+            politica.save(update_fields=['plegado_hasta'])
+        dias += 1
+        desde = fin
+
+    if politica.plegado_hasta is None or politica.plegado_hasta < hasta:
+        politica.plegado_hasta = hasta
+        politica.save(update_fields=['plegado_hasta'])
+    return dias, leidas
+
+
+def borrar_en_chunks(queryset, tamano=TAMANO_CHUNK, pausa_ms=PAUSA_MS, al_avanzar=None):
+    """
+    Borra las filas de `queryset` (ya ordenado por un índice) en transacciones
+    de a lo más `tamano` filas, con una pausa entre ellas para no acaparar
+    bloqueos ni el log de transacciones. Llama a `al_avanzar(filas)` tras cada
+    transacción. Devuelve las filas borradas.
+    """
+    modelo = queryset.model
+    borradas = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:tamano])
+        if not pks:
+            return borradas
+        with transaction.atomic():
+            filas = modelo._base_manager.filter(pk__in=pks).delete()[0]
+        borradas += filas
+        if al_avanzar is not None:
+            al_avanzar(filas)
+        if pausa_ms:
+            time.sleep(pausa_ms / 1000)
+
+
+def aplicar(politica, tamano=TAMANO_CHUNK, pausa_ms=PAUSA_MS, simular=False):
+    """
+    Aplica una política: pliega y borra las mediciones crudas vencidas (por
+    dispositivo, en orden del índice (dispositivo, fecha)) y borra los
+    resúmenes vencidos. Con `simular` solo cuenta lo que se borraría.
+    """
+    limites = cortes(politica)
+    dispositivo_ids = list(
+        Dispositivo.objects.filter(zona__organizacion_id=politica.organizacion_id).values_list('id', flat=True)
+    )
+    resultado = {'dias_plegados': 0, 'mediciones_plegadas': 0}
+
+    # Nunca se borra un día que no esté plegado, aunque la política cambie
+    corte_crudo = limites['crudo']
+    if simular:
+        resultado['mediciones'] = Medicion.objects.filter(
+            dispositivo_id__in=dispositivo_ids, fecha__lt=corte_crudo
+        ).count()
+    else:
+        resultado['dias_plegados'], resultado['mediciones_plegadas'] = plegar(politica, corte_crudo)
+        corte_crudo = min(corte_crudo, politica.plegado_hasta)
+        resultado['mediciones'] = sum(
+            borrar_en_chunks(
+                Medicion.objects.filter(dispositivo_id=dispositivo_id, fecha__lt=corte_crudo).order_by('fecha'),
+                tamano, pausa_ms,
+            )
+            for dispositivo_id in dispositivo_ids
+        )
+
+    for nivel, modelo in (('horario', ResumenHorario), ('diario', ResumenDiario)):
+        if limites[nivel] is None:
+            resultado[nivel] = 0
+            continue
+        resumenes = modelo.objects.filter(
+            organizacion_id=politica.organizacion_id, periodo__lt=limites[nivel]
+        ).order_by('periodo')
+        resultado[nivel] = resumenes.count() if simular else borrar_en_chunks(resumenes, tamano, pausa_ms)
+
+    if not simular:
+        politica.ultima_ejecucion = timezone.now()
+        politica.save(update_fields=['ultima_ejecucion'])
+        logger.info(f'Retención {politica.organizacion.nombre}: {resultado}')
+    return resultado
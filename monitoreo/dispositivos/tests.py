@@ -1,3 +1,1387 @@
-from django.test import TestCase
+import importlib
+import io
+import random
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from unittest import mock, skipIf
+
+from usuarios.models import Organizacion, Perfil
+
+from . import alertas, anomalias, archivo as modulo_archivo, replicas, umbrales
+from .alertas import LIBERA, MIN_VECTORIZADO, NIVELES, evaluar
+from .anomalias import AlmacenEstados, combinar, guardar_punto_control, puntuar
+from .archivo import ArchivoInvalido, ArchivoMes, archivar_mes, codificar, leer_mes, limites_mes
+from .binario import (
+    CABECERA, MAGIA, REGISTROS, VERSION, VERSION_SECUENCIA, LoteDemasiadoGrande, codificar_lote,
+    decodificar_lote,
+)
+from .buffer import BufferMediciones, obtener_buffer
+from .consistencia import contar, corregir, corregir_pendientes
+from .ingesta import (
+    MAX_BYTES_LINEA, MAX_LECTURAS_POR_LOTE, LecturaInvalida, guardar_mediciones, leer_csv, leer_ndjson,
+    procesar_flujo, procesar_lote, recalcular_ultima_lectura, validar_fecha, validar_lectura,
+)
+from .management.commands.ingest_server import LimitesLocales, ServidorIngesta, parsear_linea
+from .models import (
+    Alerta, Dispositivo, EstadoAnomalia, Medicion, PerfilUmbrales, PoliticaRetencion, Purga, ResumenDiario,
+    ResumenHorario, Zona,
+)
+from .purga import marcar_eliminado, pendientes, purgar
+from .replicas import COOKIE_PRIMARIA, ReplicasMiddleware, RouterReplicas
+from .resumenes import limites_dia, reconstruir_rango
+from .retencion import aplicar, cortes
+from .views import ultimas_mediciones
+
+CACHE_LOCAL = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+SIN_EXTRAS = dict(CACHES=CACHE_LOCAL, ALERTAS_ACTIVAS=False, ANOMALIAS_ACTIVAS=False)
+
+
+def crear_dispositivo(nombre='Medidor', organizacion=None, **campos):
+    """Dispositivo en una zona nueva de `organizacion` (o de una organización nueva)."""
+    if organizacion is None:
+        organizacion = Organizacion.objects.create(nombre=f'Org {nombre}')
+    zona = Zona.objects.create(nombre=f'Zona {nombre}', organizacion=organizacion)
+    return Dispositivo.objects.create(nombre=nombre, zona=zona, **campos)
+
+
+class LectoresFlujoTests(SimpleTestCase):
+
+    def test_ndjson(self):
+        flujo = io.BytesIO(b'{"dispositivo": 1, "consumo": 2}\n\n  \n{malo\n' + b'{"a": 1}')
+        lecturas = list(leer_ndjson(flujo))
+        self.assertEqual(lecturas[0], {'dispositivo': 1, 'consumo': 2})
+        self.assertIsInstance(lecturas[1], LecturaInvalida)
+        self.assertEqual(lecturas[2], {'a': 1})
+
+    def test_linea_demasiado_larga_se_descarta_completa(self):
+        larga = b'{"x": "' + b'a' * (MAX_BYTES_LINEA * 3) + b'"}\n'
+        lecturas = list(leer_ndjson(io.BytesIO(larga + b'{"ok": true}\n')))
+        self.assertEqual(len(lecturas), 2)
+        self.assertIsInstance(lecturas[0], LecturaInvalida)
+        self.assertEqual(lecturas[1], {'ok': True})
+
+    def test_csv_con_cabecera(self):
+        flujo = io.BytesIO(b'Dispositivo, Consumo ,fecha\n1,2.5,2025-01-01T00:00:00Z\n\n2,"3",\n')
+        self.assertEqual(list(leer_csv(flujo)), [
+            {'dispositivo': '1', 'consumo': '2.5', 'fecha': '2025-01-01T00:00:00Z'},
+            {'dispositivo': '2', 'consumo': '3', 'fecha': ''},
+        ])
+
+
+@override_settings(**SIN_EXTRAS)
+class ProcesarFlujoTests(TestCase):
+
+    def setUp(self):
+        self.dispositivo = crear_dispositivo()
+
+    def lecturas(self, cantidad):
+        return ({'dispositivo': self.dispositivo.id, 'consumo': 1} for _ in range(cantidad))
+
+    def test_confirma_por_chunk(self):
+        resumenes = list(procesar_flujo(self.lecturas(5), tamano_chunk=2))
+        self.assertEqual([r['procesadas'] for r in resumenes], [2, 4, 5, 5])
+        self.assertTrue(resumenes[-1]['fin'])
+        self.assertEqual(Medicion.objects.count(), 5)
+
+    def test_control_detiene_sin_guardar_el_chunk(self):
+        llamadas = []
+
+        def control(chunk):
+            llamadas.append(len(chunk))
+            return 'Alto.' if len(llamadas) == 2 else None
+
+        resumenes = list(procesar_flujo(self.lecturas(5), tamano_chunk=2, control=control))
+        self.assertEqual(resumenes[-1], {
+            'fin': True, 'procesadas': 2, 'creadas': 2, 'duplicadas': 0, 'total_errores': 0, 'error': 'Alto.',
+        })
+        self.assertEqual(Medicion.objects.count(), 2)
+
+    def test_organizacion_ajena(self):
+        otra = Organizacion.objects.create(nombre='Otra')
+        resumenes = list(procesar_flujo(self.lecturas(3), organizacion=otra))
+        self.assertEqual(resumenes[-1]['total_errores'], 3)
+        self.assertFalse(Medicion.objects.exists())
+
+
+class ValidarLecturaTests(SimpleTestCase):
+
+    def test_fechas_de_origen(self):
+        utc = datetime(2025, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc)
+        self.assertEqual(validar_fecha('2025-01-02T03:04:05Z'), utc)
+        self.assertEqual(validar_fecha('2025-01-02T00:04:05-03:00'), utc)
+        self.assertEqual(validar_fecha(utc.timestamp()), utc)
+        # Sin zona horaria se asume la de settings.TIME_ZONE
+        local = timezone.make_aware(datetime(2025, 1, 2, 3, 4, 5))
+        self.assertEqual(validar_fecha('2025-01-02T03:04:05'), local)
+
+    def test_fechas_invalidas(self):
+        futuro = timezone.now() + timedelta(hours=1)
+        for valor in ('ayer', '2025-13-01T00:00:00', True, 1e20, futuro.isoformat(), futuro.timestamp()):
+            with self.subTest(valor=valor), self.assertRaises(LecturaInvalida):
+                validar_fecha(valor)
+
+    def test_lectura_sin_fecha_ni_secuencia(self):
+        self.assertEqual(validar_lectura({'dispositivo': '3', 'consumo': '1.234'}), (3, 1.23, None, None))
+
+    def test_campos_invalidos(self):
+        for dato in (
+            {'dispositivo': True, 'consumo': 1},
+            {'dispositivo': 1, 'consumo': 'nan'},
+            {'dispositivo': 1, 'consumo': 10000},
+            {'dispositivo': 1, 'consumo': 0.001},
+            {'dispositivo': 1, 'consumo': 1, 'secuencia': -1},
+            {'dispositivo': 1, 'consumo': 1, 'secuencia': 'a'},
+        ):
+            with self.subTest(dato=dato), self.assertRaises(LecturaInvalida):
+                validar_lectura(dato)
+
+
+@override_settings(**SIN_EXTRAS)
+class GuardarMedicionesTests(TestCase):
+
+    def test_fechas_de_origen_y_orden_de_insercion(self):
+        organizacion = Organizacion.objects.create(nombre='Org')
+        a = crear_dispositivo('A', organizacion)
+        b = crear_dispositivo('B', organizacion)
+        base = timezone.now().replace(microsecond=0) - timedelta(days=2)
+        antes = timezone.now()
+        guardar_mediciones([
+            Medicion(dispositivo=b, consumo=1, fecha=base + timedelta(hours=1)),
+            Medicion(dispositivo=a, consumo=2, fecha=base + timedelta(hours=2)),
+            Medicion(dispositivo=b, consumo=3, fecha=base),
+            Medicion(dispositivo=a, consumo=4),
+        ])
+        filas = list(Medicion.objects.order_by('id').values_list('dispositivo_id', 'consumo', 'fecha'))
+        # Insertadas por (dispositivo, fecha) y con la hora de origen intacta
+        self.assertEqual([(d, c) for d, c, _ in filas], [(a.id, 2), (a.id, 4), (b.id, 3), (b.id, 1)])
+        self.assertEqual(filas[2][2], base)
+        # Sin fecha de origen se usa la hora de llegada
+        self.assertGreaterEqual(filas[1][2], antes)
+
+
+@override_settings(**SIN_EXTRAS)
+class DuplicadasTests(TestCase):
+
+    def setUp(self):
+        self.dispositivo = crear_dispositivo('A')
+        self.otro = crear_dispositivo('B')
+
+    def lectura(self, secuencia, dispositivo=None, consumo=1):
+        dispositivo = dispositivo or self.dispositivo
+        return {'dispositivo': dispositivo.id, 'consumo': consumo, 'secuencia': secuencia}
+
+    def test_reintento_no_duplica(self):
+        lote = [self.lectura(1), self.lectura(2), self.lectura(None)]
+        self.assertEqual(procesar_lote(lote)['creadas'], 3)
+        resultado = procesar_lote(lote + [self.lectura(3)])
+        # Sin secuencia no se puede reconocer el reintento
+        self.assertEqual((resultado['creadas'], resultado['duplicadas']), (2, 2))
+        self.assertEqual(Medicion.objects.count(), 5)
+        # Los resúmenes cuentan solo lo insertado
+        self.assertEqual(ResumenDiario.objects.get().cantidad, 5)
+
+    def test_duplicada_dentro_del_lote(self):
+        resultado = procesar_lote([self.lectura(7, consumo=1), self.lectura(7, consumo=2)])
+        self.assertEqual((resultado['creadas'], resultado['duplicadas']), (1, 1))
+        self.assertEqual(Medicion.objects.get().consumo, 1)
+
+    def test_secuencia_es_por_dispositivo(self):
+        resultado = procesar_lote([self.lectura(1), self.lectura(1, self.otro)])
+        self.assertEqual(resultado['creadas'], 2)
+
+    def test_insert_directo_duplicado_falla(self):
+        procesar_lote([self.lectura(1)])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Medicion.objects.create(dispositivo=self.dispositivo, consumo=1, secuencia=1)
+
+
+class BufferMedicionesTests(SimpleTestCase):
+    """La lógica de agrupación, con el guardado reemplazado: no toca la base."""
+
+    def setUp(self):
+        self.llamadas = []
+        self.fallar = lambda mediciones: False
+
+        def guardar(mediciones):
+            self.llamadas.append(list(mediciones))
+            if self.fallar(mediciones):
+                raise RuntimeError('falla simulada')
+            return mediciones
+
+        for nombre, reemplazo in (('guardar_mediciones', guardar), ('close_old_connections', mock.DEFAULT)):
+            parche = mock.patch(f'dispositivos.buffer.{nombre}', reemplazo)
+            parche.start()
+            self.addCleanup(parche.stop)
+        self.buffer = BufferMediciones(max_filas=3, max_espera_ms=2000)
+        self.addCleanup(self.buffer.cerrar)
+
+    def en_paralelo(self, grupos):
+        resultados = [None] * len(grupos)
+
+        def agregar(i):
+            try:
+                resultados[i] = self.buffer.agregar(grupos[i])
+            except Exception as e:
+                resultados[i] = e
+
+        hilos = [threading.Thread(target=agregar, args=(i,)) for i in range(len(grupos))]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join(5)
+            self.assertFalse(hilo.is_alive(), 'una petición quedó esperando')
+        return resultados
+
+    def test_agrupa_peticiones_concurrentes(self):
+        grupos = [[Medicion(consumo=i)] for i in range(3)]
+        resultados = self.en_paralelo(grupos)
+        # max_filas alcanzado: un solo guardado, sin esperar los 2 s
+        self.assertEqual(len(self.llamadas), 1)
+        self.assertEqual(sorted(m.consumo for m in self.llamadas[0]), [0, 1, 2])
+        self.assertEqual(resultados, grupos)
+
+    def test_lote_fallido_se_reintenta_por_peticion(self):
+        self.fallar = lambda mediciones: any(m.consumo < 0 for m in mediciones)
+        grupos = [[Medicion(consumo=1)], [Medicion(consumo=-1)], [Medicion(consumo=2)]]
+        resultados = self.en_paralelo(grupos)
+        self.assertEqual(resultados[0], grupos[0])
+        self.assertIsInstance(resultados[1], RuntimeError)
+        self.assertEqual(resultados[2], grupos[2])
+
+    def test_sobrevive_a_la_base_caida(self):
+        import dispositivos.buffer as modulo
+        modulo.close_old_connections.side_effect = RuntimeError('base caída')
+        self.fallar = lambda mediciones: True
+        self.buffer.max_filas = 1
+        with self.assertRaises(RuntimeError):
+            self.buffer.agregar([Medicion(consumo=1)])
+        # El hilo sigue vivo y atiende lo siguiente cuando la base vuelve
+        modulo.close_old_connections.side_effect = None
+        self.fallar = lambda mediciones: False
+        lectura = [Medicion(consumo=2)]
+        self.assertEqual(self.buffer.agregar(lectura), lectura)
+
+    def test_cerrado_guarda_directo(self):
+        self.buffer.cerrar()
+        lectura = [Medicion(consumo=1)]
+        self.assertEqual(self.buffer.agregar(lectura), lectura)
+        self.assertEqual(self.llamadas, [lectura])
+
+    @override_settings(INGESTA_BUFFER_ACTIVO=False)
+    def test_desactivado(self):
+        self.assertIsNone(obtener_buffer())
+
+
+class ServidorSincrono(ServidorIngesta):
+    """Ejecuta el ORM en el hilo y la conexión del test, dentro de su transacción."""
+
+    async def _ejecutar_db(self, funcion, *args):
+        return funcion(*args)
+
+
+def completar(corrutina):
+    """
+    Corre una corrutina que no llega a suspenderse sin event loop: bajo un
+    loop Django usaría otra conexión, fuera de la transacción del test.
+    """
+    try:
+        corrutina.send(None)
+    except StopIteration as fin:
+        return fin.value
+    raise AssertionError('La corrutina se suspendió')
+
+
+class IngestServerTests(SimpleTestCase):
+
+    def test_parsear_linea(self):
+        self.assertEqual(
+            parsear_linea('3 1700000000 1.5'), {'dispositivo': '3', 'consumo': '1.5', 'fecha': 1700000000.0}
+        )
+        self.assertEqual(
+            parsear_linea('3,2025-01-01T00:00:00Z,1.5,9'),
+            {'dispositivo': '3', 'consumo': '1.5', 'fecha': '2025-01-01T00:00:00Z', 'secuencia': '9'},
+        )
+        for linea in ('3 1.5', '1 2 3 4 5'):
+            with self.subTest(linea=linea), self.assertRaises(LecturaInvalida):
+                parsear_linea(linea)
+
+    @override_settings(
+        INGESTA_LIMITE_ACTIVO=True,
+        INGESTA_LIMITE_DISPOSITIVO={'TASA': 1, 'RAFAGA': 2},
+        INGESTA_LIMITE_ORGANIZACION={'TASA': 10, 'RAFAGA': 3},
+    )
+    def test_limites_locales(self):
+        limites = LimitesLocales()
+        with mock.patch('time.monotonic', return_value=100.0):
+            self.assertEqual([limites.consumir(1, 7) for _ in range(3)], [0, 0, 1.0])
+            # El dispositivo 2 tiene fichas pero a la organización le queda una
+            self.assertEqual(limites.consumir(2, 7), 0)
+            self.assertAlmostEqual(limites.consumir(2, 7), 0.1)
+        with mock.patch('time.monotonic', return_value=101.0):
+            self.assertEqual(limites.consumir(1, 7), 0)
+
+
+@override_settings(**SIN_EXTRAS)
+class IngestServerVaciarTests(TestCase):
+
+    def setUp(self):
+        parche = mock.patch('dispositivos.management.commands.ingest_server.close_old_connections')
+        self.close_old_connections = parche.start()
+        self.addCleanup(parche.stop)
+        self.dispositivo = crear_dispositivo()
+        self.servidor = ServidorSincrono(
+            max_filas=100, max_espera_ms=10, max_cola=100, intervalo_metricas=60, refresco_dispositivos=60
+        )
+        self.addCleanup(self.servidor.executor.shutdown)
+        self.servidor.dispositivos = {
+            self.dispositivo.id: self.dispositivo.zona.organizacion_id, 999999: None,
+        }
+
+    def test_lote_fallido_se_reintenta_por_fila(self):
+        lote = [
+            Medicion(dispositivo_id=self.dispositivo.id, consumo=1),
+            # consumo nulo: el INSERT falla
+            Medicion(dispositivo_id=self.dispositivo.id, consumo=None),
+            Medicion(dispositivo_id=999999, consumo=None),
+            Medicion(dispositivo_id=self.dispositivo.id, consumo=2),
+        ]
+        completar(self.servidor._vaciar(lote))
+        metricas = self.servidor.metricas
+        self.assertEqual((metricas.errores_escritura, metricas.guardadas, metricas.perdidas), (1, 2, 2))
+        self.assertEqual(metricas.duplicadas, 0)
+        self.assertEqual(Medicion.objects.count(), 2)
+        # El dispositivo inexistente deja de aceptarse sin esperar al refresco
+        self.assertEqual(list(self.servidor.dispositivos), [self.dispositivo.id])
+
+    def test_sin_base_cuenta_perdidas(self):
+        self.close_old_connections.side_effect = RuntimeError('base caída')
+        completar(self.servidor._vaciar([Medicion(dispositivo_id=self.dispositivo.id, consumo=1)] * 3))
+        self.assertEqual((self.servidor.metricas.perdidas, self.servidor.metricas.vaciados), (3, 0))
+
+
+def _fecha(minutos):
+    """Fecha con precisión de milisegundos, la que guarda el formato binario."""
+    return datetime(2025, 3, 1, 12, 0, tzinfo=dt_timezone.utc) + timedelta(minutes=minutos, milliseconds=7)
+
+
+class FormatoBinarioTests(SimpleTestCase):
+
+    def test_ida_y_vuelta_con_secuencia(self):
+        # Desordenadas: el segundo registro lleva un delta negativo
+        lecturas = [(3, _fecha(10), 1.5, 100), (3, _fecha(-120), 12.25, 101), (7, _fecha(11), 0.0, 5)]
+        datos = codificar_lote(lecturas)
+        self.assertEqual(CABECERA.unpack_from(datos)[1], VERSION_SECUENCIA)
+
+        validas, errores = decodificar_lote(datos, inicio=4)
+        self.assertEqual(errores, [])
+        self.assertEqual(validas, [
+            (4 + i, dispositivo_id, consumo, fecha, secuencia)
+            for i, (dispositivo_id, fecha, consumo, secuencia) in enumerate(lecturas)
+        ])
+
+    def test_ida_y_vuelta_sin_secuencia(self):
+        lecturas = [(1, _fecha(0), 2.5), (2, _fecha(-1), 3.75)]
+        datos = codificar_lote(lecturas)
+        self.assertEqual(CABECERA.unpack_from(datos)[1], VERSION)
+        validas, errores = decodificar_lote(datos)
+        self.assertEqual(errores, [])
+        self.assertEqual([v[1:] for v in validas], [(d, c, f, None) for d, f, c in lecturas])
+
+    def test_lote_vacio(self):
+        self.assertEqual(decodificar_lote(codificar_lote([])), ([], []))
+
+    def test_acepta_la_version_1(self):
+        base = int(_fecha(0).timestamp() * 1000)
+        datos = CABECERA.pack(MAGIA, 1, 2, base)
+        datos += REGISTROS[1].pack(4, 0, 1.5) + REGISTROS[1].pack(4, 60000, 2.5)
+        validas, _ = decodificar_lote(datos)
+        self.assertEqual([(v[3], v[2]) for v in validas], [(_fecha(0), 1.5), (_fecha(1), 2.5)])
+
+    def test_rechaza_lote_grande_solo_con_la_cabecera(self):
+        # Sin registros: se rechaza antes de comprobar el tamaño o decodificar
+        datos = CABECERA.pack(MAGIA, VERSION, MAX_LECTURAS_POR_LOTE + 1, 0)
+        with self.assertRaises(LoteDemasiadoGrande):
+            decodificar_lote(datos)
+
+    def test_rechaza_lotes_malformados(self):
+        datos = codificar_lote([(1, _fecha(0), 2.5)])
+        for malformado in (datos[:10], datos[:-1], b'XYZ' + datos[3:], datos[:3] + bytes([9]) + datos[4:]):
+            with self.assertRaises(LecturaInvalida):
+                decodificar_lote(malformado)
+
+    def test_informa_registros_invalidos(self):
+        ahora = timezone.now()
+        datos = codificar_lote([
+            (1, ahora, -1.0), (1, ahora, 20000.0), (1, ahora + timedelta(hours=1), 1.0), (1, ahora, 1.0)
+        ])
+        validas, errores = decodificar_lote(datos)
+        self.assertEqual([e['indice'] for e in errores], [0, 1, 2])
+        self.assertEqual([v[0] for v in validas], [3])
+
+    def test_codificar_valida_limites(self):
+        with self.assertRaises(ValueError):
+            codificar_lote([(1, _fecha(0), 1.0), (1, _fecha(60 * 24 * 30), 1.0)])
+        with self.assertRaises(ValueError):
+            codificar_lote([(1, _fecha(0), 1.0, 1), (1, _fecha(1), 1.0)])
+
+    def test_limites_del_consumo_sobreviven_a_float32(self):
+        datos = codificar_lote([(1, _fecha(0), 0.01), (1, _fecha(1), 9999.99), (1, _fecha(2), 0.004)])
+        validas, errores = decodificar_lote(datos)
+        self.assertEqual([v[2] for v in validas], [0.01, 9999.99])
+        self.assertEqual([e['indice'] for e in errores], [2])
+
+
+@override_settings(**SIN_EXTRAS)
+class ResumenesTests(TestCase):
+
+    def setUp(self):
+        self.dispositivo = crear_dispositivo('A')
+        self.otro = crear_dispositivo('B')
+        self.base = timezone.make_aware(datetime(2025, 3, 10, 10, 15))
+
+    def guardar(self, *lecturas, dispositivo=None):
+        return guardar_mediciones([
+            Medicion(
+                dispositivo=dispositivo or self.dispositivo, consumo=consumo,
+                fecha=self.base + timedelta(minutes=minutos),
+            )
+            for minutos, consumo in lecturas
+        ])
+
+    def resumen(self, modelo, **filtros):
+        fila = modelo.objects.filter(dispositivo=self.dispositivo, **filtros).values(
+            'cantidad', 'suma', 'minimo', 'maximo', 'ultimo', 'zona_id', 'organizacion_id'
+        )
+        return fila.get()
+
+    def test_se_acumulan_por_lote(self):
+        self.guardar((0, 2), (30, 5))
+        # Una lectura atrasada no reemplaza a la última de su hora
+        self.guardar((50, 1), (-5, 9), (60, 4))
+        horas = ResumenHorario.objects.filter(dispositivo=self.dispositivo).order_by('periodo')
+        self.assertEqual(list(horas.values_list('periodo', 'cantidad', 'suma', 'ultimo')), [
+            (self.base.replace(minute=0), 3, 16, 5),
+            (self.base.replace(hour=11, minute=0), 2, 5, 4),
+        ])
+        self.assertEqual(self.resumen(ResumenDiario), {
+            'cantidad': 5, 'suma': 21, 'minimo': 1, 'maximo': 9, 'ultimo': 4,
+            'zona_id': self.dispositivo.zona_id, 'organizacion_id': self.dispositivo.zona.organizacion_id,
+        })
+
+    def test_reconstruir_rango(self):
+        self.guardar((0, 2), (30, 5))
+        self.guardar((0, 7), dispositivo=self.otro)
+        ResumenDiario.objects.update(suma=0, cantidad=0)
+        Medicion.objects.filter(dispositivo=self.dispositivo, consumo=5).delete()
+
+        inicio, fin = limites_dia(self.base.date())
+        self.assertEqual(reconstruir_rango(inicio, fin, self.dispositivo.id), 1)
+        self.assertEqual(self.resumen(ResumenDiario)['suma'], 2)
+        self.assertEqual(self.resumen(ResumenHorario)['cantidad'], 1)
+        # Fuera del filtro no se toca nada
+        self.assertEqual(ResumenDiario.objects.get(dispositivo=self.otro).suma, 0)
+
+        Medicion.objects.filter(dispositivo=self.dispositivo).delete()
+        reconstruir_rango(inicio, fin, self.dispositivo.id)
+        self.assertFalse(ResumenHorario.objects.filter(dispositivo=self.dispositivo).exists())
+
+
+@override_settings(**SIN_EXTRAS)
+class RetencionTests(TestCase):
+
+    def setUp(self):
+        self.dispositivo = crear_dispositivo('A')
+        self.organizacion = self.dispositivo.zona.organizacion
+        self.hoy = timezone.localdate()
+        guardar_mediciones([
+            Medicion(dispositivo=self.dispositivo, consumo=consumo, fecha=self.hace(dias))
+            for dias, consumo in ((10, 1), (10, 2), (3, 4))
+        ])
+
+    def hace(self, dias):
+        return limites_dia(self.hoy - timedelta(days=dias))[0] + timedelta(hours=12)
+
+    def politica(self):
+        return PoliticaRetencion.objects.create(organizacion=self.organizacion, dias_crudo=5, dias_horario=8)
+
+    def test_cortes(self):
+        politica = PoliticaRetencion(dias_crudo=30, dias_horario=10, dias_diario=5)
+        # Un nivel agregado nunca vence antes que el más fino
+        self.assertEqual(cortes(politica, self.hoy), {
+            'crudo': limites_dia(self.hoy - timedelta(days=30))[0],
+            'horario': limites_dia(self.hoy - timedelta(days=30))[0],
+            'diario': limites_dia(self.hoy - timedelta(days=30))[0],
+        })
+        politica.dias_horario = None
+        self.assertEqual(cortes(politica, self.hoy)['diario'], None)
+
+    def test_simular_no_borra(self):
+        politica = self.politica()
+        resultado = aplicar(politica, pausa_ms=0, simular=True)
+        self.assertEqual((resultado['mediciones'], resultado['horario'], resultado['diario']), (2, 1, 0))
+        self.assertEqual(Medicion.objects.count(), 3)
+        self.assertIsNone(politica.plegado_hasta)
+
+    def test_pliega_antes_de_borrar(self):
+        politica = self.politica()
+        # Un resumen desactualizado se reconstruye desde las crudas antes de
+        # borrarlas; el del día que no vence queda como estaba
+        ResumenDiario.objects.update(suma=0)
+        resultado = aplicar(politica, tamano=1, pausa_ms=0)
+        self.assertEqual(
+            (resultado['mediciones'], resultado['horario'], resultado['dias_plegados']), (2, 1, 1)
+        )
+        self.assertEqual(list(Medicion.objects.values_list('consumo', flat=True)), [4])
+        self.assertEqual(
+            list(ResumenDiario.objects.order_by('periodo').values_list('cantidad', 'suma')), [(2, 3), (1, 0)]
+        )
+        self.assertEqual(ResumenHorario.objects.count(), 1)
+        politica.refresh_from_db()
+        self.assertEqual(politica.plegado_hasta, limites_dia(self.hoy - timedelta(days=5))[0])
+
+        # Una segunda pasada no encuentra nada que plegar ni borrar
+        resultado = aplicar(politica, pausa_ms=0)
+        self.assertEqual((resultado['mediciones'], resultado['dias_plegados']), (0, 0))
+
+
+@override_settings(**SIN_EXTRAS)
+class UltimasMedicionesTests(TestCase):
+
+    def setUp(self):
+        self.organizacion = Organizacion.objects.create(nombre='Org')
+        self.dispositivos = [crear_dispositivo(f'D{i}', self.organizacion) for i in range(3)]
+        ahora = timezone.now()
+        # Lecturas viejas: el panel no debe esconderlas tras una ventana fija
+        guardar_mediciones([
+            Medicion(dispositivo=dispositivo, consumo=1, fecha=ahora - timedelta(days=30 + dias))
+            for dias in range(5) for dispositivo in self.dispositivos
+        ])
+        self.esperadas = list(Medicion.objects.order_by('-fecha').values_list('id', flat=True)[:4])
+
+    def ultimas(self):
+        ultimas = ultimas_mediciones(Medicion.objects.all(), Dispositivo.objects.all(), cantidad=4)
+        return [m.id for m in ultimas]
+
+    def test_mas_recientes_sin_ventana(self):
+        self.assertEqual(self.ultimas(), self.esperadas)
+
+    def test_last_fecha_desactualizado(self):
+        # Un corte demasiado alto deja menos filas de las pedidas: se repite sin filtro
+        Dispositivo.objects.update(last_fecha=timezone.now())
+        self.assertEqual(self.ultimas(), self.esperadas)
+
+    def test_panel(self):
+        usuario = User.objects.create_user('cliente', password='clave')
+        Perfil.objects.create(user=usuario, organizacion=self.organizacion, rol='cliente_admin')
+        self.client.login(username='cliente', password='clave')
+        respuesta = self.client.get(reverse('dispositivos:dashboard'))
+        self.assertEqual(len(respuesta.context['mediciones']), 10)
+
+
+class ArchivoTests(SimpleTestCase):
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = Path(directorio.name)
+
+    def _escribir(self, datos):
+        ruta = self.directorio / 'mes.eca'
+        ruta.write_bytes(datos)
+        return ruta
+
+    def test_ida_y_vuelta(self):
+        azar = random.Random(3)
+        fecha = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        filas = []
+        for _ in range(2000):
+            # Intervalos casi periódicos y consumos parecidos, con algún salto
+            fecha += timedelta(seconds=60, microseconds=azar.choice([0, 0, 0, 13]))
+            filas.append((fecha, azar.choice([1.25, 1.3, round(azar.uniform(0, 50), 2)])))
+
+        with ArchivoMes(self._escribir(codificar(42, filas))) as archivo:
+            self.assertEqual(archivo.dispositivo_id, 42)
+            self.assertEqual(archivo.serie(), filas)
+            resumen = archivo.resumen()
+        consumos = [c for _, c in filas]
+        self.assertEqual(resumen['cantidad'], len(filas))
+        self.assertAlmostEqual(resumen['suma'], sum(consumos))
+        self.assertEqual((resumen['minimo'], resumen['maximo']), (min(consumos), max(consumos)))
+        self.assertEqual((resumen['desde'], resumen['hasta']), (filas[0][0], filas[-1][0]))
+
+    def test_sin_numpy_da_lo_mismo(self):
+        fecha = datetime(2025, 1, 1, 2, tzinfo=dt_timezone.utc)
+        filas = [(fecha + timedelta(minutes=17 * i), round(i * 0.37 % 9, 2)) for i in range(500)]
+        with ArchivoMes(self._escribir(codificar(1, filas))) as archivo:
+            serie, dias = archivo.serie(), archivo.por_dia()
+            with mock.patch.object(modulo_archivo, 'np', None):
+                self.assertEqual(archivo.serie(), serie)
+                self.assertEqual(archivo.por_dia(), dias)
+        self.assertEqual(serie, filas)
+        self.assertEqual(sum(d['cantidad'] for d in dias), 500)
+
+    def test_rechaza_archivos_danados(self):
+        datos = codificar(1, [(datetime(2025, 1, 1, tzinfo=dt_timezone.utc), 1.0)])
+        for danado in (b'', datos[:20], datos[:-1], b'XXXX' + datos[4:]):
+            with self.assertRaises(ArchivoInvalido):
+                ArchivoMes(self._escribir(danado)).cerrar()
+
+
+class ArchivarMesTests(TestCase):
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(ARCHIVO_MEDICIONES_DIR=directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        organizacion = Organizacion.objects.create(nombre='Org')
+        zona = Zona.objects.create(nombre='Zona', organizacion=organizacion)
+        self.dispositivo = Dispositivo.objects.create(nombre='Medidor', zona=zona)
+        self.mes = date(2025, 2, 1)
+        self.inicio = limites_mes(self.mes)[0]
+
+    def crear(self, horas):
+        Medicion.objects.bulk_create([
+            Medicion(
+                dispositivo=self.dispositivo, consumo=hora / 4, fecha=self.inicio + timedelta(hours=hora)
+            )
+            for hora in horas
+        ])
+
+    def test_archivar_y_completar_sin_duplicar(self):
+        self.crear(range(0, 48))
+        # Una lectura del mes siguiente no entra
+        self.crear([24 * 28])
+        self.assertEqual(archivar_mes(self.dispositivo.id, self.mes), 48)
+        self.crear(range(48, 60))
+        self.assertEqual(archivar_mes(self.dispositivo.id, self.mes), 60)
+
+        with leer_mes(self.dispositivo.id, self.mes) as archivo:
+            serie = archivo.serie()
+            dias = archivo.por_dia()
+        esperadas = list(
+            Medicion.objects.filter(fecha__lt=limites_mes(self.mes)[1])
+            .order_by('fecha').values_list('fecha', 'consumo')
+        )
+        self.assertEqual(serie, esperadas)
+        self.assertEqual(sum(d['cantidad'] for d in dias), 60)
+
+    def test_lecturas_identicas_no_se_colapsan(self):
+        self.crear([1, 1, 2])
+        self.assertEqual(archivar_mes(self.dispositivo.id, self.mes), 3)
+        # Repetir tras una carga tardía: lo ya archivado no se duplica
+        self.crear([1, 5])
+        self.assertEqual(archivar_mes(self.dispositivo.id, self.mes), 5)
+        # Y lo que ya no está en la base se conserva
+        Medicion.objects.filter(fecha__lt=self.inicio + timedelta(hours=2)).delete()
+        self.crear([7])
+        self.assertEqual(archivar_mes(self.dispositivo.id, self.mes), 6)
+        with leer_mes(self.dispositivo.id, self.mes) as archivo:
+            horas = [(fecha - self.inicio) // timedelta(hours=1) for fecha, _ in archivo.serie()]
+        self.assertEqual(horas, [1, 1, 1, 2, 5, 7])
+
+    def test_mes_sin_mediciones(self):
+        self.assertEqual(archivar_mes(self.dispositivo.id, self.mes), 0)
+        self.assertIsNone(leer_mes(self.dispositivo.id, self.mes))
+
+
+@override_settings(**SIN_EXTRAS)
+class UltimaLecturaTests(TestCase):
+
+    def setUp(self):
+        self.dispositivo = crear_dispositivo('A', watts=100)
+        self.base = timezone.now().replace(microsecond=0) - timedelta(hours=5)
+
+    def guardar(self, *lecturas):
+        guardar_mediciones([
+            Medicion(dispositivo=self.dispositivo, consumo=consumo, fecha=self.base + timedelta(hours=horas))
+            for horas, consumo in lecturas
+        ])
+
+    def ultima(self):
+        return Dispositivo.objects.values_list('last_consumo', 'last_fecha').get(pk=self.dispositivo.pk)
+
+    def test_lote_atrasado_no_pisa_la_ultima(self):
+        self.guardar((2, 5), (1, 3))
+        self.assertEqual(self.ultima(), (5, self.base + timedelta(hours=2)))
+        self.guardar((0, 9))
+        self.assertEqual(self.ultima(), (5, self.base + timedelta(hours=2)))
+
+    def test_recalcular_tras_borrar(self):
+        self.guardar((1, 3), (2, 5))
+        Medicion.objects.filter(consumo=5).delete()
+        recalcular_ultima_lectura({self.dispositivo.id})
+        self.assertEqual(self.ultima(), (3, self.base + timedelta(hours=1)))
+        Medicion.objects.all().delete()
+        recalcular_ultima_lectura({self.dispositivo.id})
+        self.assertEqual(self.ultima(), (None, None))
+
+    def test_editar_no_pisa_la_ultima_lectura(self):
+        usuario = User.objects.create_user('admin', password='clave')
+        organizacion = self.dispositivo.zona.organizacion
+        Perfil.objects.create(user=usuario, organizacion=organizacion, rol='cliente_admin')
+        self.client.login(username='admin', password='clave')
+        # La página del formulario se abrió antes de esta lectura
+        self.guardar((1, 7))
+        respuesta = self.client.post(reverse('dispositivos:dispositivo_edit', args=[self.dispositivo.id]), {
+            'nombre': 'Renombrado', 'categoria': 'General', 'zona': self.dispositivo.zona_id, 'watts': 50,
+        })
+        self.assertEqual(respuesta.status_code, 302)
+        self.dispositivo.refresh_from_db()
+        self.assertEqual((self.dispositivo.nombre, self.dispositivo.watts), ('Renombrado', 50))
+        self.assertEqual(self.dispositivo.last_consumo, 7)
+
+
+@override_settings(**SIN_EXTRAS)
+class ConsistenciaTests(TestCase):
+
+    def setUp(self):
+        self.origen = Organizacion.objects.create(nombre='Origen')
+        self.destino = Organizacion.objects.create(nombre='Destino')
+        self.dispositivo = crear_dispositivo('Medidor', organizacion=self.origen)
+        self.zona_destino = Zona.objects.create(nombre='Zona destino', organizacion=self.destino)
+        ahora = timezone.now()
+        guardar_mediciones([
+            Medicion(dispositivo=self.dispositivo, consumo=i, fecha=ahora - timedelta(minutes=i))
+            for i in range(5)
+        ])
+        Alerta.objects.create(dispositivo=self.dispositivo, mensaje='Alto', gravedad='Alta')
+
+    def organizaciones(self):
+        return {
+            modelo.__name__: set(modelo.objects.values_list('organizacion_id', flat=True))
+            for modelo in (Medicion, Alerta)
+        }
+
+    def test_rellenar_organizacion_por_tramos(self):
+        migracion = importlib.import_module('dispositivos.migrations.0011_organizacion_mediciones')
+        Medicion.objects.update(organizacion=None)
+        Alerta.objects.update(organizacion=None)
+        with mock.patch.object(migracion, 'TAMANO_CHUNK', 2):
+            migracion.rellenar_organizacion(django_apps, None)
+        self.assertEqual(self.organizaciones(), {'Medicion': {self.origen.id}, 'Alerta': {self.origen.id}})
+
+    def test_contar_y_corregir(self):
+        Dispositivo.objects.filter(pk=self.dispositivo.pk).update(zona=self.zona_destino)
+        self.assertEqual(contar(), {'Medicion': 5, 'Alerta': 1})
+        self.assertEqual(corregir(tamano=2), 6)
+        self.assertEqual(contar(), {'Medicion': 0, 'Alerta': 0})
+        self.assertEqual(self.organizaciones(), {'Medicion': {self.destino.id}, 'Alerta': {self.destino.id}})
+
+    def test_mover_de_organizacion_solo_encola(self):
+        usuario = User.objects.create_user('encargado', password='clave')
+        Perfil.objects.create(user=usuario, rol='encargado_ecoenergy')
+        self.client.login(username='encargado', password='clave')
+        respuesta = self.client.post(reverse('dispositivos:dispositivo_edit', args=[self.dispositivo.id]), {
+            'nombre': 'Medidor', 'categoria': 'General', 'zona': self.zona_destino.id, 'watts': 0,
+        })
+        self.assertEqual(respuesta.status_code, 302)
+        # La petición no reescribe las filas, solo marca el dispositivo
+        self.assertEqual(self.organizaciones(), {'Medicion': {self.origen.id}, 'Alerta': {self.origen.id}})
+        self.assertTrue(Dispositivo.objects.get(pk=self.dispositivo.pk).organizacion_pendiente)
+
+        self.assertEqual(corregir_pendientes(tamano=2), 6)
+        self.assertEqual(self.organizaciones(), {'Medicion': {self.destino.id}, 'Alerta': {self.destino.id}})
+        self.assertFalse(Dispositivo.objects.get(pk=self.dispositivo.pk).organizacion_pendiente)
+        self.assertEqual(corregir_pendientes(), 0)
+
+
+@override_settings(**SIN_EXTRAS)
+class PurgaTests(TestCase):
+
+    def setUp(self):
+        self.dispositivo = crear_dispositivo('Medidor')
+        self.zona = self.dispositivo.zona
+        ahora = timezone.now()
+        guardar_mediciones([
+            Medicion(dispositivo=self.dispositivo, consumo=i, fecha=ahora - timedelta(minutes=i))
+            for i in range(5)
+        ])
+        Alerta.objects.create(dispositivo=self.dispositivo, mensaje='Alto', gravedad='Alta')
+
+    def test_eliminar_solo_marca_y_encola(self):
+        usuario = User.objects.create_user('admin', password='clave')
+        Perfil.objects.create(user=usuario, organizacion=self.zona.organizacion, rol='cliente_admin')
+        self.client.login(username='admin', password='clave')
+        respuesta = self.client.post(reverse('dispositivos:dispositivo_delete', args=[self.dispositivo.id]))
+        self.assertTrue(respuesta.json()['ok'])
+        self.assertFalse(Dispositivo.objects.filter(pk=self.dispositivo.pk).exists())
+        # Las filas siguen ahí hasta que corra purgar_eliminados
+        self.assertEqual(Medicion.objects.count(), 5)
+        purga = Purga.objects.get()
+        self.assertEqual(
+            (purga.tipo, purga.objeto_id, purga.estado), ('dispositivo', self.dispositivo.id, 'pendiente')
+        )
+        self.assertEqual(purga.solicitada_por, usuario)
+
+    def test_purgar_dispositivo_por_lotes(self):
+        purga = purgar(marcar_eliminado(self.dispositivo), tamano=2, pausa_ms=0)
+        self.assertEqual(purga.estado, 'terminada')
+        self.assertFalse(Dispositivo.todos.filter(pk=self.dispositivo.pk).exists())
+        for modelo in (Medicion, Alerta, ResumenHorario, ResumenDiario):
+            self.assertFalse(modelo.objects.exists())
+        self.assertEqual(purga.progreso[Medicion._meta.db_table], 5)
+        self.assertEqual(purga.progreso[Alerta._meta.db_table], 1)
+
+    def test_se_reanuda_tras_un_error(self):
+        purga = marcar_eliminado(self.dispositivo)
+        with mock.patch('dispositivos.retencion.time.sleep', side_effect=[None, RuntimeError('caída')]):
+            purga = purgar(purga, tamano=2, pausa_ms=1)
+        self.assertEqual((purga.estado, purga.error), ('error', 'caída'))
+        # Los lotes confirmados no se deshacen y el avance quedó guardado
+        self.assertEqual(Medicion.objects.count(), 1)
+        self.assertEqual(Purga.objects.get().progreso, {Medicion._meta.db_table: 4})
+        self.assertEqual(pendientes(), [])
+        self.assertEqual(pendientes(reintentar_errores=True), [purga])
+
+        call_command('purgar_eliminados', '--reintentar-errores', '--pausa-ms', '0', stdout=io.StringIO())
+        purga.refresh_from_db()
+        self.assertEqual(purga.estado, 'terminada')
+        self.assertEqual(purga.progreso[Medicion._meta.db_table], 5)
+        self.assertFalse(Medicion.objects.exists())
+
+    def test_zona_con_dispositivos_activos_no_se_purga(self):
+        purga = purgar(marcar_eliminado(self.zona), pausa_ms=0)
+        self.assertEqual(purga.estado, 'error')
+        self.assertTrue(Zona.todos.filter(pk=self.zona.pk).exists())
+        self.assertEqual(Medicion.objects.count(), 5)
+
+    def test_purgar_zona(self):
+        # Un dispositivo que se fue a otra zona deja resúmenes con la anterior
+        otra = Zona.objects.create(nombre='Otra', organizacion=self.zona.organizacion)
+        Dispositivo.objects.filter(pk=self.dispositivo.pk).update(zona=otra)
+        eliminado = Dispositivo.objects.create(nombre='Viejo', zona=self.zona)
+        Medicion.objects.create(dispositivo=eliminado, consumo=1)
+        purga_dispositivo = marcar_eliminado(eliminado)
+        purga_zona = marcar_eliminado(self.zona)
+        self.assertEqual(pendientes(), [purga_dispositivo, purga_zona])
+
+        purga = purgar(purga_zona, pausa_ms=0)
+        self.assertEqual(purga.estado, 'terminada')
+        self.assertFalse(Zona.todos.filter(pk=self.zona.pk).exists())
+        self.assertFalse(Dispositivo.todos.filter(pk=eliminado.pk).exists())
+        self.assertEqual(Medicion.objects.count(), 5)
+        self.assertFalse(ResumenHorario.objects.filter(zona_id=self.zona.pk).exists())
+        self.assertTrue(ResumenHorario.objects.filter(dispositivo=self.dispositivo, zona=None).exists())
+
+
+@override_settings(REPLICAS_LECTURA=['replica1', 'replica2'], REPLICAS_RETRASO_MAX=5)
+class RouterReplicasTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = RouterReplicas()
+
+    def en_peticion(self, estado):
+        token = replicas._estado.set(estado)
+        self.addCleanup(replicas._estado.reset, token)
+        return estado
+
+    def test_fuera_de_una_peticion_usa_la_primaria(self):
+        self.assertEqual(self.router.db_for_read(Medicion), 'default')
+
+    def test_solo_lectura_usa_una_sola_replica(self):
+        estado = self.en_peticion(replicas._EstadoPeticion())
+        self.assertEqual(self.router.db_for_read(Medicion), 'default')
+        estado.lectura = True
+        alias = self.router.db_for_read(Medicion)
+        self.assertIn(alias, ['replica1', 'replica2'])
+        self.assertEqual({self.router.db_for_read(Dispositivo) for _ in range(20)}, {alias})
+
+    def test_sesiones_y_peticiones_pegadas_usan_la_primaria(self):
+        from django.contrib.sessions.models import Session
+        estado = self.en_peticion(replicas._EstadoPeticion())
+        estado.lectura = True
+        self.assertEqual(self.router.db_for_read(Session), 'default')
+        estado.primaria = True
+        self.assertEqual(self.router.db_for_read(Medicion), 'default')
+
+    def test_escribir_pasa_el_resto_de_la_peticion_a_la_primaria(self):
+        estado = self.en_peticion(replicas._EstadoPeticion())
+        estado.lectura = True
+        self.assertEqual(self.router.db_for_write(Medicion), 'default')
+        self.assertTrue(estado.escribio)
+        self.assertEqual(self.router.db_for_read(Medicion), 'default')
+
+    def test_middleware_pega_al_usuario_tras_escribir(self):
+        factory = RequestFactory()
+
+        def vista(escribe):
+            def responder(request):
+                if escribe:
+                    replicas.marcar_escritura()
+                return HttpResponse()
+            return responder
+
+        self.assertNotIn(COOKIE_PRIMARIA, ReplicasMiddleware(vista(False))(factory.get('/')).cookies)
+        respuesta = ReplicasMiddleware(vista(True))(factory.post('/'))
+        self.assertGreater(float(respuesta.cookies[COOKIE_PRIMARIA].value), time.time())
+
+        # Con la cookie vigente la petición siguiente no lee de réplicas
+        pegadas = []
+        solicitud = factory.get('/')
+        solicitud.COOKIES[COOKIE_PRIMARIA] = respuesta.cookies[COOKIE_PRIMARIA].value
+        def vista_pegada(request):
+            pegadas.append(replicas._estado.get().primaria)
+            return HttpResponse()
+
+        ReplicasMiddleware(vista_pegada)(solicitud)
+        self.assertEqual(pegadas, [True])
+
+
+@override_settings(**SIN_EXTRAS)
+class CrearMedicionReplicasTests(TestCase):
+
+    def setUp(self):
+        self.dispositivo = crear_dispositivo('Medidor')
+        usuario = User.objects.create_user('admin', password='clave')
+        organizacion = self.dispositivo.zona.organizacion
+        Perfil.objects.create(user=usuario, organizacion=organizacion, rol='cliente_admin')
+        self.client.login(username='admin', password='clave')
+
+    def test_medicion_por_el_buffer_pega_a_la_primaria(self):
+        # El buffer inserta desde su propio hilo, donde el router no ve la petición
+        guardadas = []
+
+        def guardar(mediciones):
+            guardadas.extend(mediciones)
+            return mediciones
+
+        for nombre, reemplazo in (('guardar_mediciones', guardar), ('close_old_connections', mock.DEFAULT)):
+            parche = mock.patch(f'dispositivos.buffer.{nombre}', reemplazo)
+            parche.start()
+            self.addCleanup(parche.stop)
+        buffer = BufferMediciones(max_filas=1)
+        self.addCleanup(buffer.cerrar)
+        with mock.patch('dispositivos.views.obtener_buffer', return_value=buffer):
+            respuesta = self.client.post(reverse('dispositivos:medicion_create'), {
+                'dispositivo': self.dispositivo.id, 'consumo': '12.5',
+            })
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual([medicion.consumo for medicion in guardadas], [12.5])
+        self.assertIn(COOKIE_PRIMARIA, respuesta.cookies)
+
+
+@override_settings(
+    CACHES=CACHE_LOCAL, ALERTAS_ACTIVAS=True, ANOMALIAS_ACTIVAS=False,
+    ALERTAS_HISTERESIS=0.1, ALERTAS_VENTANA_SUPRESION=15,
+)
+class AlertasLoteTests(TestCase):
+    """Umbrales por defecto: grave 100 (inclusivo), alta 80, media 60 kWh."""
+
+    def setUp(self):
+        self.organizacion = Organizacion.objects.create(nombre='Org')
+        self.dispositivo = crear_dispositivo('Medidor', organizacion=self.organizacion)
+        self.otro = crear_dispositivo('Otro', organizacion=self.organizacion)
+        self.base = timezone.now().replace(microsecond=0) - timedelta(hours=3)
+
+    def medicion(self, dispositivo, minutos, consumo):
+        fecha = self.base + timedelta(minutes=minutos)
+        return Medicion(dispositivo=dispositivo, consumo=consumo, fecha=fecha)
+
+    def test_un_lote_se_evalua_una_vez(self):
+        lote = [
+            self.medicion(self.dispositivo, 0, 100),
+            self.medicion(self.otro, 0, 85),
+            self.medicion(self.otro, 1, 10),
+            self.medicion(self.dispositivo, 1, 30),
+        ]
+        with mock.patch('dispositivos.ingesta.generar_alertas', wraps=alertas.generar_alertas) as generar:
+            guardar_mediciones(lote)
+        generar.assert_called_once()
+        alertas_guardadas = Alerta.objects.values_list('dispositivo_id', 'gravedad', 'organizacion_id')
+        self.assertEqual(sorted(alertas_guardadas), [
+            (self.dispositivo.id, 'Grave', self.organizacion.id),
+            (self.otro.id, 'Alta', self.organizacion.id),
+        ])
+        self.dispositivo.refresh_from_db()
+        self.assertEqual(self.dispositivo.last_alerta.gravedad, 'Grave')
+
+    def test_lectura_atrasada_lleva_su_propia_hora(self):
+        guardar_mediciones([self.medicion(self.dispositivo, -90, 70)])
+        alerta = Alerta.objects.get()
+        self.assertEqual((alerta.fecha, alerta.ultima_vez), (self.base - timedelta(minutes=90),) * 2)
+        self.assertIn('umbral 60 kWh', alerta.mensaje)
+
+    def test_bajo_los_umbrales_no_alerta(self):
+        guardar_mediciones([self.medicion(self.dispositivo, i, 59.9) for i in range(5)])
+        self.assertFalse(Alerta.objects.exists())
+
+    @override_settings(ALERTAS_ACTIVAS=False)
+    def test_desactivadas(self):
+        guardar_mediciones([self.medicion(self.dispositivo, 0, 500)])
+        self.assertFalse(Alerta.objects.exists())
+
+    def test_el_panel_muestra_las_alertas_guardadas(self):
+        ajeno = crear_dispositivo('Ajeno')
+        self.base = timezone.now().replace(microsecond=0) - timedelta(minutes=30)
+        guardar_mediciones([
+            self.medicion(self.dispositivo, 0, 120),
+            self.medicion(self.otro, 0, 90),
+            self.medicion(ajeno, 0, 120),
+        ])
+        usuario = User.objects.create_user('admin', password='clave')
+        Perfil.objects.create(user=usuario, organizacion=self.organizacion, rol='cliente_admin')
+        self.client.login(username='admin', password='clave')
+        with mock.patch('dispositivos.alertas.evaluar') as evaluar:
+            respuesta = self.client.get(reverse('dispositivos:dashboard'))
+        # El panel lee las alertas, no las recalcula
+        evaluar.assert_not_called()
+        contexto = respuesta.context
+        self.assertEqual([a.dispositivo_id for a in contexto['alertas_grave']], [self.dispositivo.id])
+        self.assertEqual([a.dispositivo_id for a in contexto['alertas_alta']], [self.otro.id])
+        self.assertEqual(contexto['alertas_criticas'], 2)
+
+
+@override_settings(CACHES=CACHE_LOCAL, ALERTAS_ACTIVAS=True, ANOMALIAS_ACTIVAS=False, ALERTAS_HISTERESIS=0.1)
+class PerfilUmbralesTests(TestCase):
+
+    def setUp(self):
+        def crear(nombre, zona, **campos):
+            return Dispositivo.objects.create(nombre=nombre, zona=zona, categoria='Sensor', **campos)
+
+        # La tabla compilada es global del worker: que no pase entre tests
+        umbrales.invalidar()
+        self.addCleanup(umbrales.invalidar)
+        self.organizacion = Organizacion.objects.create(nombre='Org')
+        self.zona = Zona.objects.create(nombre='Zona', organizacion=self.organizacion)
+        self.propio = crear('Propio', self.zona, watts=2000)
+        self.de_zona = crear('De zona', self.zona)
+        otra_zona = Zona.objects.create(nombre='Otra', organizacion=self.organizacion)
+        self.de_categoria = crear('Sensor', otra_zona)
+        ajena = Zona.objects.create(nombre='Ajena', organizacion=Organizacion.objects.create(nombre='Ajena'))
+        self.ajeno = crear('Ajeno', ajena)
+        self.sin_perfil = Dispositivo.objects.create(nombre='Sin perfil', zona=otra_zona, categoria='General')
+
+    def crear_perfiles(self):
+        PerfilUmbrales.objects.create(
+            nombre='Propio', dispositivo=self.propio, modo='relativo', umbral_alta=3, umbral_grave=5,
+        )
+        PerfilUmbrales.objects.create(
+            nombre='Zona', zona=self.zona, umbral_media=1, umbral_alta=2, umbral_grave=3,
+        )
+        PerfilUmbrales.objects.create(
+            nombre='Sensores de la org', categoria='Sensor', organizacion=self.organizacion, umbral_media=4,
+        )
+        PerfilUmbrales.objects.create(nombre='Sensores', categoria='Sensor', umbral_media=7)
+
+    def test_compilar_resuelve_el_mas_especifico(self):
+        self.crear_perfiles()
+        self.assertEqual(umbrales.compilar(), {
+            # Relativo: múltiplos del consumo nominal de una hora (2 kWh)
+            self.propio.id: (10, 6, None),
+            self.de_zona.id: (3, 2, 1),
+            self.de_categoria.id: (None, None, 4),
+            self.ajeno.id: (None, None, 7),
+        })
+
+    def test_sin_perfiles_la_tabla_queda_vacia(self):
+        self.assertEqual(umbrales.compilar(), {})
+
+    def test_validacion(self):
+        invalidos = [
+            PerfilUmbrales(nombre='Sin alcance', umbral_media=1),
+            PerfilUmbrales(nombre='Dos alcances', zona=self.zona, categoria='General', umbral_media=1),
+            PerfilUmbrales(nombre='Sin umbral', zona=self.zona),
+            PerfilUmbrales(nombre='Desordenados', zona=self.zona, umbral_media=5, umbral_alta=2),
+            PerfilUmbrales(
+                nombre='Org sin categoría', zona=self.zona, organizacion=self.organizacion, umbral_media=1,
+            ),
+        ]
+        for perfil in invalidos:
+            with self.subTest(perfil.nombre), self.assertRaises(ValidationError):
+                perfil.full_clean()
+        PerfilUmbrales.objects.create(nombre='Sensores', categoria='Sensor', umbral_media=7)
+        with self.assertRaises(ValidationError):
+            PerfilUmbrales(nombre='Repetido', categoria='Sensor', umbral_media=8).full_clean()
+
+    def test_las_alertas_usan_el_perfil_y_se_recompila_al_cambiar(self):
+        self.assertEqual(umbrales.tabla(), {})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.crear_perfiles()
+        ahora = timezone.now()
+        guardar_mediciones([
+            Medicion(dispositivo=self.de_zona, consumo=2.5, fecha=ahora),
+            Medicion(dispositivo=self.sin_perfil, consumo=2.5, fecha=ahora),
+        ])
+        alerta = Alerta.objects.get()
+        self.assertEqual((alerta.dispositivo_id, alerta.gravedad), (self.de_zona.id, 'Alta'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PerfilUmbrales.objects.filter(zona=self.zona).get().delete()
+        # Vuelve al perfil de la categoría en su organización
+        self.assertEqual(umbrales.tabla()[self.de_zona.id], (None, None, 4))
+
+
+@skipIf(alertas.np is None, 'requiere NumPy')
+@override_settings(ALERTAS_HISTERESIS=0.1)
+class EvaluarVectorizadoTests(SimpleTestCase):
+    """La evaluación vectorizada debe dar exactamente lo mismo que la escalar."""
+
+    def setUp(self):
+        azar = random.Random(7)
+        self.umbrales = {
+            1: (10, 5, 2),
+            2: (None, 50, 40),
+            3: (None, None, None),
+            5: (30.5, None, 12),
+        }
+        # Ids con y sin perfil; los consumos incluyen los umbrales exactos
+        bordes = [10, 5, 2, 50, 40, 30.5, 12, 100, 80, 60, 54, 1.8]
+        self.mediciones = [
+            Medicion(
+                dispositivo_id=azar.choice([1, 2, 3, 4, 5, 999]),
+                consumo=azar.choice(bordes) if azar.random() < 0.3 else round(azar.uniform(0, 120), 2),
+            )
+            for _ in range(MIN_VECTORIZADO * 8)
+        ]
+
+    def _comparar(self, abiertos):
+        vectorizada = evaluar(self.mediciones, self.umbrales, abiertos)
+        with mock.patch.object(alertas, 'np', None):
+            escalar = evaluar(self.mediciones, self.umbrales, abiertos)
+        self.assertEqual(
+            [(id(m), nivel, umbral) for m, nivel, umbral in vectorizada],
+            [(id(m), nivel, umbral) for m, nivel, umbral in escalar],
+        )
+        return escalar
+
+    def test_misma_salida_sin_abiertos(self):
+        eventos = self._comparar(None)
+        self.assertTrue(any(nivel == LIBERA for _, nivel, _ in eventos))
+        self.assertTrue(any(nivel == NIVELES['Grave'] for _, nivel, _ in eventos))
+
+    def test_misma_salida_con_abiertos(self):
+        self._comparar([2])
+        self._comparar([])
+
+    def test_ids_grandes_usan_busqueda_binaria(self):
+        self.umbrales[alertas.MAX_ID_INDICE_DENSO + 1] = (1, 1, 1)
+        self._comparar(None)
+
+    def test_reutiliza_la_tabla_mientras_no_cambie(self):
+        tabla = alertas.tabla_vectorizada(self.umbrales, 0.1)
+        self.assertIs(alertas.tabla_vectorizada(self.umbrales, 0.1), tabla)
+        self.assertIsNot(alertas.tabla_vectorizada(self.umbrales, 0.2), tabla)
+        self.assertIsNot(alertas.tabla_vectorizada(dict(self.umbrales), 0.2), tabla)
+
+
+@override_settings(
+    CACHES=CACHE_LOCAL, ALERTAS_ACTIVAS=True, ANOMALIAS_ACTIVAS=False,
+    ALERTAS_HISTERESIS=0.1, ALERTAS_VENTANA_SUPRESION=15,
+)
+class EpisodiosAlertaTests(TestCase):
+    """Umbrales por defecto (grave 100, alta 80, media 60): libera bajo 54 kWh."""
+
+    def setUp(self):
+        self.dispositivo = crear_dispositivo('Medidor', watts=100)
+        self.base = timezone.now().replace(microsecond=0) - timedelta(hours=3)
+
+    def leer(self, minutos, consumo):
+        fecha = self.base + timedelta(minutes=minutos)
+        guardar_mediciones([Medicion(dispositivo=self.dispositivo, consumo=consumo, fecha=fecha)])
+
+    def test_abre_suma_y_escala(self):
+        self.leer(0, 65)
+        alerta = Alerta.objects.get()
+        self.assertEqual((alerta.gravedad, alerta.ocurrencias, alerta.fecha), ('Media', 1, self.base))
+        self.assertTrue(alerta.abierta)
+
+        self.leer(1, 85)
+        self.leer(2, 70)
+        alerta = Alerta.objects.get()
+        # Escala a Alta y no vuelve a bajar mientras siga abierta
+        self.assertEqual((alerta.gravedad, alerta.ocurrencias), ('Alta', 3))
+        self.assertEqual(alerta.ultima_vez, self.base + timedelta(minutes=2))
+        self.dispositivo.refresh_from_db()
+        self.assertEqual(self.dispositivo.last_alerta_id, alerta.id)
+
+    def test_cierra_solo_bajo_la_banda_de_histeresis(self):
+        self.leer(0, 65)
+        self.leer(1, 58)
+        self.assertTrue(Alerta.objects.get().abierta)
+        self.leer(2, 50)
+        alerta = Alerta.objects.get()
+        self.assertEqual(alerta.cerrada_en, self.base + timedelta(minutes=2))
+        self.assertEqual(alerta.ocurrencias, 1)
+
+    def test_lectura_atrasada_no_cierra(self):
+        self.leer(10, 65)
+        self.leer(5, 50)
+        self.assertTrue(Alerta.objects.get().abierta)
+
+    def test_reabre_dentro_de_la_ventana(self):
+        self.leer(0, 65)
+        self.leer(1, 50)
+        self.leer(10, 90)
+        alerta = Alerta.objects.get()
+        self.assertTrue(alerta.abierta)
+        self.assertEqual((alerta.gravedad, alerta.ocurrencias), ('Alta', 2))
+
+    def test_nuevo_episodio_despues_de_la_ventana(self):
+        self.leer(0, 65)
+        self.leer(1, 50)
+        self.leer(30, 120)
+        primera, segunda = Alerta.objects.order_by('fecha')
+        self.assertFalse(primera.abierta)
+        self.assertEqual((segunda.gravedad, segunda.fecha), ('Grave', self.base + timedelta(minutes=30)))
+        self.assertTrue(segunda.abierta)
+        self.dispositivo.refresh_from_db()
+        self.assertEqual(self.dispositivo.last_alerta_id, segunda.id)
+
+    def test_un_lote_abre_y_cierra(self):
+        guardar_mediciones([
+            Medicion(dispositivo=self.dispositivo, consumo=consumo, fecha=self.base + timedelta(minutes=i))
+            for i, consumo in enumerate([70, 110, 40])
+        ])
+        alerta = Alerta.objects.get()
+        self.assertEqual((alerta.gravedad, alerta.ocurrencias), ('Grave', 2))
+        self.assertEqual(alerta.cerrada_en, self.base + timedelta(minutes=2))
+
+    def test_el_panel_muestra_episodios_abiertos_y_recientes(self):
+        self.base = timezone.now().replace(microsecond=0) - timedelta(days=3)
+        self.leer(0, 120)
+        abierto = Alerta.objects.get()
+        cerrado_viejo = crear_dispositivo('Viejo')
+        guardar_mediciones([
+            Medicion(dispositivo=cerrado_viejo, consumo=consumo, fecha=self.base + timedelta(minutes=i))
+            for i, consumo in enumerate([90, 10])
+        ])
+        reciente = crear_dispositivo('Reciente')
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        guardar_mediciones([
+            Medicion(dispositivo=reciente, consumo=consumo, fecha=hace_una_hora + timedelta(minutes=i))
+            for i, consumo in enumerate([90, 10])
+        ])
+        usuario = User.objects.create_user('encargado', password='clave')
+        Perfil.objects.create(user=usuario, rol='encargado_ecoenergy')
+        self.client.login(username='encargado', password='clave')
+        contexto = self.client.get(reverse('dispositivos:dashboard')).context
+        # El abierto empezó hace días; el cerrado viejo ya no se muestra
+        self.assertEqual([a.id for a in contexto['alertas_grave']], [abierto.id])
+        self.assertEqual([a.dispositivo_id for a in contexto['alertas_alta']], [reciente.id])
+        self.assertEqual(contexto['alertas_criticas'], 2)
+
+
+class CombinarEstadosTests(SimpleTestCase):
+
+    def test_sin_lecturas_ajenas_queda_el_local(self):
+        self.assertEqual(combinar((5, 1, 10), (5, 1, 10), (7, 2, 15)), (7, 2, 15))
+
+    def test_sin_lecturas_propias_queda_el_guardado(self):
+        self.assertEqual(combinar((9, 3, 30), (5, 1, 10), (5, 1, 10)), (9, 3, 30))
+
+    def test_pondera_por_las_lecturas_nuevas_de_cada_uno(self):
+        media, varianza, lecturas = combinar((10, 1, 40), (0, 0, 10), (20, 1, 20))
+        # 30 lecturas ajenas y 10 propias desde la base
+        self.assertAlmostEqual(media, 12.5)
+        self.assertAlmostEqual(varianza, 0.75 * (1 + 2.5 ** 2) + 0.25 * (1 + 7.5 ** 2))
+        self.assertEqual(lecturas, 50)
+
+
+@override_settings(
+    CACHES=CACHE_LOCAL, ALERTAS_ACTIVAS=False, ANOMALIAS_ACTIVAS=True, ANOMALIAS_ALFA=0.1,
+    ANOMALIAS_UMBRAL_Z=4, ANOMALIAS_MIN_LECTURAS=10, ALERTAS_HISTERESIS=0.1,
+    ALERTAS_VENTANA_SUPRESION=15, ANOMALIAS_INTERVALO_PUNTO_CONTROL=3600,
+)
+class DetectorAnomaliasTests(TestCase):
+
+    def setUp(self):
+        self.dispositivo = crear_dispositivo('Medidor')
+        self.workers = [AlmacenEstados(), AlmacenEstados()]
+        self.en_worker(0)
+
+    def en_worker(self, numero):
+        """Cambia el almacén del módulo, como si la lectura llegara a otro worker."""
+        parche = mock.patch.object(anomalias, 'almacen', self.workers[numero])
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def puntuar(self, *consumos):
+        return puntuar([Medicion(dispositivo_id=self.dispositivo.id, consumo=c) for c in consumos], set())
+
+    def guardado(self):
+        estado = EstadoAnomalia.objects.get(dispositivo=self.dispositivo)
+        return estado.media, estado.varianza, estado.lecturas
+
+    def test_un_pico_abre_una_anomalia(self):
+        base = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        guardar_mediciones([
+            Medicion(dispositivo=self.dispositivo, consumo=consumo, fecha=base + timedelta(minutes=i))
+            for i, consumo in enumerate([10, 10.5, 11] * 7)
+        ])
+        self.assertFalse(Alerta.objects.exists())
+        pico = Medicion(dispositivo=self.dispositivo, consumo=40, fecha=base + timedelta(minutes=30))
+        guardar_mediciones([pico])
+        alerta = Alerta.objects.get()
+        self.assertEqual((alerta.tipo, alerta.gravedad), ('Anomalia', 'Alta'))
+        self.assertIn('Consumo anómalo', alerta.mensaje)
+
+    @override_settings(ANOMALIAS_INTERVALO_PUNTO_CONTROL=0)
+    def test_el_punto_de_control_se_guarda_tras_el_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            guardar_mediciones([Medicion(dispositivo=self.dispositivo, consumo=5, fecha=timezone.now())])
+        self.assertEqual(self.guardado(), (5, 0, 1))
+        # Un worker nuevo retoma desde el punto de control
+        self.en_worker(1)
+        self.puntuar(5)
+        self.assertEqual(self.workers[1].estado(self.dispositivo.id)[2], 2)
+
+    def test_dos_workers_combinan_sus_lecturas(self):
+        self.puntuar(*[10] * 40)
+        guardar_punto_control()
+        self.en_worker(1)
+        self.puntuar(*[20] * 10)
+        self.en_worker(0)
+        self.puntuar(*[10] * 10)
+        self.assertEqual(guardar_punto_control(), 1)
+        self.assertEqual(self.guardado(), (10, 0, 50))
+
+        # El segundo en guardar no pisa al primero: suma sus 10 lecturas
+        self.en_worker(1)
+        self.assertEqual(guardar_punto_control(), 1)
+        media, varianza, lecturas = self.guardado()
+        self.assertEqual(lecturas, 60)
+        # 10 lecturas nuevas cada uno: el promedio de las dos medias
+        media_segundo = 20 - 10 * 0.9 ** 10
+        self.assertAlmostEqual(media, (10 + media_segundo) / 2)
+        self.assertGreater(varianza, 0)
+        # Y sigue desde el estado combinado
+        self.assertEqual(self.workers[1].estado(self.dispositivo.id), (media, varianza, 60))
+
+        # El primero vuelve a guardar y combina con lo del segundo
+        self.en_worker(0)
+        self.puntuar(10)
+        guardar_punto_control()
+        self.assertEqual(self.guardado()[2], 61)
+
+    def test_lecturas_durante_el_guardado_quedan_para_el_siguiente(self):
+        self.puntuar(*[10] * 5)
+        almacen = self.workers[0]
+        pendientes = almacen.pendientes()
+        self.puntuar(10, 10)
+        almacen.aplicar({self.dispositivo.id: (10, 0, 5)}, pendientes)
+        self.assertEqual(almacen.estado(self.dispositivo.id)[2], 7)
+        self.assertEqual(almacen.base_lecturas[0], 5)
+        self.assertEqual(almacen.sucias, {self.dispositivo.id})
+
+    def test_si_falla_el_guardado_se_reintenta(self):
+        self.puntuar(10)
+        with mock.patch('dispositivos.anomalias._bloquear_estados', side_effect=RuntimeError('caída')):
+            self.assertEqual(guardar_punto_control(), 0)
+        self.assertEqual(self.workers[0].sucias, {self.dispositivo.id})
+        self.assertEqual(guardar_punto_control(), 1)
+        self.assertEqual(self.guardado(), (10, 0, 1))
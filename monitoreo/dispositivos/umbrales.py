@@ -0,0 +1,89 @@
+"""
+Tabla en memoria de umbrales de alerta por dispositivo. Los PerfilUmbrales
+se resuelven (dispositivo > zona > categoría) y se pasan a kWh una sola vez;
+el motor de alertas solo hace un dict.get por medición, sin consultas.
+
+La tabla se reconstruye cuando cambia un perfil, un dispositivo o una zona.
+Las señales solo llegan al worker que hizo el cambio, así que además se
+cambia una versión en la caché compartida que los demás comparan en cada
+lote.
+"""
+import logging
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Dispositivo, PerfilUmbrales, Zona
+
+logger = logging.getLogger(__name__)
+
+CLAVE_VERSION = 'alertas:umbrales:version'
+
+_tabla = None
+_version = None
+_lock = threading.Lock()
+
+
+def compilar():
+    """{dispositivo_id: (grave, alta, media)} en kWh, solo de los dispositivos con perfil."""
+    por_dispositivo = {}
+    por_zona = {}
+    por_categoria = {}
+    for perfil in PerfilUmbrales.objects.all():
+        if perfil.dispositivo_id is not None:
+            por_dispositivo[perfil.dispositivo_id] = perfil
+        elif perfil.zona_id is not None:
+            por_zona[perfil.zona_id] = perfil
+        else:
+            por_categoria[(perfil.categoria, perfil.organizacion_id)] = perfil
+    if not (por_dispositivo or por_zona or por_categoria):
+        return {}
+
+    umbrales = {}
+    for dispositivo_id, zona_id, categoria, watts, organizacion_id in Dispositivo.objects.values_list(
+        'id', 'zona_id', 'categoria', 'watts', 'zona__organizacion_id'
+    ):
+        perfil = (
+            por_dispositivo.get(dispositivo_id)
+            or por_zona.get(zona_id)
+            or por_categoria.get((categoria, organizacion_id))
+            or por_categoria.get((categoria, None))
+        )
+        if perfil is not None:
+            umbrales[dispositivo_id] = perfil.umbrales_kwh(watts)
+    return umbrales
+
+
+def tabla():
+    """Tabla vigente del worker; la reconstruye si otro worker la invalidó."""
+    global _tabla, _version
+    version = cache.get(CLAVE_VERSION)
+    with _lock:
+        if _tabla is None or version != _version:
+            _tabla = compilar()
+            _version = version
+            logger.info(f'Tabla de umbrales compilada: {len(_tabla)} dispositivos con perfil')
+        return _tabla
+
+
+def invalidar():
+    """Fuerza la reconstrucción en este worker y en los demás."""
+    global _tabla
+    with _lock:
+        _tabla = None
+    try:
+        cache.set(CLAVE_VERSION, uuid.uuid4().hex, None)
+    except Exception as e:
+        logger.warning(f'No se pudo publicar la nueva versión de umbrales: {str(e)}')
+
+
+@receiver([post_save, post_delete], sender=PerfilUmbrales)
+@receiver([post_save, post_delete], sender=Dispositivo)
+@receiver([post_save, post_delete], sender=Zona)
+def _cambio_umbrales(sender, **kwargs):
+    # Tras el commit, para que la reconstrucción vea el cambio
+    transaction.on_commit(invalidar)
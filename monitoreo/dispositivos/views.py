@@ -1,5 +1,6 @@
 import logging
 import os
+from datetime import date, timedelta
 from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.models import User
@@ -11,6 +12,7 @@ from django.db.models import Count, Q
 from django.core.paginator import Paginator 
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied, ValidationError
 from django.contrib import messages
+from django.utils import timezone
 from django.utils.html import escape
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill
@@ -18,6 +20,13 @@ from usuarios.decorators import cliente_admin_required, cliente_electronico_requ
 
 logger = logging.getLogger(__name__)
 
+from .archivo import leer_mes, meses_archivados
+from .buffer import obtener_buffer
+from .consistencia import marcar_pendiente
+from .purga import dispositivos_eliminados, marcar_eliminado
+from .replicas import solo_lectura
+from .ingesta import guardar_mediciones, recalcular_ultima_lectura
+from .resumenes import consumo_por_zona, limites_dia, recalcular_medicion
 from .forms import DispositivoForm, ZonaForm, MedicionForm
 from .models import Zona, Dispositivo, Medicion, Alerta
 from usuarios.models import Organizacion
@@ -53,43 +62,101 @@ def validate_safe_path(path_param):
             return False
     return True
 
+VENTANA_ALERTAS_PANEL = timedelta(hours=24)
+
+def ultimas_mediciones(mediciones_qs, dispositivos_qs, cantidad=10):
+    """
+    Las `cantidad` mediciones más recientes sin recorrer todo el historial.
+    Los `cantidad` dispositivos con lectura más reciente tienen su última
+    lectura desde `corte`, así que las más recientes están todas desde
+    `corte`: el filtro no cambia el resultado y deja que el ORDER BY lea solo
+    las particiones (o el tramo del índice) recientes. Si last_fecha quedó
+    desactualizado y no alcanzan, se repite sin filtro.
+    """
+    fechas = list(
+        dispositivos_qs.exclude(last_fecha=None).order_by('-last_fecha')
+        .values_list('last_fecha', flat=True)[:cantidad]
+    )
+    if fechas:
+        ultimas = list(mediciones_qs.filter(fecha__gte=fechas[-1]).order_by('-fecha')[:cantidad])
+        if len(ultimas) == cantidad:
+            return ultimas
+    return list(mediciones_qs.order_by('-fecha')[:cantidad])
+
+def excluir_eliminados(qs):
+    """Oculta mediciones o alertas de dispositivos eliminados que aún se están purgando."""
+    eliminados = dispositivos_eliminados()
+    return qs.exclude(dispositivo_id__in=eliminados) if eliminados else qs
+
+def filtrar_rango_fechas(qs, fecha_inicio, fecha_fin):
+    """
+    Filtra `fecha` por días locales (TIME_ZONE, America/Santiago) con un rango
+    semiabierto [inicio del primer día, inicio del día siguiente al último).
+    A diferencia de fecha__date, no envuelve la columna en una conversión de
+    zona horaria, así que puede usar los índices (dispositivo, fecha) y (fecha).
+    Devuelve el queryset y los parámetros, vacíos si no eran fechas válidas.
+    """
+    if fecha_inicio:
+        try:
+            qs = qs.filter(fecha__gte=limites_dia(date.fromisoformat(fecha_inicio))[0])
+        except ValueError:
+            fecha_inicio = ''
+
+    if fecha_fin:
+        try:
+            qs = qs.filter(fecha__lt=limites_dia(date.fromisoformat(fecha_fin))[1])
+        except ValueError:
+            fecha_fin = ''
+
+    return qs, fecha_inicio, fecha_fin
+
 @login_required
+@solo_lectura
 def dashboard(request):
     organizacion_usuario = get_organizacion_del_usuario(request.user)
     user_role = get_user_role(request.user)
     
-    mediciones_qs = Medicion.objects.select_related('dispositivo')
+    mediciones_qs = excluir_eliminados(Medicion.objects.select_related('dispositivo'))
     zonas_qs = Zona.objects.all()
+    dispositivos_qs = Dispositivo.objects.all()
 
     if organizacion_usuario and user_role != 'encargado_ecoenergy':
-        mediciones_qs = mediciones_qs.filter(dispositivo__zona__organizacion=organizacion_usuario)
+        mediciones_qs = mediciones_qs.filter(organizacion=organizacion_usuario)
         zonas_qs = zonas_qs.filter(organizacion=organizacion_usuario)
+        dispositivos_qs = dispositivos_qs.filter(zona__organizacion=organizacion_usuario)
 
-    mediciones = mediciones_qs.order_by('-fecha')[:10]
+    mediciones = ultimas_mediciones(mediciones_qs, dispositivos_qs)
     zonas = zonas_qs.annotate(num_dispositivos=Count('dispositivo'))
+    # Consumo del día leído de los resúmenes diarios, no de Medicion
+    hoy = timezone.localdate()
+    zonas = consumo_por_zona(zonas, *limites_dia(hoy))
     
-    alertas_grave = []
-    alertas_alta = []
-    alertas_media = []
-
-    for medicion in mediciones:
-        consumo = medicion.consumo
-        if consumo >= 100:
-            alertas_grave.append(medicion)
-        elif consumo > 80:
-            alertas_alta.append(medicion)
-        elif consumo > 60:
-            alertas_media.append(medicion)
+    # Episodios guardados por el motor de alertas en cada lote de ingesta:
+    # los abiertos, aunque hayan empezado hace días, y los que tuvieron
+    # lecturas en la ventana
+    alertas_qs = excluir_eliminados(Alerta.objects.select_related('dispositivo')).filter(
+        Q(cerrada_en__isnull=True) | Q(ultima_vez__gte=timezone.now() - VENTANA_ALERTAS_PANEL)
+    ).order_by('-ultima_vez', '-id')
+    if organizacion_usuario and user_role != 'encargado_ecoenergy':
+        alertas_qs = alertas_qs.filter(organizacion=organizacion_usuario)
+    conteo_alertas = alertas_qs.aggregate(
+        criticas=Count('id', filter=Q(gravedad__in=['Grave', 'Alta'])),
+        medias=Count('id', filter=Q(gravedad='Media')),
+    )
+    alertas_grave = alertas_qs.filter(gravedad='Grave')[:10]
+    alertas_alta = alertas_qs.filter(gravedad='Alta')[:10]
 
     return render(request, 'dispositivos/panel.html', {
         'mediciones': mediciones,
         'zonas': zonas,
         'alertas_grave': alertas_grave,
         'alertas_alta': alertas_alta,
-        'alertas_media': alertas_media,
+        'alertas_criticas': conteo_alertas['criticas'],
+        'alertas_medias': conteo_alertas['medias'],
     })
 
 @login_required
+@solo_lectura
 def listar_dispositivos(request):
     try:
         organizacion_usuario = get_organizacion_del_usuario(request.user)
@@ -169,6 +236,7 @@ def listar_dispositivos(request):
         return render(request, 'dispositivos/dispositivo_list.html', {'page_obj': None})
 
 @login_required
+@solo_lectura
 def detalle_dispositivo(request, dispositivo_id):
     try:
         # Validar que el ID sea seguro
@@ -178,7 +246,7 @@ def detalle_dispositivo(request, dispositivo_id):
             
         organizacion_usuario = get_organizacion_del_usuario(request.user)
         user_role = get_user_role(request.user)
-        dispositivo = get_object_or_404(Dispositivo, id=dispositivo_id)
+        dispositivo = get_object_or_404(Dispositivo.objects.select_related('last_alerta'), id=dispositivo_id)
         
         if organizacion_usuario and user_role != 'encargado_ecoenergy' and dispositivo.zona.organizacion != organizacion_usuario:
             logger.warning(f'Usuario {request.user.id} intentó acceder a dispositivo {dispositivo_id} sin permisos')
@@ -190,12 +258,27 @@ def detalle_dispositivo(request, dispositivo_id):
         alertas_alta = Alerta.objects.filter(dispositivo=dispositivo, gravedad='Alta').order_by('-fecha')
         alertas_media = Alerta.objects.filter(dispositivo=dispositivo, gravedad='Media').order_by('-fecha')
 
+        # Historial en el archivo frío: se lee de disco, sin tocar la base
+        meses_archivo = meses_archivados(dispositivo.id)
+        mes_archivo = request.GET.get('archivo', '')
+        dias_archivo = None
+        try:
+            archivo = leer_mes(dispositivo.id, date.fromisoformat(f'{mes_archivo}-01')) if mes_archivo else None
+        except ValueError:
+            archivo = None
+        if archivo is not None:
+            with archivo:
+                dias_archivo = archivo.por_dia()
+
         return render(request, 'dispositivos/dispositivo_detalle.html', {
             'dispositivo': dispositivo,
             'mediciones': mediciones,
             'alertas_grave': alertas_grave,
             'alertas_alta': alertas_alta,
             'alertas_media': alertas_media,
+            'meses_archivo': meses_archivo,
+            'mes_archivo': mes_archivo if dias_archivo is not None else '',
+            'dias_archivo': dias_archivo,
         })
     except Exception as e:
         logger.error(f'Error en detalle_dispositivo: {str(e)}')
@@ -232,13 +315,23 @@ def editar_dispositivo(request, dispositivo_id):
         raise Http404("Dispositivo no encontrado.")
 
     if request.method == "POST":
+        organizacion_anterior = dispositivo.zona.organizacion_id if dispositivo.zona else None
         form = DispositivoForm(request.POST, instance=dispositivo, user=request.user)
         if form.is_valid():
             zona_seleccionada = form.cleaned_data['zona']
             if organizacion_usuario and user_role != 'encargado_ecoenergy' and zona_seleccionada.organizacion != organizacion_usuario:
                 form.add_error('zona', 'Esta zona no pertenece a tu organización.')
             else:
-                dispositivo = form.save()
+                # Solo los campos del formulario: last_* los mantiene la ingesta
+                # y un save() completo podría pisar una lectura concurrente
+                dispositivo = form.save(commit=False)
+                dispositivo.save(update_fields=list(form.fields))
+                organizacion_nueva = dispositivo.zona.organizacion_id if dispositivo.zona else None
+                if organizacion_nueva != organizacion_anterior:
+                    # Las mediciones y alertas llevan la organización copiada;
+                    # reescribirlas puede tardar, así que se corrigen en segundo plano
+                    marcar_pendiente(dispositivo.id)
+                    logger.info(f'Dispositivo {dispositivo.id} cambió de organización, filas pendientes de corregir')
                 messages.success(request, f'Dispositivo "{dispositivo.nombre}" actualizado exitosamente.')
                 return redirect("dispositivos:dispositivo_detail", dispositivo_id=dispositivo.id)
     else:
@@ -265,8 +358,9 @@ def eliminar_dispositivo(request, dispositivo_id):
             return JsonResponse({"ok": False, "message": "Permiso denegado."}, status=403)
 
         nombre = dispositivo.nombre
-        dispositivo.delete()
-        logger.info(f'Dispositivo {nombre} eliminado por usuario {request.user.id}')
+        # Las mediciones y alertas se borran por lotes en segundo plano
+        purga = marcar_eliminado(dispositivo, request.user)
+        logger.info(f'Dispositivo {nombre} eliminado por usuario {request.user.id} (purga {purga.id})')
         return JsonResponse({"ok": True, "message": f"Dispositivo '{nombre}' eliminado"})
         
     except Exception as e:
@@ -274,6 +368,7 @@ def eliminar_dispositivo(request, dispositivo_id):
         return JsonResponse({"ok": False, "message": "Error interno del servidor."}, status=500)
 
 @login_required
+@solo_lectura
 def listar_zonas(request):
     organizacion_usuario = get_organizacion_del_usuario(request.user)
     user_role = get_user_role(request.user)
@@ -357,12 +452,13 @@ def eliminar_zona(request, zona_id):
     
     try:
         nombre = zona.nombre
-        zona.delete()
+        marcar_eliminado(zona, request.user)
         return JsonResponse({"ok": True, "message": f"Zona '{nombre}' eliminada"})
     except Exception as e:
         return JsonResponse({"ok": False, "message": str(e)}, status=400)
 
 @login_required
+@solo_lectura
 def listar_mediciones(request):
     organizacion_usuario = get_organizacion_del_usuario(request.user)
     user_role = get_user_role(request.user)
@@ -378,9 +474,9 @@ def listar_mediciones(request):
     except ValueError:
         page_size = 10
 
-    mediciones_qs = Medicion.objects.select_related('dispositivo', 'dispositivo__zona')
+    mediciones_qs = excluir_eliminados(Medicion.objects.select_related('dispositivo', 'dispositivo__zona'))
     if organizacion_usuario and user_role != 'encargado_ecoenergy':
-        mediciones_qs = mediciones_qs.filter(dispositivo__zona__organizacion=organizacion_usuario)
+        mediciones_qs = mediciones_qs.filter(organizacion=organizacion_usuario)
 
     dispositivos_para_filtro = Dispositivo.objects.order_by('nombre')
     if organizacion_usuario and user_role != 'encargado_ecoenergy':
@@ -389,17 +485,7 @@ def listar_mediciones(request):
     if dispositivo_id:
         mediciones_qs = mediciones_qs.filter(dispositivo_id=dispositivo_id)
     
-    if fecha_inicio:
-        try:
-            mediciones_qs = mediciones_qs.filter(fecha__date__gte=fecha_inicio)
-        except:
-            fecha_inicio = ''
-    
-    if fecha_fin:
-        try:
-            mediciones_qs = mediciones_qs.filter(fecha__date__lte=fecha_fin)
-        except:
-            fecha_fin = ''
+    mediciones_qs, fecha_inicio, fecha_fin = filtrar_rango_fechas(mediciones_qs, fecha_inicio, fecha_fin)
 
     mediciones_qs = mediciones_qs.order_by('-fecha')
     paginator = Paginator(mediciones_qs, page_size) 
@@ -427,7 +513,13 @@ def crear_medicion(request):
     if request.method == 'POST':
         form = MedicionForm(request.POST, user=request.user)
         if form.is_valid():
-            medicion = form.save()
+            # Mismo camino que la ingesta para mantener los resúmenes
+            medicion = form.save(commit=False)
+            buffer = obtener_buffer()
+            if buffer is not None:
+                buffer.agregar([medicion])
+            else:
+                guardar_mediciones([medicion])
             messages.success(request, f'Medición creada exitosamente para {medicion.dispositivo.nombre}.')
             return redirect('dispositivos:medicion_list')
     else:
@@ -441,9 +533,14 @@ def editar_medicion(request, medicion_id):
     medicion = get_object_or_404(Medicion, id=medicion_id)
     
     if request.method == 'POST':
+        dispositivo_anterior = medicion.dispositivo_id
         form = MedicionForm(request.POST, instance=medicion, user=request.user)
         if form.is_valid():
             form.save()
+            recalcular_medicion(medicion.dispositivo_id, medicion.fecha)
+            if dispositivo_anterior != medicion.dispositivo_id:
+                recalcular_medicion(dispositivo_anterior, medicion.fecha)
+            recalcular_ultima_lectura({medicion.dispositivo_id, dispositivo_anterior})
             messages.success(request, 'Medición actualizada exitosamente.')
             return redirect('dispositivos:medicion_list')
     else:
@@ -460,16 +557,20 @@ def eliminar_medicion(request, medicion_id):
     try:
         dispositivo_nombre = medicion.dispositivo.nombre
         medicion.delete()
+        recalcular_medicion(medicion.dispositivo_id, medicion.fecha)
+        recalcular_ultima_lectura([medicion.dispositivo_id])
         return JsonResponse({"ok": True, "message": f"Medición de {dispositivo_nombre} eliminada"})
     except Exception as e:
         return JsonResponse({"ok": False, "message": str(e)}, status=400)
 
 @login_required
+@solo_lectura
 def detalle_medicion(request, medicion_id):
     medicion = get_object_or_404(Medicion, id=medicion_id)
     return render(request, 'dispositivos/medicion_detalle.html', {'medicion': medicion})
 
 @login_required
+@solo_lectura
 def exportar_dispositivos_excel(request):
     try:
         organizacion_usuario = get_organizacion_del_usuario(request.user)
@@ -552,6 +653,7 @@ def exportar_dispositivos_excel(request):
         return HttpResponse('Error al generar el archivo', status=500)
 
 @login_required
+@solo_lectura
 def listar_alertas(request):
     organizacion_usuario = get_organizacion_del_usuario(request.user)
     user_role = get_user_role(request.user)
@@ -568,9 +670,9 @@ def listar_alertas(request):
     except ValueError:
         page_size = 10
     
-    alertas_qs = Alerta.objects.select_related('dispositivo', 'dispositivo__zona')
+    alertas_qs = excluir_eliminados(Alerta.objects.select_related('dispositivo', 'dispositivo__zona'))
     if organizacion_usuario and user_role != 'encargado_ecoenergy':
-        alertas_qs = alertas_qs.filter(dispositivo__zona__organizacion=organizacion_usuario)
+        alertas_qs = alertas_qs.filter(organizacion=organizacion_usuario)
 
     dispositivos_para_filtro = Dispositivo.objects.order_by('nombre')
     if organizacion_usuario and user_role != 'encargado_ecoenergy':
@@ -583,17 +685,7 @@ def listar_alertas(request):
     if gravedad:
         alertas_qs = alertas_qs.filter(gravedad=gravedad)
     
-    if fecha_inicio:
-        try:
-            alertas_qs = alertas_qs.filter(fecha__date__gte=fecha_inicio)
-        except:
-            fecha_inicio = ''
-    
-    if fecha_fin:
-        try:
-            alertas_qs = alertas_qs.filter(fecha__date__lte=fecha_fin)
-        except:
-            fecha_fin = ''
+    alertas_qs, fecha_inicio, fecha_fin = filtrar_rango_fechas(alertas_qs, fecha_inicio, fecha_fin)
 
     alertas_qs = alertas_qs.order_by('-fecha')
     paginator = Paginator(alertas_qs, page_size) 
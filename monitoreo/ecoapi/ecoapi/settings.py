@@ -1,123 +1,85 @@
 """
 Django settings for ecoapi project.
 
-Generated by 'django-admin startproject' using Django 4.2.26.
+Servicio solo de ingesta y lectura. Comparte modelos y base de datos con el
+proyecto `monitoreo`, pero no carga plantillas, sesiones, mensajes ni crispy
+forms, de modo que sus workers arrancan rápido y escalan aparte del dashboard
+HTML. La autenticación es solo por clave de ingesta.
+
+Se sirve por WSGI con workers de hilos (gunicorn -k gthread), no por ASGI:
+bajo ASGI Django guarda el cuerpo completo antes de llamar a la vista y junta
+toda la respuesta de un generador síncrono antes de enviarla, así que la
+ingesta por streaming no mandaría progreso y dejar de leer el cuerpo no
+frenaría al cliente. Las vistas y el ORM son síncronos de todos modos.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/topics/settings/
-
-For the full list of settings and their values, see
-https://docs.djangoproject.com/en/4.2/ref/settings/
 """
-
+import sys
 from pathlib import Path
 
-# Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-
-# Quick-start development settings - unsuitable for production
-# See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
-
-# SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-w)qendzdy*z^&v*(zn4@37z6kn+)llmu483^_mw9(y=m^ecbm='
-
-# SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
-
-ALLOWED_HOSTS = []
-
-
-# Application definition
+# Las apps compartidas (dispositivos, usuarios, api) viven en el directorio
+# del proyecto monitoreo
+PROYECTO_DIR = BASE_DIR.parent
+if str(PROYECTO_DIR) not in sys.path:
+    sys.path.insert(0, str(PROYECTO_DIR))
+
+# Misma clave, base de datos y zona horaria que el dashboard
+from monitoreo.settings import (  # noqa: E402
+    ALERTAS_ACTIVAS,
+    ALERTAS_HISTERESIS,
+    ALERTAS_VENTANA_SUPRESION,
+    ALLOWED_HOSTS,
+    ANOMALIAS_ACTIVAS,
+    ANOMALIAS_ALFA,
+    ANOMALIAS_INTERVALO_PUNTO_CONTROL,
+    ANOMALIAS_MIN_LECTURAS,
+    ANOMALIAS_UMBRAL_Z,
+    CACHES,
+    DATABASE_ROUTERS,
+    DATABASES,
+    DEBUG,
+    DEFAULT_AUTO_FIELD,
+    INGESTA_BUFFER_ACTIVO,
+    INGESTA_BUFFER_MAX_ESPERA_MS,
+    INGESTA_BUFFER_MAX_FILAS,
+    INGESTA_LIMITE_ACTIVO,
+    INGESTA_LIMITE_DISPOSITIVO,
+    INGESTA_LIMITE_MAX_ESPERA_FLUJO,
+    INGESTA_LIMITE_ORGANIZACION,
+    LANGUAGE_CODE,
+    LOGGING,
+    REPLICAS_LECTURA,
+    REPLICAS_RETRASO_MAX,
+    SECRET_KEY,
+    TIME_ZONE,
+    USE_I18N,
+    USE_TZ,
+)
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
-    'django.contrib.sessions',
-    'django.contrib.messages',
-    'django.contrib.staticfiles',
+    'usuarios',
+    'dispositivos',
+    'api',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # La API de consulta (@solo_lectura) lee de las réplicas, como el dashboard
+    'dispositivos.replicas.ReplicasMiddleware',
 ]
 
 ROOT_URLCONF = 'ecoapi.urls'
 
-TEMPLATES = [
-    {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
-        'APP_DIRS': True,
-        'OPTIONS': {
-            'context_processors': [
-                'django.template.context_processors.debug',
-                'django.template.context_processors.request',
-                'django.contrib.auth.context_processors.auth',
-                'django.contrib.messages.context_processors.messages',
-            ],
-        },
-    },
-]
+TEMPLATES = []
 
 WSGI_APPLICATION = 'ecoapi.wsgi.application'
 
-
-# Database
-# https://docs.djangoproject.com/en/4.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
-
-
-# Password validation
-# https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
-
-AUTH_PASSWORD_VALIDATORS = [
-    {
-        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
-    },
-    {
-        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
-    },
-    {
-        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
-    },
-    {
-        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
-    },
-]
-
-
-# Internationalization
-# https://docs.djangoproject.com/en/4.2/topics/i18n/
-
-LANGUAGE_CODE = 'en-us'
-
-TIME_ZONE = 'UTC'
-
-USE_I18N = True
-
-USE_TZ = True
-
-
-# Static files (CSS, JavaScript, Images)
-# https://docs.djangoproject.com/en/4.2/howto/static-files/
-
-STATIC_URL = 'static/'
-
-# Default primary key field type
-# https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
-
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+# La ingesta por streaming lee el cuerpo por partes; el resto de peticiones
+# mantiene el mismo límite que el dashboard
+DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
@@ -0,0 +1,6 @@
+"""
+Backend MySQL con pool de conexiones por worker. Se activa con
+ENGINE = "monitoreo.pool_mysql" y OPTIONS["pool"] = {"tamano", "espera",
+"edad_max"}; requiere CONN_MAX_AGE = 0 para que Django devuelva la conexión
+al pool al terminar cada petición.
+"""
@@ -0,0 +1,48 @@
+from functools import partial
+
+from django.db.backends.mysql.base import Database
+from django.db.backends.mysql.base import DatabaseWrapper as MySQLDatabaseWrapper
+
+from .pool import EDAD_MAX, ESPERA, TAMANO, PoolConexiones, obtener_pool
+
+
+def _ping(raw):
+    raw.ping()
+
+
+class DatabaseWrapper(MySQLDatabaseWrapper):
+    """
+    Igual que el backend MySQL de Django, pero abrir la conexión la toma del
+    pool del worker y cerrarla la devuelve.
+    """
+    _pool = None
+    _conexion_pool = None
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # Las opciones del pool no son parámetros de MySQLdb.connect
+        kwargs.pop('pool', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        opciones = self.settings_dict['OPTIONS'].get('pool', {})
+        self._pool = obtener_pool(self.alias, lambda: PoolConexiones(
+            self.alias,
+            partial(MySQLDatabaseWrapper.get_new_connection, self, conn_params),
+            _ping,
+            Database.OperationalError,
+            tamano=opciones.get('tamano', TAMANO),
+            espera=opciones.get('espera', ESPERA),
+            edad_max=opciones.get('edad_max', EDAD_MAX),
+        ))
+        self._conexion_pool = self._pool.obtener()
+        return self._conexion_pool.raw
+
+    def _close(self):
+        conexion, self._conexion_pool = self._conexion_pool, None
+        if conexion is None or conexion.raw is not self.connection:
+            return super()._close()
+        # Solo vuelve al pool una conexión limpia: sin transacción a medias
+        # ni errores de base de datos en esta petición
+        reutilizable = not self.in_atomic_block and self.autocommit and not self.errors_occurred
+        self._pool.devolver(conexion, reutilizable)
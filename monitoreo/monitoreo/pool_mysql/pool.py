@@ -0,0 +1,211 @@
+"""
+Pool de conexiones por worker. Cada proceso guarda, por alias de base de
+datos, hasta `tamano` conexiones abiertas; los hilos las piden al abrir la
+conexión de Django y las devuelven al cerrarla (fin de la petición). Antes de
+reutilizar una conexión se comprueba con un ping y las que superan `edad_max`
+se cierran y se reemplazan.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+TAMANO = 10
+ESPERA = 5
+EDAD_MAX = 600
+CLAVE_CONTADOR = 'pool_bd:{}:{}'
+INTERVALO_VOLCADO = 10
+# Contadores acumulables entre workers (se suman en la caché compartida)
+CONTADORES = (
+    'pedidas', 'reutilizadas', 'creadas', 'esperas', 'espera_ms', 'agotadas',
+    'fallos_conexion', 'fallos_chequeo', 'recicladas', 'descartadas',
+)
+
+
+class _Conexion:
+    __slots__ = ('raw', 'creada')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.creada = time.monotonic()
+
+
+class PoolConexiones:
+    """
+    Conexiones de un alias en el proceso actual. `conectar()` abre una
+    conexión nueva, `chequear(raw)` debe lanzar una excepción si la conexión
+    ya no sirve y `error` es la excepción que se lanza si no hay conexión
+    libre tras `espera` segundos.
+    """
+
+    def __init__(self, alias, conectar, chequear, error, tamano=TAMANO, espera=ESPERA, edad_max=EDAD_MAX):
+        self.alias = alias
+        self.conectar = conectar
+        self.chequear = chequear
+        self.error = error
+        self.tamano = tamano
+        self.espera = espera
+        self.edad_max = edad_max
+        self.pid = os.getpid()
+        self.contadores = Counter()
+        self._condicion = threading.Condition()
+        self._libres = []
+        self._abiertas = 0
+        self._ultimo_volcado = time.monotonic()
+        self._volcados = Counter()
+
+    def obtener(self):
+        """Devuelve una conexión libre y sana, o abre una si hay cupo."""
+        inicio = time.monotonic()
+        limite = inicio + self.espera
+        espero = False
+        while True:
+            with self._condicion:
+                conexion = self._libres.pop() if self._libres else None
+                if conexion is None and self._abiertas >= self.tamano:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self.contadores['agotadas'] += 1
+                        raise self.error(
+                            f'Pool de conexiones {self.alias} agotado: {self.tamano} en uso tras {self.espera}s'
+                        )
+                    if not espero:
+                        espero = True
+                        self.contadores['esperas'] += 1
+                    self._condicion.wait(restante)
+                    continue
+                if conexion is None:
+                    self._abiertas += 1
+                if espero:
+                    self.contadores['espera_ms'] += round((time.monotonic() - inicio) * 1000)
+
+            if conexion is None:
+                try:
+                    conexion = _Conexion(self.conectar())
+                except Exception:
+                    self._liberar_cupo('fallos_conexion')
+                    raise
+                self._contar('pedidas', 'creadas')
+                return conexion
+
+            # El ping y el cierre van fuera del candado: son viajes de red
+            if time.monotonic() - conexion.creada > self.edad_max:
+                self._cerrar(conexion, 'recicladas')
+                continue
+            try:
+                self.chequear(conexion.raw)
+            except Exception as e:
+                logger.warning(f'Conexión del pool {self.alias} descartada al reutilizarla: {str(e)}')
+                self._cerrar(conexion, 'fallos_chequeo')
+                continue
+            self._contar('pedidas', 'reutilizadas')
+            return conexion
+
+    def devolver(self, conexion, reutilizable=True):
+        """Deja la conexión libre para otro hilo, o la cierra si no conviene reutilizarla."""
+        if not reutilizable or os.getpid() != self.pid:
+            self._cerrar(conexion, 'descartadas')
+        elif time.monotonic() - conexion.creada > self.edad_max:
+            self._cerrar(conexion, 'recicladas')
+        else:
+            with self._condicion:
+                self._libres.append(conexion)
+                self._condicion.notify()
+        self._volcar()
+
+    def cerrar_libres(self):
+        with self._condicion:
+            libres, self._libres = self._libres, []
+        for conexion in libres:
+            self._cerrar(conexion, 'descartadas')
+
+    def estado(self):
+        with self._condicion:
+            return {
+                **{nombre: self.contadores[nombre] for nombre in CONTADORES},
+                'tamano': self.tamano,
+                'abiertas': self._abiertas,
+                'libres': len(self._libres),
+                'en_uso': self._abiertas - len(self._libres),
+            }
+
+    def _contar(self, *nombres):
+        with self._condicion:
+            self.contadores.update(nombres)
+
+    def _liberar_cupo(self, contador):
+        with self._condicion:
+            self._abiertas -= 1
+            self.contadores[contador] += 1
+            self._condicion.notify()
+
+    def _cerrar(self, conexion, contador):
+        # Tras un fork la conexión es del proceso padre: cerrarla aquí le
+        # cortaría el socket, así que solo se suelta
+        if os.getpid() == self.pid:
+            try:
+                conexion.raw.close()
+            except Exception:
+                pass
+        self._liberar_cupo(contador)
+
+    def _volcar(self):
+        """Suma los contadores nuevos en la caché compartida, como mucho cada INTERVALO_VOLCADO s."""
+        with self._condicion:
+            if time.monotonic() - self._ultimo_volcado < INTERVALO_VOLCADO:
+                return
+            self._ultimo_volcado = time.monotonic()
+            nuevos = {
+                nombre: self.contadores[nombre] - self._volcados[nombre]
+                for nombre in CONTADORES
+                if self.contadores[nombre] != self._volcados[nombre]
+            }
+            self._volcados.update(nuevos)
+        if not nuevos:
+            return
+        try:
+            from django.core.cache import cache
+            for nombre, cantidad in nuevos.items():
+                clave = CLAVE_CONTADOR.format(self.alias, nombre)
+                cache.add(clave, 0, None)
+                cache.incr(clave, cantidad)
+        except Exception as e:
+            logger.warning(f'No se pudieron guardar las estadísticas del pool {self.alias}: {str(e)}')
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def obtener_pool(alias, crear):
+    """Pool del alias en este proceso; `crear()` lo construye la primera vez."""
+    with _pools_lock:
+        pool = _pools.get(alias)
+        # Tras un fork (gunicorn --preload) cada worker arma su propio pool
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[alias] = crear()
+        return pool
+
+
+def estadisticas():
+    """{alias: estado} de los pools de este proceso."""
+    with _pools_lock:
+        pools = [pool for pool in _pools.values() if pool.pid == os.getpid()]
+    return {pool.alias: pool.estado() for pool in pools}
+
+
+def estadisticas_acumuladas(aliases):
+    """{alias: {contador: valor}} sumados por todos los workers desde el último reinicio."""
+    from django.core.cache import cache
+    return {
+        alias: {nombre: cache.get(CLAVE_CONTADOR.format(alias, nombre), 0) for nombre in CONTADORES}
+        for alias in aliases
+    }
+
+
+def reiniciar_estadisticas(aliases):
+    from django.core.cache import cache
+    cache.delete_many([CLAVE_CONTADOR.format(alias, nombre) for alias in aliases for nombre in CONTADORES])
@@ -0,0 +1,149 @@
+import itertools
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from . import pool as modulo_pool
+from .pool import PoolConexiones, estadisticas_acumuladas, obtener_pool, reiniciar_estadisticas
+
+CACHE_LOCAL = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class ErrorPool(Exception):
+    pass
+
+
+class ConexionFalsa:
+
+    def __init__(self, numero):
+        self.numero = numero
+        self.cerrada = False
+        self.sana = True
+
+    def close(self):
+        self.cerrada = True
+
+
+class PoolConexionesTests(SimpleTestCase):
+    """La lógica del pool con conexiones falsas: no necesita MySQL."""
+
+    def setUp(self):
+        self.numeros = itertools.count(1)
+        self.creadas = []
+        self.reloj = 1000.0
+        parche = mock.patch('monitoreo.pool_mysql.pool.time.monotonic', lambda: self.reloj)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def conectar(self):
+        conexion = ConexionFalsa(next(self.numeros))
+        self.creadas.append(conexion)
+        return conexion
+
+    @staticmethod
+    def chequear(raw):
+        if not raw.sana:
+            raise ErrorPool('se fue el servidor')
+
+    def pool(self, **opciones):
+        return PoolConexiones('default', self.conectar, self.chequear, ErrorPool, **opciones)
+
+    def test_reutiliza_la_conexion_devuelta(self):
+        pool = self.pool()
+        conexion = pool.obtener()
+        pool.devolver(conexion)
+        self.assertIs(pool.obtener().raw, conexion.raw)
+        self.assertEqual(len(self.creadas), 1)
+        estado = pool.estado()
+        self.assertEqual((estado['pedidas'], estado['creadas'], estado['reutilizadas']), (2, 1, 1))
+        self.assertEqual((estado['abiertas'], estado['en_uso']), (1, 1))
+
+    def test_agotado_lanza_el_error_del_backend(self):
+        pool = self.pool(tamano=1, espera=0)
+        pool.obtener()
+        with self.assertRaises(ErrorPool):
+            pool.obtener()
+        self.assertEqual(pool.estado()['agotadas'], 1)
+        self.assertEqual(len(self.creadas), 1)
+
+    def test_espera_a_que_otro_hilo_devuelva(self):
+        pool = self.pool(tamano=1, espera=5)
+        conexion = pool.obtener()
+        obtenidas = []
+        hilo = threading.Thread(target=lambda: obtenidas.append(pool.obtener()))
+        hilo.start()
+        # El hilo queda esperando hasta que haya una libre
+        while not pool.estado()['esperas']:
+            hilo.join(0.01)
+        pool.devolver(conexion)
+        hilo.join(5)
+        self.assertIs(obtenidas[0].raw, conexion.raw)
+        self.assertEqual(len(self.creadas), 1)
+
+    def test_descarta_la_que_falla_el_ping(self):
+        pool = self.pool()
+        conexion = pool.obtener()
+        pool.devolver(conexion)
+        conexion.raw.sana = False
+        nueva = pool.obtener()
+        self.assertIsNot(nueva.raw, conexion.raw)
+        self.assertTrue(conexion.raw.cerrada)
+        estado = pool.estado()
+        self.assertEqual((estado['fallos_chequeo'], estado['abiertas']), (1, 1))
+
+    def test_recicla_las_viejas(self):
+        pool = self.pool(edad_max=60)
+        conexion = pool.obtener()
+        pool.devolver(conexion)
+        self.reloj += 61
+        self.assertIsNot(pool.obtener().raw, conexion.raw)
+        self.assertTrue(conexion.raw.cerrada)
+        self.assertEqual(pool.estado()['recicladas'], 1)
+
+    def test_no_reutilizable_se_cierra_y_libera_el_cupo(self):
+        pool = self.pool(tamano=1, espera=0)
+        conexion = pool.obtener()
+        pool.devolver(conexion, reutilizable=False)
+        self.assertTrue(conexion.raw.cerrada)
+        self.assertIsNot(pool.obtener().raw, conexion.raw)
+        self.assertEqual(pool.estado()['descartadas'], 1)
+
+    def test_fallo_al_conectar_libera_el_cupo(self):
+        pool = self.pool(tamano=1, espera=0)
+        with mock.patch.object(pool, 'conectar', side_effect=ErrorPool('sin servidor')):
+            with self.assertRaises(ErrorPool):
+                pool.obtener()
+        self.assertEqual(pool.estado()['fallos_conexion'], 1)
+        self.assertIsNotNone(pool.obtener())
+
+    def test_tras_un_fork_no_cierra_las_del_padre(self):
+        pool = self.pool()
+        conexion = pool.obtener()
+        with mock.patch('monitoreo.pool_mysql.pool.os.getpid', return_value=pool.pid + 1):
+            pool.devolver(conexion)
+            self.assertFalse(conexion.raw.cerrada)
+            self.assertEqual(pool.estado()['libres'], 0)
+
+    def test_obtener_pool_uno_por_alias_y_proceso(self):
+        self.addCleanup(modulo_pool._pools.clear)
+        crear = lambda: self.pool()
+        pool = obtener_pool('default', crear)
+        self.assertIs(obtener_pool('default', crear), pool)
+        with mock.patch('monitoreo.pool_mysql.pool.os.getpid', return_value=pool.pid + 1):
+            self.assertIsNot(obtener_pool('default', crear), pool)
+
+    @override_settings(CACHES=CACHE_LOCAL)
+    def test_vuelca_los_contadores_en_la_cache(self):
+        cache.clear()
+        self.addCleanup(reiniciar_estadisticas, ['default'])
+        pool = self.pool()
+        pool.devolver(pool.obtener())
+        # Antes del intervalo no se escribe en la caché
+        self.assertEqual(estadisticas_acumuladas(['default'])['default']['pedidas'], 0)
+        self.reloj += modulo_pool.INTERVALO_VOLCADO
+        pool.devolver(pool.obtener())
+        pool.devolver(pool.obtener())
+        acumuladas = estadisticas_acumuladas(['default'])['default']
+        self.assertEqual((acumuladas['pedidas'], acumuladas['reutilizadas']), (2, 1))
@@ -93,6 +93,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'dispositivos.replicas.ReplicasMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -150,6 +151,15 @@ try:
                 })(),
             }
         }
+        # Pool de conexiones por worker (monitoreo.pool_mysql): evita abrir
+        # una conexión TLS nueva en cada petición. DB_POOL_TAMANO=0 lo desactiva.
+        if int(os.getenv("DB_POOL_TAMANO", "10")) > 0:
+            DATABASES["default"]["ENGINE"] = "monitoreo.pool_mysql"
+            DATABASES["default"]["OPTIONS"]["pool"] = {
+                "tamano": int(os.getenv("DB_POOL_TAMANO", "10")),
+                "espera": float(os.getenv("DB_POOL_ESPERA", "5")),
+                "edad_max": float(os.getenv("DB_POOL_EDAD_MAX", "600")),
+            }
     else:  # SQLite por defecto
         DATABASES = {
             "default": {
@@ -161,6 +171,23 @@ except Exception as e:
     print(f"Database configuration error: {e}")
     raise
 
+# Réplicas de lectura (MySQL): DB_REPLICAS=host1[:puerto],host2[:puerto].
+# Las vistas de solo lectura las usan; ver dispositivos.replicas.
+REPLICAS_LECTURA = []
+if ENGINE == "mysql":
+    for i, servidor in enumerate(filter(None, os.getenv("DB_REPLICAS", "").split(",")), 1):
+        host, _, puerto = servidor.strip().partition(":")
+        DATABASES[f"replica{i}"] = {
+            **DATABASES["default"],
+            "HOST": host,
+            "PORT": puerto or DATABASES["default"]["PORT"],
+            "TEST": {"MIRROR": "default"},
+        }
+        REPLICAS_LECTURA.append(f"replica{i}")
+DATABASE_ROUTERS = ["dispositivos.replicas.RouterReplicas"] if REPLICAS_LECTURA else []
+# Segundos que un usuario lee de la primaria después de escribir
+REPLICAS_RETRASO_MAX = float(os.getenv("REPLICAS_RETRASO_MAX", "5"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -301,6 +328,59 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
 FILE_UPLOAD_PERMISSIONS = 0o644
 
+# Archivo frío de mediciones por dispositivo y mes (comando archivar_mediciones)
+ARCHIVO_MEDICIONES_DIR = os.getenv('ARCHIVO_MEDICIONES_DIR', str(BASE_DIR / 'archivo'))
+
+# Buffer de escritura de mediciones: agrupa los INSERT de peticiones
+# concurrentes del mismo worker en un solo bulk_create (útil con gthread)
+INGESTA_BUFFER_ACTIVO = os.getenv('INGESTA_BUFFER_ACTIVO', 'False') == 'True'
+INGESTA_BUFFER_MAX_FILAS = int(os.getenv('INGESTA_BUFFER_MAX_FILAS', '500'))
+INGESTA_BUFFER_MAX_ESPERA_MS = float(os.getenv('INGESTA_BUFFER_MAX_ESPERA_MS', '5'))
+
+# Motor de alertas: evalúa las reglas en cada lote de ingesta (dispositivos.alertas)
+ALERTAS_ACTIVAS = os.getenv('ALERTAS_ACTIVAS', 'True') == 'True'
+# Un episodio de alerta se cierra cuando el consumo baja de su umbral más bajo
+# menos esta fracción, y se reabre si vuelve a dispararse dentro de la ventana
+ALERTAS_HISTERESIS = float(os.getenv('ALERTAS_HISTERESIS', '0.1'))
+ALERTAS_VENTANA_SUPRESION = int(os.getenv('ALERTAS_VENTANA_SUPRESION', '15'))  # minutos
+# Detector de anomalías (dispositivos.anomalias): alerta cuando una lectura se
+# aleja más de ANOMALIAS_UMBRAL_Z desvíos de la media exponencial del dispositivo
+ANOMALIAS_ACTIVAS = os.getenv('ANOMALIAS_ACTIVAS', 'True') == 'True'
+ANOMALIAS_ALFA = float(os.getenv('ANOMALIAS_ALFA', '0.05'))
+ANOMALIAS_UMBRAL_Z = float(os.getenv('ANOMALIAS_UMBRAL_Z', '4'))
+ANOMALIAS_MIN_LECTURAS = int(os.getenv('ANOMALIAS_MIN_LECTURAS', '30'))
+ANOMALIAS_INTERVALO_PUNTO_CONTROL = int(os.getenv('ANOMALIAS_INTERVALO_PUNTO_CONTROL', '60'))  # segundos
+
+# Caché compartida entre workers (estado del límite de ingesta). Con REDIS_URL
+# se usa Redis; si no, una caché en disco compartida por los workers del host.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', str(BASE_DIR / '.cache')),
+        }
+    }
+
+# Límite de ingesta (token bucket): lecturas por segundo y ráfaga máxima
+INGESTA_LIMITE_ACTIVO = os.getenv('INGESTA_LIMITE_ACTIVO', 'True') == 'True'
+INGESTA_LIMITE_DISPOSITIVO = {
+    'TASA': float(os.getenv('INGESTA_LIMITE_DISPOSITIVO_TASA', '10')),
+    'RAFAGA': float(os.getenv('INGESTA_LIMITE_DISPOSITIVO_RAFAGA', '3600')),
+}
+INGESTA_LIMITE_ORGANIZACION = {
+    'TASA': float(os.getenv('INGESTA_LIMITE_ORGANIZACION_TASA', '1000')),
+    'RAFAGA': float(os.getenv('INGESTA_LIMITE_ORGANIZACION_RAFAGA', '50000')),
+}
+# Espera máxima de la ingesta por streaming antes de abortar por el límite
+INGESTA_LIMITE_MAX_ESPERA_FLUJO = float(os.getenv('INGESTA_LIMITE_MAX_ESPERA_FLUJO', '30'))
+
 # Session settings
 SESSION_COOKIE_AGE = 3600  # 1 hour
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True